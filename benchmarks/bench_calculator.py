@@ -0,0 +1,125 @@
+"""合成データでDataProcessor.combine_df、BlankTable、GPUUsageCalculatorの各集計を計測する
+
+    python -m benchmarks.bench_calculator --sizes 100000 1000000 --output calculator.json
+
+処理ごとの実行時間と、処理中のRSSの最大増加量をJSONで出力する。
+バージョン間で同じコマンドを実行して結果を比較すれば、集計処理の性能の劣化を検出できる。
+"""
+import argparse
+import datetime as dt
+import json
+import platform
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import polars as pl
+import psutil
+from easydict import EasyDict
+
+from benchmarks.synthetic_data import make_dataset
+from src.calculator.allocation_calendar import load_calendar
+from src.calculator.blank_table import BlankTable
+from src.calculator.gpu_usage_calculator import GPUUsageCalculator
+from src.uploader.data_processor import DataProcessor
+from src.utils.config import CONFIG
+
+AGG_METHODS = ["agg_host_overlap", "agg_overall", "agg_monthly", "agg_weekly", "agg_daily", "agg_summary"]
+
+class PeakRssSampler:
+    """別スレッドで一定間隔ごとにRSSを読み、最大値を記録する（polarsのメモリはtracemallocでは見えないため）"""
+
+    def __init__(self, interval_sec: float = 0.005):
+        self.process = psutil.Process()
+        self.interval_sec = interval_sec
+
+    def __enter__(self):
+        self.start_rss = self.process.memory_info().rss
+        self.peak_rss = self.start_rss
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __sample(self):
+        while not self.stopped.wait(self.interval_sec):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+@contextmanager
+def measure(results: list, n_rows: int, step: str):
+    with PeakRssSampler() as sampler:
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+    result = {
+        "rows": n_rows,
+        "step": step,
+        "wall_sec": round(elapsed, 4),
+        "peak_rss_delta_mb": round((sampler.peak_rss - sampler.start_rss) / 1024 ** 2, 1),
+    }
+    results.append(result)
+    print(json.dumps(result))
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def run_benchmark(n_rows: int, end_date: dt.date, sketch_ratio: float) -> list:
+    results = []
+    all_runs_df, companies = make_dataset(n_rows, end_date=end_date, sketch_ratio=sketch_ratio)
+    # 合成データに対応する企業の設定に差し替える
+    CONFIG.companies = EasyDict({"companies": companies}).companies
+    date_range = [end_date.strftime("%Y-%m-%d")] * 2
+
+    new_runs_df = all_runs_df.filter(pl.col("date") >= end_date - dt.timedelta(days=1))
+    old_runs_df = all_runs_df.filter(pl.col("date") < end_date - dt.timedelta(days=1))
+    with measure(results, n_rows, "combine_df"):
+        all_runs_df = DataProcessor.combine_df(new_runs_df=new_runs_df, old_runs_df=old_runs_df)
+    del new_runs_df, old_runs_df
+
+    load_calendar.cache_clear()
+    with measure(results, n_rows, "blank_table"):
+        BlankTable(end_date)
+
+    calculator = GPUUsageCalculator(all_runs_df, date_range)
+    for method in AGG_METHODS:
+        with measure(results, n_rows, method):
+            getattr(calculator, method)()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the aggregation on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000], help="Numbers of rows (e.g. 100000 1000000 10000000)")
+    parser.add_argument("--end-date", type=str, default="2025-03-31")
+    # 新しいデータには常にスケッチがあるため、既定ではすべての行に付与する（スケッチ導入前の履歴を模すときだけ下げる）
+    parser.add_argument("--sketch-ratio", type=float, default=1.0, help="Ratio of rows that carry a utilization sketch (lower it only to model history from before sketches)")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    end_date = dt.datetime.strptime(args.end_date, "%Y-%m-%d").date()
+    results = []
+    for n_rows in args.sizes:
+        results += run_benchmark(n_rows, end_date, args.sketch_ratio)
+
+    report = {
+        "revision": git_revision(),
+        "created_at": dt.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "sketch_ratio": args.sketch_ratio,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
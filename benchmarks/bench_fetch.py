@@ -0,0 +1,80 @@
+"""ローカルの偽W&Bサーバーに対してRunManager.fetch_runsを実行し、スループットを計測する
+
+    python -m benchmarks.bench_fetch --runs-per-project 50 --latency-ms 20 --output fetch.json
+
+runs/sec、run当たりのリクエスト数・受信バイト数、ピークRSSをJSONで出力する。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import urllib.request
+from dataclasses import asdict
+
+from benchmarks.fake_wandb_server import FakeDataParams, serve
+
+def start_server(params: FakeDataParams):
+    """別プロセスでサーバーを起動し、(プロセス, URL)を返す（サーバーのメモリをRSSに含めないため）"""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=serve, args=(params, 0, sender), daemon=True)
+    process.start()
+    port = receiver.recv()
+    return process, f"http://127.0.0.1:{port}"
+
+def server_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.loads(response.read())
+
+def run_benchmark(params: FakeDataParams) -> dict:
+    process, base_url = start_server(params)
+    try:
+        os.environ["WANDB_BASE_URL"] = base_url
+        os.environ["WANDB_API_KEY"] = "x" * 40
+        # CONFIGやwandbの設定を環境変数の後に読み込ませる
+        from src.tracker.run_manager import RunManager
+        from src.utils.config import CONFIG
+
+        # 偽のプロジェクトの取得記録で本来の見積もり用の記録を上書きしないようにする
+        CONFIG.cache_dir = tempfile.mkdtemp()
+        start = time.perf_counter()
+        run_manager = RunManager([params.start_date, params.end_date])
+        runs_df = run_manager.fetch_runs()
+        elapsed = time.perf_counter() - start
+
+        stats = server_stats(base_url)
+        n_runs = max(run_manager.total_valid_runs, 1)
+        return {
+            "params": asdict(params),
+            "elapsed_sec": round(elapsed, 3),
+            "valid_runs": run_manager.total_valid_runs,
+            "rows": len(runs_df),
+            "runs_per_sec": round(run_manager.total_valid_runs / elapsed, 2),
+            "requests_per_run": round(stats["total_requests"] / n_runs, 2),
+            "bytes_per_run": round(stats["bytes_sent"] / n_runs),
+            # Linuxのru_maxrssはKB単位
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "server": stats,
+        }
+    finally:
+        process.terminate()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RunManager.fetch_runs against a local fake W&B server")
+    for name, default in asdict(FakeDataParams()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    parser.add_argument("--output", type=str, help="Write the result as JSON to this path")
+    args = parser.parse_args()
+    params = FakeDataParams(**{name: getattr(args, name) for name in asdict(FakeDataParams())})
+
+    result = run_benchmark(params)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""エントリポイントのコールドスタート時間（新しいプロセスでの読み込みにかかる時間）を計測する
+
+    python -m benchmarks.bench_startup --repeat 5 --output startup.json
+
+エントリポイントごとに新しいPythonプロセスを起動して時間を計り、中央値を出力する。
+-X importtime の結果から、読み込みに時間のかかっているモジュールの上位も記録する。
+"""
+import argparse
+import datetime as dt
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+# (名前, 実行する引数)
+ENTRYPOINTS = [
+    ("main --help", ["main.py", "--help"]),
+    ("query --help", ["query.py", "--help"]),
+    ("import check_dashboard", ["-c", "import src.alart.check_dashboard"]),
+    ("import config", ["-c", "from src.utils.config import get_companies; get_companies()"]),
+    ("import gpu_usage_calculator", ["-c", "import src.calculator.gpu_usage_calculator"]),
+]
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=REPO_ROOT).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def slowest_imports(importtime_log: str, top: int) -> list:
+    """-X importtime の出力から、累積時間の長いモジュールを返す"""
+    modules = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "cumulative_ms": round(int(cumulative) / 1000, 1)})
+    return sorted(modules, key=lambda m: m["cumulative_ms"], reverse=True)[:top]
+
+def measure(args: list, repeat: int, top: int) -> dict:
+    wall_secs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=REPO_ROOT, capture_output=True, check=True)
+        wall_secs.append(time.perf_counter() - start)
+    profile = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    return {
+        "median_sec": round(statistics.median(wall_secs), 3),
+        "min_sec": round(min(wall_secs), 3),
+        "slowest_imports": slowest_imports(profile.stderr, top),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold-start time of the entrypoints")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh processes per entrypoint")
+    parser.add_argument("--top", type=int, default=5, help="Number of slowest imports to record")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = {}
+    for name, entry_args in ENTRYPOINTS:
+        results[name] = measure(entry_args, args.repeat, args.top)
+        print(f"{name}: {results[name]['median_sec']}s")
+
+    report = {
+        "revision": git_revision(),
+        "created_at": dt.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""RunManagerが使うW&BのGraphQLエンドポイントを模したローカルサーバー
+
+ログインユーザー(Viewer)、プロジェクト一覧(Projects)、runの一覧(GetGpuInfoForProject、期間のfiltersも解釈する)、runの取得(Run)、
+システムメトリクスの取得(RunFullHistory)だけを実装する。データはパラメータから決定的に生成するため、
+同じパラメータなら何度実行しても同じレスポンスになる。
+WANDB_BASE_URL にこのサーバーのURLを指定すれば、wandb.Api()はこのサーバーに問い合わせる。
+"""
+import argparse
+import datetime as dt
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GPU_NAME = "NVIDIA H100 80GB HBM3"
+
+@dataclass
+class FakeDataParams:
+    projects_per_team: int = 3
+    runs_per_project: int = 20
+    samples_per_run: int = 100
+    gpus_per_run: int = 8
+    hosts_per_team: int = 8
+    start_date: str = "2025-03-01"
+    end_date: str = "2025-03-07"
+    # 1リクエストごとの遅延（ミリ秒）と、500エラーを返す確率
+    latency_ms: float = 0.0
+    error_rate: float = 0.0
+
+def rng_for(*keys) -> random.Random:
+    """キーから決定的な乱数生成器を作る"""
+    return random.Random(zlib.crc32("/".join(map(str, keys)).encode("utf-8")))
+
+def to_iso(value: dt.datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def matches_filters(node: dict, filters: dict) -> bool:
+    """runsのfiltersのうち、$and/$orと日時・文字列の比較だけを解釈する"""
+    if "$and" in filters:
+        return all(matches_filters(node, f) for f in filters["$and"])
+    if "$or" in filters:
+        return any(matches_filters(node, f) for f in filters["$or"])
+    for key, condition in filters.items():
+        value = node.get(key)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for op, operand in condition.items():
+            if key.endswith("At"):
+                value_at = dt.datetime.fromisoformat(value.rstrip("Z"))
+                operand_at = dt.datetime.fromisoformat(operand.rstrip("Z"))
+                compare = {"$gt": value_at > operand_at, "$gte": value_at >= operand_at, "$lt": value_at < operand_at, "$lte": value_at <= operand_at}
+            else:
+                compare = {"$eq": value == operand, "$ne": value != operand}
+            if not compare.get(op, True):
+                return False
+    return True
+
+class FakeWandbData:
+    def __init__(self, params: FakeDataParams):
+        self.params = params
+        self.start = dt.datetime.strptime(params.start_date, "%Y-%m-%d")
+        self.end = dt.datetime.strptime(params.end_date, "%Y-%m-%d") + dt.timedelta(days=1)
+
+    def project_names(self, entity: str) -> list:
+        # stockmarkはinclude_project_patternで"gpu-info"だけを対象にしているため、最初のプロジェクトをその名前にする
+        return ["gpu-info"] + [f"project-{i}" for i in range(1, self.params.projects_per_team)]
+
+    def run_span(self, entity: str, project: str, index: int) -> tuple:
+        rng = rng_for(entity, project, index)
+        period_hours = (self.end - self.start).total_seconds() / 3600
+        created_at = self.start + dt.timedelta(hours=rng.uniform(0, period_hours - 1))
+        heartbeat_at = min(created_at + dt.timedelta(hours=rng.uniform(0.5, 48)), self.end)
+        return created_at, heartbeat_at
+
+    def run_node(self, entity: str, project: str, index: int) -> dict:
+        created_at, heartbeat_at = self.run_span(entity, project, index)
+        return {
+            "name": f"run-{index}",
+            "createdAt": to_iso(created_at),
+            "updatedAt": to_iso(heartbeat_at),
+            "heartbeatAt": to_iso(heartbeat_at),
+            "state": "finished",
+            "tags": [],
+            "host": f"{entity}-host-{index % self.params.hosts_per_team}",
+            "runInfo": {"gpuCount": self.params.gpus_per_run, "gpu": GPU_NAME},
+            "config": "{}",
+        }
+
+    def run_detail(self, entity: str, project: str, name: str) -> dict:
+        index = int(name.rsplit("-", 1)[-1])
+        node = self.run_node(entity, project, index)
+        return {
+            "id": f"{entity}:{project}:{name}",
+            "tags": node["tags"],
+            "name": name,
+            "displayName": name,
+            "sweepName": None,
+            "state": node["state"],
+            "config": node["config"],
+            "group": None,
+            "jobType": None,
+            "commit": None,
+            "readOnly": False,
+            "createdAt": node["createdAt"],
+            "heartbeatAt": node["heartbeatAt"],
+            "description": None,
+            "notes": None,
+            "systemMetrics": "{}",
+            "summaryMetrics": "{}",
+            "historyLineCount": 0,
+            "user": None,
+            "historyKeys": None,
+        }
+
+    def events(self, entity: str, project: str, name: str, samples: int) -> list:
+        index = int(name.rsplit("-", 1)[-1])
+        created_at, heartbeat_at = self.run_span(entity, project, index)
+        rng = rng_for(entity, project, index, "events")
+        n_samples = min(samples, self.params.samples_per_run)
+        # wandbと同じくUTCのepoch秒をタイムスタンプにする
+        start = created_at.replace(tzinfo=dt.timezone.utc).timestamp()
+        step = (heartbeat_at - created_at).total_seconds() / max(n_samples - 1, 1)
+        lines = []
+        for i in range(n_samples):
+            event = {"_timestamp": start + i * step, "_runtime": i * step}
+            for gpu in range(self.params.gpus_per_run):
+                event[f"system.gpu.{gpu}.gpu"] = round(rng.uniform(0, 100), 2)
+                event[f"system.gpu.{gpu}.memory"] = round(rng.uniform(0, 100), 2)
+            lines.append(json.dumps(event))
+        return lines
+
+    def resolve(self, query: str, variables: dict) -> dict:
+        """クエリの種類ごとにレスポンスのdataを作る"""
+        if "query Viewer" in query:
+            return {
+                "viewer": {
+                    "id": "viewer",
+                    "entity": "benchmark",
+                    "flags": "{}",
+                    "username": "benchmark",
+                    "email": None,
+                    "admin": False,
+                    "apiKeys": {"edges": []},
+                    "teams": {"edges": []},
+                }
+            }
+        if "query Projects" in query:
+            names = self.project_names(variables["entity"])
+            offset = int(variables.get("cursor") or 0)
+            per_page = variables.get("perPage") or 50
+            page = names[offset:offset + per_page]
+            return {
+                "models": {
+                    "edges": [
+                        {
+                            "node": {"id": name, "name": name, "entityName": variables["entity"], "createdAt": "2024-10-25T00:00:00", "isBenchmark": False},
+                            "cursor": str(offset + i + 1),
+                        }
+                        for i, name in enumerate(page)
+                    ],
+                    "pageInfo": {"endCursor": str(offset + len(page)), "hasNextPage": offset + len(page) < len(names)},
+                }
+            }
+        if "query GetGpuInfoForProject" in query or "query GetActiveRunsForProject" in query:
+            entity, project = variables["entity"], variables["project"]
+            offset = int(variables.get("cursor") or 0)
+            filters = json.loads(variables["filters"]) if variables.get("filters") else {}
+            # カーソルはフィルタ後の位置とする
+            matched = [
+                node for node in (self.run_node(entity, project, i) for i in range(self.params.runs_per_project))
+                if matches_filters(node, filters)
+            ]
+            nodes = matched[offset:offset + variables["first"]]
+            if "systemMetrics" in query:
+                # 最新のシステムメトリクスとして最後のサンプルを、eventsTailとして末尾の10行を返す
+                for node in nodes:
+                    lines = self.events(entity, project, node["name"], self.params.samples_per_run)
+                    node["systemMetrics"] = lines[-1]
+                    node["eventsTail"] = json.dumps(lines[-10:])
+            return {
+                "project": {
+                    "name": project,
+                    "runs": {
+                        "edges": [{"cursor": str(offset + i + 1), "node": node} for i, node in enumerate(nodes)]
+                    },
+                }
+            }
+        if "query RunFullHistory" in query:
+            stream = "events" if "events(samples" in query else "history"
+            lines = self.events(variables["entity"], variables["project"], variables["name"], variables.get("samples") or 500)
+            return {"project": {"run": {stream: lines if stream == "events" else []}}}
+        if "query Run(" in query:
+            return {"project": {"run": self.run_detail(variables["entity"], variables["project"], variables["name"])}}
+        return None
+
+class RequestStats:
+    """リクエスト数と送信バイト数を操作ごとに数える"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes_sent = 0
+            self.errors_injected = 0
+
+    def add(self, operation: str, n_bytes: int, error: bool = False):
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+            self.bytes_sent += n_bytes
+            self.errors_injected += int(error)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "total_requests": sum(self.requests.values()),
+                "bytes_sent": self.bytes_sent,
+                "errors_injected": self.errors_injected,
+            }
+
+def make_handler(data: FakeWandbData, stats: RequestStats):
+    error_rng = random.Random(0)
+    error_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status: int, body: dict) -> int:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return len(payload)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.send_json(200, stats.to_dict())
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/reset":
+                stats.reset()
+                self.send_json(200, {})
+                return
+            query = body.get("query", "")
+            match = re.search(r"query\s+(\w+)", query)
+            operation = match.group(1) if match else "unknown"
+            if data.params.latency_ms:
+                time.sleep(data.params.latency_ms / 1000)
+            with error_lock:
+                inject_error = error_rng.random() < data.params.error_rate
+            if inject_error:
+                stats.add(operation, self.send_json(500, {"errors": [{"message": "injected error"}]}), error=True)
+                return
+            result = data.resolve(query, body.get("variables") or {})
+            if result is None:
+                stats.add(operation, self.send_json(200, {"errors": [{"message": f"unsupported operation: {operation}"}]}))
+                return
+            stats.add(operation, self.send_json(200, {"data": result}))
+
+    return Handler
+
+def serve(params: FakeDataParams, port: int = 0, ready=None) -> None:
+    """サーバーを起動する（readyにはポート番号を送る）"""
+    stats = RequestStats()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(FakeWandbData(params), stats))
+    server.daemon_threads = True
+    if ready is not None:
+        ready.send(server.server_address[1])
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in of the W&B GraphQL API")
+    parser.add_argument("--port", type=int, default=8765)
+    for name, default in asdict(FakeDataParams()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+    params = FakeDataParams(**{name: getattr(args, name) for name in asdict(FakeDataParams())})
+    print(f"Serving fake W&B API on http://127.0.0.1:{args.port} with {params}")
+    serve(params, args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""ベンチマーク用に、all_runs_dfと同じ形式のデータと、それに対応するcompaniesの設定を生成する
+
+runごとに開始日時・日数・ホスト・GPU数などを決め、run×日の行に展開する。
+numpyでまとめて生成するため、1000万行でも数十秒で作れる。
+"""
+import datetime as dt
+import json
+from typing import List, Tuple
+
+import numpy as np
+import polars as pl
+
+from src.utils.quantile_sketch import build_sketches
+
+# 1runあたりの日数の平均が3日になるように、1〜5日から一様に選ぶ
+MAX_DAYS_PER_RUN = 5
+N_SKETCH_VARIANTS = 64
+
+def make_companies(n_companies: int, start_date: dt.date, end_date: dt.date, seed: int = 0) -> List[dict]:
+    """config.yamlのcompaniesと同じ形式のスケジュールを生成する（途中で割り当てノード数が1回変わる）"""
+    rng = np.random.default_rng(seed)
+    n_days = (end_date - start_date).days
+    companies = []
+    for i in range(n_companies):
+        change_date = start_date + dt.timedelta(days=int(rng.integers(1, max(n_days, 2))))
+        companies.append(
+            {
+                "company": f"company{i:03d}-geniac",
+                "teams": [f"company{i:03d}-geniac"],
+                "schedule": [
+                    {"date": start_date.strftime("%Y-%m-%d"), "assigned_gpu_node": int(rng.integers(1, 32))},
+                    {"date": change_date.strftime("%Y-%m-%d"), "assigned_gpu_node": int(rng.integers(1, 32))},
+                ],
+            }
+        )
+    return companies
+
+def make_sketch_pool(n_variants: int, seed: int = 0) -> List[str]:
+    """GPU使用率スケッチのシリアライズ済み文字列をいくつか作っておく（行ごとに作ると遅いため使い回す）"""
+    rng = np.random.default_rng(seed)
+    n_samples = 100
+    samples = pl.DataFrame(
+        {
+            "variant": np.repeat(np.arange(n_variants), 8 * n_samples),
+            "gpu": np.tile(np.repeat(np.arange(8), n_samples), n_variants),
+            "value": rng.choice([0.0, 0.0, 5.0, 30.0, 60.0, 90.0, 100.0], 8 * n_samples * n_variants),
+        }
+    )
+    return build_sketches(samples, ["variant"], "gpu", "value").sort("variant")["sketch"].to_list()
+
+def make_all_runs_df(
+    n_rows: int,
+    companies: List[dict],
+    start_date: dt.date,
+    end_date: dt.date,
+    projects_per_team: int = 10,
+    hosts_per_team: int = 32,
+    sketch_ratio: float = 1.0,
+    seed: int = 0,
+) -> pl.DataFrame:
+    """約n_rows行のrun×日のデータを生成する
+
+    スケッチは1行あたり1KB以上あるため、sketch_ratioで付与する行の割合を下げればメモリを抑えられる。
+    """
+    rng = np.random.default_rng(seed)
+    n_runs = max(n_rows // ((1 + MAX_DAYS_PER_RUN) // 2), 1)
+    n_days = (end_date - start_date).days + 1
+    teams = np.array([team for c in companies for team in c["teams"]])
+    sketch_pool = make_sketch_pool(N_SKETCH_VARIANTS, seed)
+
+    start_hour = rng.integers(0, n_days * 24, n_runs)
+    span_days = rng.integers(1, MAX_DAYS_PER_RUN + 1, n_runs)
+    created_at = np.datetime64(start_date, "h") + start_hour.astype("timedelta64[h]")
+    # 最終日の開始時刻から、span_days日目のどこかまで
+    updated_at = created_at + (span_days * 24 - rng.integers(1, 24, n_runs)).astype("timedelta64[h]")
+    updated_at = np.minimum(updated_at, np.datetime64(end_date + dt.timedelta(days=1), "h"))
+
+    runs = pl.DataFrame(
+        {
+            "company_name": teams[rng.integers(0, len(teams), n_runs)],
+            "project": np.char.add("project", rng.integers(0, projects_per_team, n_runs).astype(str)),
+            "run_id": np.char.add("run", np.arange(n_runs).astype(str)),
+            "created_at": created_at.astype("datetime64[us]"),
+            "updated_at": updated_at.astype("datetime64[us]"),
+            "gpu_count": rng.choice([1, 8, 8, 8, 16, 64], n_runs),
+            "host_index": rng.integers(0, hosts_per_team, n_runs),
+            "is_other": rng.random(n_runs) < 0.02,
+        }
+    )
+    df = (
+        runs.with_columns(
+            pl.date_ranges(pl.col("created_at").dt.date(), pl.col("updated_at").dt.date(), "1d").alias("date")
+        )
+        .explode("date")
+        .head(n_rows)
+    )
+    n = len(df)
+    day_start = pl.col("date").cast(pl.Datetime("us"))
+    return df.select(
+        pl.col("date"),
+        pl.col("company_name"),
+        pl.col("project"),
+        pl.col("run_id"),
+        pl.when(pl.col("is_other")).then(pl.lit(json.dumps(["other_gpu"]))).otherwise(pl.lit("[]")).alias("tags"),
+        pl.col("created_at"),
+        pl.col("updated_at"),
+        pl.lit("finished").alias("state"),
+        (
+            (pl.min_horizontal(pl.col("updated_at"), day_start + pl.duration(days=1)) - pl.max_horizontal(pl.col("created_at"), day_start))
+            .dt.total_seconds() / 3600
+        ).alias("duration_hour"),
+        pl.col("gpu_count").cast(pl.Int64),
+        pl.Series("average_gpu_utilization", rng.uniform(0, 100, n)),
+        pl.Series("average_gpu_memory", rng.uniform(0, 100, n)),
+        pl.Series("max_gpu_utilization", rng.uniform(50, 100, n)),
+        pl.Series("max_gpu_memory", rng.uniform(50, 100, n)),
+        pl.concat_str(pl.col("company_name"), pl.lit("-host"), pl.col("host_index").cast(pl.Utf8)).alias("host_name"),
+        pl.lit(dt.datetime.combine(end_date, dt.time(23))).cast(pl.Datetime("us")).alias("logged_at"),
+        pl.when(pl.Series(rng.random(n) < sketch_ratio))
+        .then(
+            pl.Series("sketch_index", rng.integers(0, len(sketch_pool), n)).replace(
+                list(range(len(sketch_pool))), sketch_pool, return_dtype=pl.Utf8
+            )
+        )
+        .otherwise(pl.lit(None, dtype=pl.Utf8))
+        .alias("gpu_utilization_sketch"),
+    ).with_columns(
+        # 記録が途切れていた時間の分だけ、稼働時間は経過時間より短くなる
+        (pl.col("duration_hour") * pl.Series(rng.uniform(0.6, 1.0, n))).alias("active_hour"),
+    )
+
+def make_dataset(
+    n_rows: int,
+    n_companies: int = 17,
+    end_date: dt.date = dt.date(2025, 3, 31),
+    n_days: int = 365,
+    sketch_ratio: float = 1.0,
+    seed: int = 0,
+) -> Tuple[pl.DataFrame, List[dict]]:
+    """データとcompaniesの設定の組を生成する"""
+    start_date = end_date - dt.timedelta(days=n_days - 1)
+    companies = make_companies(n_companies, start_date, end_date, seed)
+    all_runs_df = make_all_runs_df(n_rows, companies, start_date, end_date, sketch_ratio=sketch_ratio, seed=seed)
+    return all_runs_df, companies
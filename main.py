@@ -2,12 +2,13 @@ import argparse
 import datetime as dt
 import os
 import pytz
+from pathlib import Path
 
-from src.tracker.run_manager import RunManager
-from src.uploader.run_uploader import RunUploader
 from src.utils.config import CONFIG
-from src.calculator.remove_tags import remove_latest_tags
-from src.calculator.gpu_usage_calculator import GPUUsageCalculator
+from src.utils.log import setup_logging
+from src.utils.tracing import TRACER
+
+# wandb、pandas、polarsを読み込むモジュールは、実行するモードが決まってから読み込む（--helpや引数の検証を待たせないため）
 
 def validate_dates(start_date, end_date):
     # 今日の日付を取得
@@ -46,41 +47,185 @@ def main():
     parser.add_argument("--api", type=str, help="Weights & Biases API Key")
     parser.add_argument("--start-date", type=str, help="Start date for data fetch (YYYY-MM-DD)")
     parser.add_argument("--end-date", type=str, help="End date for data fetch (YYYY-MM-DD)")
+    parser.add_argument("--intraday", action="store_true", help="Run as a daemon that polls running runs and updates hourly tables")
+    parser.add_argument("--backfill", action="store_true", help="Split the date range into windows and fetch them in parallel processes")
+    parser.add_argument("--out-of-core", action="store_true", help="Combine the old and new datasets on disk with the streaming engine")
+    shard_group = parser.add_mutually_exclusive_group()
+    shard_group.add_argument("--shard", type=str, help="Fetch only the i-th of n team shards and save a partial result (i/n)")
+    shard_group.add_argument("--merge-shards", type=int, help="Merge the partial results of n shards, then upload and update tables")
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument("--record-cassette", type=str, help="Record every W&B GraphQL response to this file (.jsonl.gz)")
+    cassette_group.add_argument("--replay-cassette", type=str, help="Fetch from a recorded cassette instead of W&B, save the result locally and exit")
+    parser.add_argument("--replay-latency-ms", type=float, default=0.0, help="Simulated latency per replayed request")
+    parser.add_argument("--lease-wait-minutes", type=float, help="Wait up to this long for another running instance to finish (default: lease.wait_minutes)")
+    parser.add_argument("--verbose", action="store_true", help="Log every project and run instead of periodic progress lines")
     args = parser.parse_args()
+    setup_logging(args.verbose)
 
     # API キーの処理
     if args.api is not None:
         if "WANDB_API_KEY" in os.environ:
             del os.environ["WANDB_API_KEY"]
         os.environ["WANDB_API_KEY"] = args.api
+    elif args.replay_cassette is not None:
+        # 再生モードでは通信しないが、wandb.Api()の初期化にキーが必要なためダミーを設定する
+        os.environ.setdefault("WANDB_API_KEY", "x" * 40)
     elif "WANDB_API_KEY" not in os.environ:
         print("Warning: Weights & Biases API Key not provided. Some features may not work.")
 
     # 日付の検証
     start_date, end_date = validate_dates(args.start_date, args.end_date)
-    date_range = [start_date, end_date]
 
     # 他の環境変数の設定
     os.environ["WANDB_CACHE_DIR"] = CONFIG.get('wandb_dir', '/tmp/wandb')
     os.environ["WANDB_DATA_DIR"] = CONFIG.get('wandb_dir', '/tmp/wandb')
     os.environ["WANDB_DIR"] = CONFIG.get('wandb_dir', '/tmp/wandb')
 
+    cassette = None
+    if args.record_cassette is not None or args.replay_cassette is not None:
+        from src.utils.cassette import Cassette
+    if args.record_cassette is not None:
+        cassette = Cassette(args.record_cassette, "record").install()
+    elif args.replay_cassette is not None:
+        cassette = Cassette(args.replay_cassette, "replay", latency_ms=args.replay_latency_ms).install()
+    # データセットやlatestタグを更新するモードは、同時に1つだけ実行する（シャード、再生、日中モードは対象外）
+    lease = None
+    if CONFIG.get("lease", {}).get("enabled", False) and not (args.intraday or args.shard or args.replay_cassette):
+        from src.utils.lease import Lease, LeaseHeld
+        lease = Lease("pipeline", wait_minutes=args.lease_wait_minutes)
+        try:
+            lease.acquire()
+        except LeaseHeld as e:
+            print(f"{str(e)}. Exiting without running.")
+            if cassette is not None:
+                cassette.close()
+            return
+    try:
+        run_pipeline(args, start_date, end_date)
+    finally:
+        if lease is not None:
+            lease.release()
+        if cassette is not None:
+            cassette.close()
+
+def run_pipeline(args, start_date: str, end_date: str):
+    date_range = [start_date, end_date]
+
+    if args.intraday:
+        # 日中モード：稼働中のrunだけを定期的にポーリングし続ける
+        from src.tracker.intraday import IntradayTracker
+        tracker = IntradayTracker(
+            interval_minutes=CONFIG.intraday.interval_minutes,
+            retention_hours=CONFIG.intraday.retention_hours,
+        )
+        tracker.run_forever()
+        return
+
+    from src.tracker.fetch_plan import load_fetch_stats
+    from src.tracker.run_manager import RunManager
+    from src.tracker.sharding import parse_shard
+    from src.tracker.backfill import backfill
+    from src.uploader.run_uploader import RunUploader
+    from src.uploader.artifact_handler import ArtifactHandler
+    from src.uploader.data_processor import DataProcessor
+    from src.calculator.remove_tags import list_latest_runs, remove_latest_tags
+    from src.calculator.gpu_usage_calculator import GPUUsageCalculator
+
     print(f"Fetching data from {start_date} to {end_date}")
 
-    # RunManagerの初期化と実行
-    run_manager = RunManager(date_range)
-    new_runs_df = run_manager.fetch_runs()
+    if args.replay_cassette is not None:
+        # 再生モード：記録した通信から取得だけを行い、結果をローカルに保存して終了（アップロードや公開はしない）
+        with TRACER.span("fetch_runs"):
+            # 再生の所要時間は模擬した遅延によるため、見積もり用の記録には残さない
+            run_manager = RunManager(date_range, record_stats=False)
+            new_runs_df = run_manager.fetch_runs()
+        output_dir = Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "replay"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_path = output_dir / f"{start_date}_{end_date}.parquet"
+        # runがなかった場合も比較できるよう、スキーマ付きで書き出す
+        DataProcessor.write_parquet(new_runs_df, output_path)
+        print(f"Saved {len(new_runs_df)} rows to {output_path} (stage timings: {TRACER.stage_timings()})")
+        return
+
+    if args.shard is not None:
+        # シャードモード：担当チームのデータだけを取得し、部分結果として保存して終了
+        shard = parse_shard(args.shard)
+        team_weights = ArtifactHandler.read_manifest().get("team_run_counts", {})
+        run_manager = RunManager(date_range, shard=shard, team_weights=team_weights)
+        new_runs_df = run_manager.fetch_runs()
+        ArtifactHandler.write_partial(new_runs_df, date_range, shard, run_manager.team_run_counts)
+        return
+
+    fetch_stats = load_fetch_stats()
+    if args.merge_shards is not None:
+        # マージモード：全シャードの部分結果を結合する
+        with TRACER.span("merge_shards"):
+            new_runs_df, team_run_counts = ArtifactHandler.read_partials(date_range, args.merge_shards)
+    elif args.backfill:
+        # バックフィルモード：期間をウィンドウに分割して並列に取得する
+        with TRACER.span("fetch_runs"):
+            new_runs_df, team_run_counts = backfill(
+                date_range,
+                window_days=CONFIG.backfill.window_days,
+                max_workers=CONFIG.backfill.max_workers,
+            )
+    else:
+        # RunManagerの初期化と実行
+        with TRACER.span("fetch_runs"):
+            # ローカルに前回の取得の記録がなければ（新しいコンテナなど）、マニフェストに残した記録で見積もる
+            run_manager = RunManager(date_range, fetch_stats=fetch_stats or ArtifactHandler.read_manifest().get("fetch_stats", {}))
+            new_runs_df = run_manager.fetch_runs()
+            team_run_counts = run_manager.team_run_counts
+            fetch_stats = run_manager.fetch_stats
 
     # RunUploaderを使用してデータを処理しアップロード
-    uploader = RunUploader(new_runs_df, date_range)
-    processed_df = uploader.process_and_upload_runs()
+    with TRACER.span("upload_dataset"):
+        uploader = RunUploader(new_runs_df, date_range, background=CONFIG.get("upload_in_background", False))
+        if args.out_of_core:
+            processed_df = uploader.process_and_upload_runs_streaming()
+        else:
+            processed_df = uploader.process_and_upload_runs()
+
+    try:
+        # 現在のlatestランを控えておく
+        with TRACER.span("list_latest_runs"):
+            previous_latest_runs = list_latest_runs()
+
+        # テーブルをアップデート
+        with TRACER.span("update_tables"):
+            calculator = GPUUsageCalculator(processed_df, date_range)
+            calculator.update_tables()
+
+        # バックグラウンドで実行していたデータセットのアップロードを待つ（失敗していればここで例外になり、
+        # 古いランのlatestタグが残るため前回のテーブルに戻せる）
+        with TRACER.span("wait_for_upload"):
+            uploader.wait_for_upload()
+    finally:
+        # 集計や公開が失敗した場合も、アップロードの結果を回収して失敗を表に出す
+        uploader.wait_for_upload()
+
+    # 新しいテーブルの公開とデータセットのアップロードに成功した後で、古いランのlatestタグを削除
+    with TRACER.span("remove_latest_tags"):
+        removed_count = remove_latest_tags(previous_latest_runs)
 
-    # latestタグを削除
-    remove_latest_tags()
+    # 段階ごとの計測結果をトレースファイルに保存する
+    trace_path = Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "traces" / f"trace_{end_date}.json"
+    TRACER.write(trace_path)
+    print(f"Saved trace to {trace_path}")
 
-    # テーブルをアップデート
-    calculator = GPUUsageCalculator(processed_df, date_range)
-    calculator.update_tables()
+    # ヘルスチェック用のマニフェストを最後に書き込む（トレースの要約も含める）
+    ArtifactHandler.write_manifest({
+        "target_date": end_date,
+        "start_date": start_date,
+        "companies": sorted(calculator.published_tables),
+        "row_counts": calculator.published_tables,
+        "removed_latest_tags": removed_count,
+        "team_run_counts": team_run_counts,
+        "fetch_stats": fetch_stats,
+        "stage_timings": TRACER.stage_timings(),
+        "trace_summary": TRACER.summary(),
+        "created_at": dt.datetime.now(pytz.timezone('Asia/Tokyo')).isoformat(),
+    })
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
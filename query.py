@@ -0,0 +1,40 @@
+import argparse
+import time
+import polars as pl
+
+from src.query.local_dataset import GROUP_BY_COLS, dataset_dir, query, read_index, select_partitions, sync_dataset
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the locally cached GPU usage dataset")
+    parser.add_argument("--company", type=str, help="Company name in config.yaml (e.g. kotoba-geniac)")
+    parser.add_argument("--project", type=str, help="Project name")
+    parser.add_argument("--host", type=str, help="Host name")
+    parser.add_argument("--start-date", type=str, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--end-date", type=str, help="End date (YYYY-MM-DD)")
+    parser.add_argument("--group-by", type=str, nargs="*", default=[], choices=GROUP_BY_COLS, help="Columns to group by")
+    parser.add_argument("--sync", action="store_true", help="Download the latest dataset artifact if it has changed")
+    args = parser.parse_args()
+
+    directory = dataset_dir()
+    if args.sync or not read_index(directory):
+        sync_dataset(directory)
+
+    filters = {
+        "company": args.company,
+        "project": args.project,
+        "host_name": args.host,
+        "start_date": args.start_date,
+        "end_date": args.end_date,
+    }
+    start = time.perf_counter()
+    result = query(filters, args.group_by, directory)
+    elapsed = time.perf_counter() - start
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(result)
+    n_scanned = len(select_partitions(read_index(directory), filters))
+    n_total = len(read_index(directory).get("partitions", {}))
+    print(f"Scanned {n_scanned}/{n_total} partitions in {elapsed:.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 from dataclasses import dataclass
 import datetime as dt
-from typing import List, Set
+from typing import List, Optional, Set
 import pytz
 from easydict import EasyDict
 import wandb
 import yaml
 
+from src.utils.config import parse_companies
+
 @dataclass
 class CompanySchedule:
     company: str
@@ -20,6 +22,7 @@ class Config:
     def __init__(self, config_path: str):
         with open(config_path, "r") as f:
             self.data = EasyDict(yaml.safe_load(f))
+        self.companies = parse_companies(self.data.companies)
         self.LOCAL_TZ = pytz.timezone("Asia/Tokyo")
         self.TARGET_DATE = dt.datetime.now(self.LOCAL_TZ).date() + dt.timedelta(days=-1)
         self.TARGET_DATE_STR = self.TARGET_DATE.strftime("%Y-%m-%d")
@@ -37,19 +40,21 @@ class DashboardChecker:
         if not companies:
             errors.append(UpdateError(title="No active companies", text="There are no companies currently active."))
         else:
-            runs = self.get_runs()
-            errors = self.check_runs(companies, runs)
+            manifest = self.get_manifest()
+            if manifest is not None:
+                errors = self.check_manifest(companies, manifest)
+            else:
+                # マニフェストがない場合はrunを直接確認する
+                runs = self.get_runs()
+                errors = self.check_runs(companies, runs)
 
         self.send_alert(errors)
 
     def get_company_schedule(self) -> List[CompanySchedule]:
         """企業名と開始日を取得する"""
         return [
-            CompanySchedule(
-                company=company.company,
-                start_date=min(dt.datetime.strptime(s.date, "%Y-%m-%d").date() for s in company.schedule)
-            )
-            for company in self.config.data.companies
+            CompanySchedule(company=company.company, start_date=company.start_date)
+            for company in self.config.companies
         ]
 
     def get_in_progress_companies(self) -> Set[str]:
@@ -57,12 +62,9 @@ class DashboardChecker:
         today = self.config.TARGET_DATE
         companies = set()
         
-        for company in self.config.data.companies:
-            start_date = min(dt.datetime.strptime(s['date'], "%Y-%m-%d").date() for s in company.schedule)
-            end_date = max(dt.datetime.strptime(s['date'], "%Y-%m-%d").date() for s in company.schedule)
-            
-            # 開始日以降かつ終了日の前日まで進行中とみなす
-            if start_date <= today < end_date:
+        for company in self.config.companies:
+            # 開始日以降かつスケジュールの最終日の前日まで進行中とみなす
+            if company.start_date <= today < company.last_date:
                 companies.add(company.company)
         
         # 進行中の企業がある場合のみ "overall" を追加
@@ -70,10 +72,38 @@ class DashboardChecker:
             companies.add("overall")
         return companies
 
+    def get_manifest(self) -> Optional[dict]:
+        """main.pyが最後に書き込むヘルスマニフェストを取得する"""
+        dashboard = self.config.data.dashboard
+        artifact_path = f"{dashboard.entity}/{dashboard.project}/{dashboard.manifest_artifact_name}:latest"
+        try:
+            return dict(self.api.artifact(artifact_path).metadata)
+        except Exception as e:
+            print(f"Failed to read health manifest: {str(e)}")
+            return None
+
+    def check_manifest(self, companies: Set[str], manifest: dict) -> List[UpdateError]:
+        """マニフェストをチェックし、エラーがあれば返す"""
+        errors = []
+        if manifest.get("target_date") != self.config.TARGET_DATE_STR:
+            errors.append(UpdateError(title="Error of target date", text=f"{self.config.TARGET_DATE_STR}, {manifest.get('target_date')}"))
+        self.check_companies(companies, manifest.get("companies", []), errors)
+        return errors
+
     def get_runs(self) -> object:
-        """runを取得する"""
+        """対象日以降に作成されたlatestタグ付きのrunを取得する"""
         project_path = f"{self.config.data.dashboard.entity}/{self.config.data.dashboard.project}"
-        return self.api.runs(path=project_path)
+        # createdAtはUTCなので、日本時間の対象日の開始時刻をUTCに直して絞り込む
+        target_start = self.config.LOCAL_TZ.localize(
+            dt.datetime.combine(self.config.TARGET_DATE, dt.time())
+        ).astimezone(pytz.utc).replace(tzinfo=None)
+        filters = {
+            "$and": [
+                {"tags": {"$in": [self.config.data.dashboard.tag_for_latest]}},
+                {"createdAt": {"$gte": target_start.isoformat()}},
+            ]
+        }
+        return self.api.runs(path=project_path, filters=filters)
 
     def check_runs(self, companies: Set[str], runs: object) -> List[UpdateError]:
         """runをチェックし、エラーがあれば返す"""
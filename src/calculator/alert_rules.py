@@ -0,0 +1,127 @@
+"""アラートのルールを全企業の日次テーブルに対してまとめて評価し、インシデントごとに1回だけ通知する
+
+ルールはconfig.yamlのalert.rulesで設定する。ルールごとに全企業を一度のgroup_byで評価し、
+割り当てのある直近days日がすべて条件を満たした(ルール, 企業)を発火中とする。
+
+- utilization_floor: GPU稼働率(%)がthreshold未満
+- no_data: runが1つもない
+- overlap_spike: 重複実行時間(h)がthresholdを超える
+
+通知済みのインシデント（発火し始めた日と最後に通知した日）はartifactのメタデータに保存しておき、
+発火し続けている間は通知しない（renotify_daysを設定すればその日数ごとに再通知する）。
+発火しなくなったインシデントは閉じ、再び発火したら新しいインシデントとして通知する。
+"""
+import datetime as dt
+from typing import Dict, List, Sequence, Tuple
+
+import polars as pl
+import wandb
+
+from src.utils.config import CONFIG
+from src.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# alert.rulesが設定されていない場合のルール（以前の固定のしきい値と同じ）
+DEFAULT_RULES = [{"name": "low_utilization", "type": "utilization_floor", "threshold": 10, "days": 1}]
+
+RULE_TITLES = {
+    "utilization_floor": "Too low utilization rate found.",
+    "no_data": "No runs found.",
+    "overlap_spike": "Overlapping runs found.",
+}
+
+def rule_condition(rule: dict) -> Tuple[pl.Expr, pl.Expr]:
+    """ルールの (行ごとの条件, 通知に含める値) を返す"""
+    rule_type = rule["type"]
+    if rule_type == "utilization_floor":
+        return pl.col("GPU稼働率(%)") < rule["threshold"], pl.col("GPU稼働率(%)")
+    if rule_type == "no_data":
+        return pl.col("n_runs") == 0, pl.col("n_runs").cast(pl.Float64)
+    if rule_type == "overlap_spike":
+        return pl.col("重複実行時間(h)") > rule["threshold"], pl.col("重複実行時間(h)")
+    raise ValueError(f"Unknown alert rule type: {rule_type}")
+
+def evaluate_rules(daily_table: pl.DataFrame, rules: Sequence[dict], target_date: dt.date) -> pl.DataFrame:
+    """発火中の(ルール, 企業)と、直近の日の値を返す"""
+    schema = {"rule": pl.Utf8, "type": pl.Utf8, "company": pl.Utf8, "date": pl.Utf8, "value": pl.Float64}
+    # 割り当てのない日（開始前・終了後）は評価しない
+    recent = (
+        daily_table
+        .filter((pl.col("assigned_gpu_node") > 0) & (pl.col("日付") <= target_date.strftime("%Y-%m-%d")))
+        .sort(["企業名", "日付"], descending=[False, True])
+    )
+    frames = [pl.DataFrame(schema=schema)]
+    for rule in rules:
+        condition, value = rule_condition(rule)
+        days = rule.get("days", 1)
+        frames.append(
+            recent.group_by("企業名")
+            .agg(
+                condition.head(days).all().alias("firing"),
+                pl.col("日付").head(days).count().alias("n_days"),
+                pl.col("日付").first().alias("date"),
+                value.first().alias("value"),
+            )
+            .filter(pl.col("firing") & (pl.col("n_days") >= days))
+            .select(
+                pl.lit(rule["name"]).alias("rule"),
+                pl.lit(rule["type"]).alias("type"),
+                pl.col("企業名").alias("company"),
+                pl.col("date"),
+                pl.col("value").cast(pl.Float64),
+            )
+        )
+    return pl.concat(frames).sort(["rule", "company"])
+
+def plan_notifications(
+    firing: pl.DataFrame, state: Dict[str, dict], target_date: dt.date, renotify_days: int = 0
+) -> Tuple[List[dict], Dict[str, dict]]:
+    """発火中のルールと前回までの状態から、通知するアラートと新しい状態を決める"""
+    today = target_date.strftime("%Y-%m-%d")
+    alerts = []
+    new_state = {}
+    for row in firing.iter_rows(named=True):
+        key = f"{row['rule']}:{row['company']}"
+        incident = dict(state.get(key) or {"since": today, "last_notified": None})
+        last_notified = incident["last_notified"]
+        renotify = (
+            last_notified is not None
+            and renotify_days > 0
+            and (target_date - dt.datetime.strptime(last_notified, "%Y-%m-%d").date()).days >= renotify_days
+        )
+        if last_notified is None or renotify:
+            alerts.append({**row, "since": incident["since"]})
+            incident["last_notified"] = today
+        new_state[key] = incident
+    for key in state.keys() - new_state.keys():
+        logger.info(f"Alert incident resolved: {key} (since {state[key]['since']})")
+    return alerts, new_state
+
+def read_alert_state() -> Dict[str, dict]:
+    """前回までのインシデントの状態を取得する（取得できない場合は空のdict）"""
+    dashboard = CONFIG.dashboard
+    artifact_name = CONFIG.get("alert", {}).get("state_artifact_name", "alert_state")
+    try:
+        return dict(wandb.Api().artifact(f"{dashboard.entity}/{dashboard.project}/{artifact_name}:latest").metadata.get("incidents", {}))
+    except Exception as e:
+        logger.warning(f"Failed to read alert state: {str(e)}")
+        return {}
+
+def send_alerts(alerts: List[dict], state: Dict[str, dict], target_date: dt.date) -> None:
+    """アラートを通知し、インシデントの状態を保存する"""
+    artifact_name = CONFIG.get("alert", {}).get("state_artifact_name", "alert_state")
+    with wandb.init(
+        entity=CONFIG.dashboard.entity,
+        project=CONFIG.dashboard.project,
+        name=f"Alerts_{target_date}",
+        job_type="alert",
+    ) as run:
+        for alert in alerts:
+            wandb.alert(
+                title=RULE_TITLES[alert["type"]],
+                text=f"{alert['company']} ({alert['rule']}: {alert['value']} on {alert['date']}, since {alert['since']})",
+            )
+        artifact = wandb.Artifact(name=artifact_name, type="alert-state", metadata={"target_date": target_date.strftime("%Y-%m-%d"), "incidents": state})
+        run.log_artifact(artifact)
+    logger.info(f"Sent {len(alerts)} alerts ({len(state)} open incidents)")
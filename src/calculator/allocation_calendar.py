@@ -0,0 +1,77 @@
+import datetime as dt
+import hashlib
+import json
+import polars as pl
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence
+from src.utils.config import CONFIG, CompanyConfig, get_companies
+from src.utils.log import get_logger
+from src.utils.tracing import TRACER
+
+logger = get_logger(__name__)
+
+def companies_hash(companies: list) -> str:
+    """companiesの設定内容からキャッシュのキーを作成する"""
+    serialized = json.dumps(companies, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+def build_calendar(companies: Sequence[CompanyConfig]) -> pl.DataFrame:
+    """全企業のスケジュールを日次に展開した割り当てカレンダーを一度に作成する"""
+    schedule_df = pl.DataFrame(
+        {
+            "company": [c.company for c in companies for _ in c.schedule],
+            "date": [s.date for c in companies for s in c.schedule],
+            "assigned_gpu_node": [s.assigned_gpu_node for c in companies for s in c.schedule],
+        },
+        schema={"company": pl.Utf8, "date": pl.Date, "assigned_gpu_node": pl.Int64},
+    )
+
+    # 企業ごとにスケジュールの最初の日から最後の日までを展開し、割り当てを前方補完する
+    return (
+        schedule_df
+        .group_by("company")
+        .agg(pl.col("date").min().alias("start"), pl.col("date").max().alias("end"))
+        .with_columns(pl.date_ranges("start", "end", interval="1d").alias("date"))
+        .explode("date")
+        .join(schedule_df, on=["company", "date"], how="left")
+        .sort(["company", "date"])
+        .with_columns(pl.col("assigned_gpu_node").forward_fill().over("company"))
+        .select(
+            pl.col("company").cast(pl.Utf8),
+            pl.col("date").cast(pl.Date),
+            pl.col("assigned_gpu_node").cast(pl.Int64),
+        )
+    )
+
+@lru_cache(maxsize=4)
+def load_calendar(key: str, cache_dir: str) -> pl.DataFrame:
+    """ディスクのキャッシュから割り当てカレンダーを読み込み、なければ作成して保存する"""
+    cache_path = Path(cache_dir) / f"allocation_calendar_{key}.parquet"
+    if cache_path.exists():
+        try:
+            calendar = pl.read_parquet(cache_path)
+            TRACER.count("calendar_cache_hits")
+            return calendar
+        except Exception as e:
+            logger.warning(f"Failed to read allocation calendar cache {cache_path}: {str(e)}")
+    TRACER.count("calendar_cache_misses")
+    calendar = build_calendar(get_companies())
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        calendar.write_parquet(cache_path)
+    except Exception as e:
+        logger.warning(f"Failed to write allocation calendar cache {cache_path}: {str(e)}")
+    return calendar
+
+class AllocationCalendar:
+    def __init__(self):
+        self.key = companies_hash(CONFIG.companies)
+        self.calendar = load_calendar(self.key, CONFIG.get("cache_dir", CONFIG.wandb_dir))
+
+    def daily(self, end_date: dt.date, start_date: Optional[dt.date] = None) -> pl.DataFrame:
+        """指定期間の日次割り当て（割り当てのある日のみ）を切り出す"""
+        condition = (pl.col("date") <= end_date) & (pl.col("assigned_gpu_node") > 0)
+        if start_date is not None:
+            condition = condition & (pl.col("date") >= start_date)
+        return self.calendar.filter(condition)
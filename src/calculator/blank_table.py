@@ -1,12 +1,13 @@
 import datetime as dt
-import pandas as pd
 import polars as pl
-from easydict import EasyDict
-from src.utils.config import CONFIG
+from typing import Optional
+from src.calculator.allocation_calendar import AllocationCalendar
+from src.utils.config import get_companies
 
 class BlankTable:
-    def __init__(self, target_date: dt.date = dt.date.today()):
-        self.target_date = target_date
+    def __init__(self, target_date: Optional[dt.date] = None):
+        self.target_date = target_date or dt.date.today()
+        self.calendar = AllocationCalendar()
         self.__team_table()
         self.__daily_table()
         self.__weekly_table()
@@ -15,65 +16,17 @@ class BlankTable:
     
     def __team_table(self) -> pl.DataFrame:
         """企業とチームの対応テーブルを作成"""
-        df_list = []
-        for c in CONFIG.companies:
-            company = c["company"]
-            teams = c["teams"]
-            df = pd.DataFrame({"company": [company] * len(teams), "team": teams})
-            df_list.append(df)
-        self.team_table = pl.from_pandas(pd.concat(df_list))
-    
-    def __get_schedule(self) -> list[EasyDict]:
-        """configからスケジュールだけ取り出す"""
-        comps = CONFIG.companies
-        schedules = []
-        keys = {"company", "schedule"}
-        for comp in comps:
-            s = EasyDict({k: v for k, v in comp.items() if k in keys})
-            schedules.append(s)
-        return schedules
+        self.team_table = pl.DataFrame(
+            {
+                "company": [c.company for c in get_companies() for _ in c.teams],
+                "team": [team for c in get_companies() for team in c.teams],
+            },
+            schema={"company": pl.Utf8, "team": pl.Utf8},
+        )
 
     def __daily_table(self) -> pl.DataFrame:
-        df_list = []
-        schedules = self.__get_schedule()
-        for s in schedules:
-            minimum_schedule_df = pl.DataFrame(s.schedule).with_columns(
-                pl.col("date").str.strptime(pl.Date, "%Y-%m-%d"),
-                pl.col("assigned_gpu_node").cast(pl.Float64),
-            )
-            
-            # 日付範囲の開始日と終了日を決定
-            start_date = min(minimum_schedule_df["date"].min(), self.target_date)
-            end_date = min(minimum_schedule_df["date"].max(), self.target_date)
-            
-            # 日付を拡張
-            date_df = pl.DataFrame(
-                pl.date_range(
-                    start=start_date,
-                    end=end_date,
-                    interval="1d",
-                    eager=True,
-                ).alias("date")
-            )
-            
-            # 以下は変更なし
-            company_schedule_df = (
-                date_df.join(minimum_schedule_df, on=["date"], how="left")
-                .with_columns(
-                    pl.lit(s.company).alias("company"),
-                    pl.col("assigned_gpu_node").forward_fill(),
-                )
-                .select(
-                    pl.col("company").cast(pl.Utf8),
-                    pl.col("date").cast(pl.Date),
-                    pl.col("assigned_gpu_node").cast(pl.Int64),
-                ).filter(
-                    pl.col("assigned_gpu_node") > 0
-                )
-            )
-            df_list.append(company_schedule_df)
-        schedule_df = pl.concat(df_list)
-        self.daily_table = schedule_df
+        """キャッシュ済みの割り当てカレンダーからtarget_dateまでを切り出す"""
+        self.daily_table = self.calendar.daily(self.target_date)
 
     def __weekly_table(self) -> pl.DataFrame:
         """日次テーブルから週次テーブルを作成"""
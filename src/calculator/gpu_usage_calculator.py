@@ -1,13 +1,25 @@
 import datetime as dt
 import polars as pl
 import wandb
-from typing import List
+from pathlib import Path
+from typing import List, Union
+from src.calculator.alert_rules import DEFAULT_RULES, evaluate_rules, plan_notifications, read_alert_state, send_alerts
 from src.calculator.blank_table import BlankTable
-from src.utils.config import CONFIG
+from src.calculator.host_matrix import write_host_matrices
+from src.calculator.interval_sweep import run_day_segments, sweep_host_usage
+from src.calculator.table_export import export_tables
+from src.calculator.table_serializer import to_wandb_table, empty_table
+from src.utils.config import CONFIG, get_companies
+from src.utils.log import Progress, get_logger
+from src.utils.quantile_sketch import merge_quantiles, merge_sketch_counts
+from src.utils.tracing import TRACER
+
+logger = get_logger(__name__)
 
 GPU_PER_NODE = 8
 HOURS_PER_DAY = 24
 MAX_PERCENT = 100
+QUANTILES = (0.5, 0.95)
 
 def fillna_round(srs: pl.Series) -> pl.Series:
     return srs.fill_null(0).fill_nan(0).round(1)
@@ -24,19 +36,20 @@ TMP_COLS = (
 )
 
 AGG_COLS = (
-    pl.col("assigned_gpu_node")
-    .first()
-    .mul(GPU_PER_NODE * HOURS_PER_DAY)
-    .alias("assigned_gpu_hour"),
     pl.col("metrics_hour").sum().alias("total_metrics_hour"),
     pl.col("sum_gpu_utilization").sum(),
     pl.col("max_gpu_utilization").max(),
     pl.col("sum_gpu_memory").sum(),
     pl.col("max_gpu_memory").max(),
     pl.col("run_id").n_unique().alias("n_runs"),
-    pl.col("assigned_gpu_node").first(),
 )
 
+# runのない期間はleft joinで集計結果がnullになるため、合計とrun数は0にする
+FILL_COLS = ("total_metrics_hour", "sum_gpu_utilization", "sum_gpu_memory", "n_runs")
+
+# ホストごとの稼働区間の計算に使う列
+SEGMENT_COLS = ("company", "date", "host_name", "project", "run_id", "created_at", "updated_at", "gpu_count")
+
 METRICS_COLS = (
     pl.when(pl.col("total_gpu_hour") > pl.col("assigned_gpu_hour"))
     .then(MAX_PERCENT)
@@ -63,50 +76,105 @@ SELECT_COLS = (
     .alias("最大GPUパフォーマンス率(%)"),
     pl.col("average_gpu_memory").pipe(fillna_round).alias("平均GPUメモリ利用率(%)"),
     pl.col("max_gpu_memory").pipe(fillna_round).alias("最大GPUメモリ利用率(%)"),
+    pl.col("p50").pipe(fillna_round).alias("GPUパフォーマンス率p50(%)"),
+    pl.col("p95").pipe(fillna_round).alias("GPUパフォーマンス率p95(%)"),
+    pl.col("idle_rate").pipe(fillna_round).alias("アイドルGPU率(%)"),
     pl.col("n_runs"),
     pl.col("assigned_gpu_node"),
     pl.col("assigned_gpu_hour"),
     pl.col("_total_gpu_hour"),
     pl.col("total_metrics_hour"),
+    pl.col("overlap_hour").pipe(fillna_round).alias("重複実行時間(h)"),
+    pl.col("active_gpu_hour").pipe(fillna_round).alias("アクティブGPU時間(h)"),
 )
 
 class GPUUsageCalculator:
-    def __init__(self, all_runs_df: pl.DataFrame, date_range: List):
+    def __init__(self, all_runs_df: Union[pl.DataFrame, pl.LazyFrame], date_range: List):
+        # --out-of-core ではストリーミングで結合したparquetのscan（LazyFrame）を受け取る。
+        # 集計ごとに必要な列だけを読み、集計結果だけをメモリに載せる
         self.all_runs_df = all_runs_df
         self.start_date = dt.datetime.strptime(date_range[0], "%Y-%m-%d").date()
         self.end_date = dt.datetime.strptime(date_range[1], "%Y-%m-%d").date()
         self.bt = BlankTable(self.end_date)
+        # 公開したテーブルの行数（ヘルスマニフェスト用）
+        self.published_tables = {}
+        self.host_overlap_table = None
+        self.sketch_count_table = None
+        self.daily_gpu_hour_table = None
+        self.n_rows = None
 
-    def add_team(self) -> pl.DataFrame:
-        if self.all_runs_df.is_empty():
-            return pl.DataFrame(schema=self.bt.team_table.schema)
-        return self.all_runs_df.join(
-            self.bt.team_table, left_on="company_name", right_on="team", how="left"
+    def count_rows(self) -> int:
+        if self.n_rows is None:
+            if isinstance(self.all_runs_df, pl.DataFrame):
+                self.n_rows = len(self.all_runs_df)
+            else:
+                self.n_rows = self.all_runs_df.select(pl.count()).collect().item()
+        return self.n_rows
+
+    def is_empty(self) -> bool:
+        return self.count_rows() == 0
+
+    def add_team(self) -> pl.LazyFrame:
+        if self.is_empty():
+            return pl.LazyFrame(schema=self.bt.team_table.schema)
+        return self.all_runs_df.lazy().join(
+            self.bt.team_table.lazy(), left_on="company_name", right_on="team", how="left"
         ).drop("company_name", "assigned_gpu_node")
 
-    def agg_gpu_hour(self, keys: list[str]) -> pl.DataFrame:
-        if self.all_runs_df.is_empty():
-            return pl.DataFrame(schema={k: pl.Utf8 for k in keys} | {"total_gpu_hour": pl.Float64, "_total_gpu_hour": pl.Float64})
-        
+    def agg_runs(self, table: pl.DataFrame, keys: list[str], runs: pl.LazyFrame) -> pl.DataFrame:
+        """runをkeysごとに集計してから、割り当てのテーブルにleft joinする"""
+        run_table = runs.with_columns(*TMP_COLS).group_by(keys).agg(*AGG_COLS).collect(streaming=True)
+        return table.join(run_table, on=keys, how="left").with_columns(
+            pl.col(*FILL_COLS).fill_null(0),
+            pl.col("assigned_gpu_node").mul(GPU_PER_NODE * HOURS_PER_DAY).alias("assigned_gpu_hour"),
+        )
+
+    def agg_host_overlap(self) -> pl.DataFrame:
+        """同一ホストで重なったrunによって重複して数えられたGPU時間と、重なっていた時間を日ごとに計算する"""
+        if self.host_overlap_table is None:
+            segments = run_day_segments(self.add_team()).collect(streaming=True)
+            self.host_overlap_table = sweep_host_usage(segments, GPU_PER_NODE)
+        return self.host_overlap_table
+
+    def daily_gpu_hour(self) -> pl.DataFrame:
+        """(企業, 日付)ごとのGPU時間から重複分を差し引いたものを一度だけ計算する（agg_gpu_hourで共有する）"""
+        if self.daily_gpu_hour_table is not None:
+            return self.daily_gpu_hour_table
+
         all_runs_df_without_team = self.add_team()
+        # サンプルの間隔から求めた稼働時間（導入前のデータにはない）
+        if "active_hour" not in all_runs_df_without_team.columns:
+            all_runs_df_without_team = all_runs_df_without_team.with_columns(pl.lit(None).cast(pl.Float64).alias("active_hour"))
         
-        daily_table = self.bt.daily_table
         join_keys = ["company", "date"]
-        
-        gpu_hour_df = (
-            daily_table.join(
-                all_runs_df_without_team,
-                on=join_keys,
-                how="left",
+        run_gpu_hour_df = (
+            all_runs_df_without_team
+            .with_columns(
+                (pl.col("duration_hour") * pl.col("gpu_count")).alias("gpu_hour"),
+                (pl.col("active_hour") * pl.col("gpu_count")).alias("active_gpu_hour"),
             )
-            .with_columns((pl.col("duration_hour") * pl.col("gpu_count")).alias("gpu_hour"))
             .group_by(join_keys)
             .agg(
-                pl.col("gpu_hour").sum().pipe(fillna_round).alias("total_gpu_hour"),
-                pl.col("assigned_gpu_node")
-                .first()
-                .mul(GPU_PER_NODE * HOURS_PER_DAY)
-                .alias("assigned_gpu_hour"),
+                pl.col("gpu_hour").sum().alias("total_gpu_hour"),
+                pl.col("active_gpu_hour").sum(),
+            )
+            .collect(streaming=True)
+        )
+        
+        self.daily_gpu_hour_table = (
+            self.bt.daily_table.join(run_gpu_hour_df, on=join_keys, how="left")
+            .with_columns(
+                pl.col("total_gpu_hour", "active_gpu_hour").fill_null(0),
+                pl.col("assigned_gpu_node").mul(GPU_PER_NODE * HOURS_PER_DAY).alias("assigned_gpu_hour"),
+            )
+            # 同一ホストで重なったrunの重複分を差し引く
+            .join(self.agg_host_overlap(), on=join_keys, how="left")
+            .with_columns(
+                (pl.col("total_gpu_hour") - pl.col("overlap_gpu_hour").fill_null(0))
+                .clip(lower_bound=0)
+                .pipe(fillna_round)
+                .alias("total_gpu_hour"),
+                pl.col("overlap_hour").fill_null(0),
             )
             .with_columns(
                 pl.col("total_gpu_hour").alias("_total_gpu_hour"),
@@ -115,8 +183,15 @@ class GPUUsageCalculator:
                 .otherwise(pl.col("total_gpu_hour"))
                 .alias("total_gpu_hour"),
             )
-            .drop("assigned_gpu_hour")
+            .select(*join_keys, "total_gpu_hour", "_total_gpu_hour", "overlap_hour", "active_gpu_hour")
         )
+        return self.daily_gpu_hour_table
+
+    def agg_gpu_hour(self, keys: list[str]) -> pl.DataFrame:
+        if self.is_empty():
+            return pl.DataFrame(schema={k: pl.Utf8 for k in keys} | {"total_gpu_hour": pl.Float64, "_total_gpu_hour": pl.Float64, "overlap_hour": pl.Float64, "active_gpu_hour": pl.Float64})
+        
+        gpu_hour_df = self.daily_gpu_hour()
         
         # 月次データ用の処理を追加
         if "year_month" in keys:
@@ -130,38 +205,71 @@ class GPUUsageCalculator:
         
         gpu_hour_df = (
             gpu_hour_df.group_by(keys)
-            .agg(pl.col("total_gpu_hour").sum(), pl.col("_total_gpu_hour").sum())
-            .select(*keys, "total_gpu_hour", "_total_gpu_hour")
+            .agg(pl.col("total_gpu_hour").sum(), pl.col("_total_gpu_hour").sum(), pl.col("overlap_hour").sum(), pl.col("active_gpu_hour").sum())
+            .select(*keys, "total_gpu_hour", "_total_gpu_hour", "overlap_hour", "active_gpu_hour")
             .sort(["company"])
         )
         return gpu_hour_df
 
+    def sketch_counts(self) -> pl.DataFrame:
+        """スケッチのJSONを一度だけ展開し、(企業, 日付, バケット)ごとの件数にまとめておく（agg_*で共有する）"""
+        if self.sketch_count_table is None:
+            # チームのままで展開し、企業への対応付けはバケットごとの件数にまとめてから行う
+            team_counts = merge_sketch_counts(self.all_runs_df, ["company_name", "date"], "gpu_utilization_sketch")
+            self.sketch_count_table = (
+                team_counts.join(self.bt.team_table, left_on="company_name", right_on="team", how="left")
+                .group_by(["company", "date", "b"])
+                .agg(pl.col("c").sum())
+            )
+        return self.sketch_count_table
+
+    def agg_percentiles(self, keys: list[str]) -> pl.DataFrame:
+        """GPU使用率のスケッチをkeysごとにマージし、分位点とアイドル率を計算する"""
+        key_dtypes = {"company": pl.Utf8, "date": pl.Date, "week_start": pl.Date, "year_month": pl.Utf8}
+        schema = {k: key_dtypes[k] for k in keys}
+        schema |= {"idle_rate": pl.Float64} | {f"p{int(q * 100)}": pl.Float64 for q in QUANTILES}
+        if self.is_empty() or "gpu_utilization_sketch" not in self.all_runs_df.columns:
+            return pl.DataFrame(schema=schema)
+
+        long_df = self.sketch_counts()
+        if "year_month" in keys:
+            long_df = long_df.with_columns(pl.col("date").dt.strftime("%Y-%m").alias("year_month"))
+        elif "week_start" in keys:
+            long_df = long_df.with_columns(
+                (pl.col("date") - pl.duration(days=pl.col("date").dt.weekday() % 7)).alias("week_start")
+            )
+
+        if long_df.is_empty():
+            return pl.DataFrame(schema=schema)
+        return merge_quantiles(long_df, keys, QUANTILES)
+
     def agg_daily(self) -> pl.DataFrame:
-        if self.all_runs_df.is_empty():
+        if self.is_empty():
             return pl.DataFrame(schema={"企業名": pl.Utf8, "日付": pl.Utf8, "合計GPU使用時間(h)": pl.Float64, "GPU稼働率(%)": pl.Float64, 
                                         "平均GPUパフォーマンス率(%)": pl.Float64, "最大GPUパフォーマンス率(%)": pl.Float64, 
                                         "平均GPUメモリ利用率(%)": pl.Float64, "最大GPUメモリ利用率(%)": pl.Float64, 
+                                        "GPUパフォーマンス率p50(%)": pl.Float64, "GPUパフォーマンス率p95(%)": pl.Float64, 
+                                        "アイドルGPU率(%)": pl.Float64, 
                                         "n_runs": pl.Int64, "assigned_gpu_node": pl.Int64, "assigned_gpu_hour": pl.Float64, 
-                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64})
+                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64, 
+                                        "重複実行時間(h)": pl.Float64, "アクティブGPU時間(h)": pl.Float64})
         
         all_runs_df_without_team = self.add_team()
         keys = ["company", "date"]
 
         gpu_daily_table = (
-            self.bt.daily_table.join(
-                all_runs_df_without_team,
+            self.agg_runs(self.bt.daily_table, keys, all_runs_df_without_team)
+            .join(
+                self.agg_gpu_hour(keys=keys),
                 on=keys,
                 how="left",
             )
-            .with_columns(*TMP_COLS)
-            .group_by(keys)
-            .agg(*AGG_COLS)
+            .with_columns(*METRICS_COLS)
             .join(
-                self.agg_gpu_hour(keys=keys),
+                self.agg_percentiles(keys=keys),
                 on=keys,
                 how="left",
             )
-            .with_columns(*METRICS_COLS)
             .select(
                 pl.col("company").alias("企業名"),
                 pl.col("date").dt.strftime("%Y-%m-%d").alias("日付"),
@@ -174,12 +282,15 @@ class GPUUsageCalculator:
         return gpu_daily_table
 
     def agg_weekly(self) -> pl.DataFrame:
-        if self.all_runs_df.is_empty():
+        if self.is_empty():
             return pl.DataFrame(schema={"企業名": pl.Utf8, "週開始日": pl.Utf8, "合計GPU使用時間(h)": pl.Float64, "GPU稼働率(%)": pl.Float64, 
                                         "平均GPUパフォーマンス率(%)": pl.Float64, "最大GPUパフォーマンス率(%)": pl.Float64, 
                                         "平均GPUメモリ利用率(%)": pl.Float64, "最大GPUメモリ利用率(%)": pl.Float64, 
+                                        "GPUパフォーマンス率p50(%)": pl.Float64, "GPUパフォーマンス率p95(%)": pl.Float64, 
+                                        "アイドルGPU率(%)": pl.Float64, 
                                         "n_runs": pl.Int64, "assigned_gpu_node": pl.Int64, "assigned_gpu_hour": pl.Float64, 
-                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64})
+                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64, 
+                                        "重複実行時間(h)": pl.Float64, "アクティブGPU時間(h)": pl.Float64})
         
         # end_dateの週の開始日（月曜日）を計算
         target_week_start = self.end_date - dt.timedelta(days=self.end_date.weekday())
@@ -190,20 +301,22 @@ class GPUUsageCalculator:
         keys = ["company", "week_start"]
 
         gpu_weekly_table = (
-            self.bt.weekly_table.join(
+            self.agg_runs(
+                self.bt.weekly_table,
+                keys,
                 all_runs_df_without_team.filter(pl.col("week_start") < target_week_start),
-                on=keys,
-                how="left",
             )
-            .with_columns(*TMP_COLS)
-            .group_by(keys)
-            .agg(*AGG_COLS)
             .join(
                 self.agg_gpu_hour(keys=keys),
                 on=keys,
                 how="left",
             )
             .with_columns(*METRICS_COLS)
+            .join(
+                self.agg_percentiles(keys=keys),
+                on=keys,
+                how="left",
+            )
             .select(
                 pl.col("company").alias("企業名"),
                 pl.col("week_start").dt.strftime("%Y-%m-%d").alias("週開始日"),
@@ -216,31 +329,32 @@ class GPUUsageCalculator:
         return gpu_weekly_table
 
     def agg_monthly(self) -> pl.DataFrame:
-        if self.all_runs_df.is_empty():
+        if self.is_empty():
             return pl.DataFrame(schema={"企業名": pl.Utf8, "日付": pl.Utf8, "合計GPU使用時間(h)": pl.Float64, "GPU稼働率(%)": pl.Float64, 
                                         "平均GPUパフォーマンス率(%)": pl.Float64, "最大GPUパフォーマンス率(%)": pl.Float64, 
                                         "平均GPUメモリ利用率(%)": pl.Float64, "最大GPUメモリ利用率(%)": pl.Float64, 
+                                        "GPUパフォーマンス率p50(%)": pl.Float64, "GPUパフォーマンス率p95(%)": pl.Float64, 
+                                        "アイドルGPU率(%)": pl.Float64, 
                                         "n_runs": pl.Int64, "assigned_gpu_node": pl.Int64, "assigned_gpu_hour": pl.Float64, 
-                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64})
+                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64, 
+                                        "重複実行時間(h)": pl.Float64, "アクティブGPU時間(h)": pl.Float64})
         
         all_runs_df_without_team = self.add_team().with_columns(pl.col("date").dt.strftime("%Y-%m").alias("year_month"))
         keys = ["company", "year_month"]
 
         gpu_monthly_table = (
-            self.bt.monthly_table.join(
-                all_runs_df_without_team,
+            self.agg_runs(self.bt.monthly_table, keys, all_runs_df_without_team)
+            .join(
+                self.agg_gpu_hour(keys=keys),
                 on=keys,
                 how="left",
             )
-            .with_columns(*TMP_COLS)
-            .group_by(keys)
-            .agg(*AGG_COLS)
+            .with_columns(*METRICS_COLS)
             .join(
-                self.agg_gpu_hour(keys=keys),
+                self.agg_percentiles(keys=keys),
                 on=keys,
                 how="left",
             )
-            .with_columns(*METRICS_COLS)
             .select(
                 pl.col("company").alias("企業名"),
                 pl.col("year_month").alias("年月"),
@@ -253,38 +367,43 @@ class GPUUsageCalculator:
         return gpu_monthly_table
 
     def agg_overall(self) -> pl.DataFrame:
-        if self.all_runs_df.is_empty():
+        if self.is_empty():
             return pl.DataFrame(schema={"企業名": pl.Utf8, "日付": pl.Utf8, "合計GPU使用時間(h)": pl.Float64, "GPU稼働率(%)": pl.Float64, 
                                         "平均GPUパフォーマンス率(%)": pl.Float64, "最大GPUパフォーマンス率(%)": pl.Float64, 
                                         "平均GPUメモリ利用率(%)": pl.Float64, "最大GPUメモリ利用率(%)": pl.Float64, 
+                                        "GPUパフォーマンス率p50(%)": pl.Float64, "GPUパフォーマンス率p95(%)": pl.Float64, 
+                                        "アイドルGPU率(%)": pl.Float64, 
                                         "n_runs": pl.Int64, "assigned_gpu_node": pl.Int64, "assigned_gpu_hour": pl.Float64, 
-                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64})
+                                        "_total_gpu_hour": pl.Float64, "total_metrics_hour": pl.Float64, 
+                                        "重複実行時間(h)": pl.Float64, "アクティブGPU時間(h)": pl.Float64})
         
         all_runs_df_without_team = self.add_team()
         keys = ["company"]
 
         gpu_overall_table = (
-            self.bt.overall_table.join(
-                all_runs_df_without_team,
+            self.agg_runs(self.bt.overall_table, keys, all_runs_df_without_team)
+            .join(
+                self.agg_gpu_hour(keys=keys),
                 on=keys,
                 how="left",
             )
-            .with_columns(*TMP_COLS)
-            .group_by(keys)
-            .agg(*AGG_COLS)
+            .with_columns(*METRICS_COLS)
             .join(
-                self.agg_gpu_hour(keys=keys),
+                self.agg_percentiles(keys=keys),
                 on=keys,
                 how="left",
             )
-            .with_columns(*METRICS_COLS)
             .select(pl.col("company").alias("企業名"), *SELECT_COLS)
             .sort(["企業名"])
         )
 
         return gpu_overall_table
 
-    def update_overall(self, gpu_overall_table: pl.DataFrame, gpu_monthly_table: pl.DataFrame, gpu_weekly_table: pl.DataFrame):
+    def update_overall(self, gpu_overall_table: pl.DataFrame, gpu_monthly_table: pl.DataFrame, gpu_weekly_table: pl.DataFrame, stage_timings: dict):
+        stage_timings_table = pl.DataFrame(
+            {"stage": list(stage_timings), "duration_sec": list(stage_timings.values())},
+            schema={"stage": pl.Utf8, "duration_sec": pl.Float64},
+        )
         with wandb.init(
             entity=CONFIG.dashboard.entity,
             project=CONFIG.dashboard.project,
@@ -294,22 +413,38 @@ class GPUUsageCalculator:
         ) as run:
             wandb.log(
                 {
-                    "overall_gpu_usage": wandb.Table(data=gpu_overall_table.to_pandas()),
-                    "monthly_gpu_usage": wandb.Table(data=gpu_monthly_table.to_pandas()),
-                    "weekly_gpu_usage": wandb.Table(data=gpu_weekly_table.to_pandas()),
+                    "overall_gpu_usage": to_wandb_table(gpu_overall_table),
+                    "monthly_gpu_usage": to_wandb_table(gpu_monthly_table),
+                    "weekly_gpu_usage": to_wandb_table(gpu_weekly_table),
+                    "stage_timings": to_wandb_table(stage_timings_table),
                 }
             )
+            # 夜間の実行ごとの推移をrunの一覧で比べられるように、段階ごとの所要時間をsummaryにも残す
+            run.summary.update({f"stage_timings/{stage}": sec for stage, sec in stage_timings.items()})
             if gpu_overall_table.is_empty():
                 wandb.log({"warning": "No data available for overall, monthly, and weekly tables"})
+        self.published_tables["overall"] = {
+            "overall_gpu_usage": len(gpu_overall_table),
+            "monthly_gpu_usage": len(gpu_monthly_table),
+            "weekly_gpu_usage": len(gpu_weekly_table),
+        }
 
     def update_companies(self, gpu_daily_table: pl.DataFrame, gpu_weekly_table: pl.DataFrame, gpu_summary_table: pl.DataFrame):
         limit = 30
 
         if gpu_daily_table.is_empty():
-            print("Warning: No data to update for companies.")
+            logger.warning("No data to update for companies.")
 
-        for company_info in CONFIG.companies:
-            company = company_info['company']
+        # アーカイブを有効にしている場合、latestテーブルは直近の期間だけに絞る
+        if self.archive_enabled():
+            cutoff = (self.end_date - dt.timedelta(days=CONFIG.dashboard.archive.window_days - 1)).strftime("%Y-%m-%d")
+            gpu_daily_table = gpu_daily_table.filter(pl.col("日付") >= cutoff)
+            gpu_weekly_table = gpu_weekly_table.filter(pl.col("週開始日") >= cutoff)
+
+        companies = get_companies()
+        progress = Progress("publish_companies", total=len(companies))
+        for company_info in companies:
+            company = company_info.company
             gpu_daily_company_table = gpu_daily_table.filter(pl.col("企業名") == company)
             gpu_weekly_company_table = gpu_weekly_table.filter(pl.col("企業名") == company)
             gpu_summary_company_table = gpu_summary_table.filter(pl.col("company_name") == company)
@@ -324,48 +459,175 @@ class GPUUsageCalculator:
                 data_to_log = {}
                 
                 if gpu_daily_company_table.is_empty():
-                    empty_df = pl.DataFrame({"column": []}).with_columns(pl.col("column").cast(pl.Utf8))
                     data_to_log = {
-                        "company_daily_gpu_usage": wandb.Table(data=empty_df.to_pandas()),
-                        f"company_daily_gpu_usage_within_{limit}days": wandb.Table(data=empty_df.to_pandas()),
-                        "company_weekly_gpu_usage": wandb.Table(data=empty_df.to_pandas()),
-                        f"company_weekly_gpu_usage_within_{limit//7}weeks": wandb.Table(data=empty_df.to_pandas()),
-                        "company_summary": wandb.Table(data=empty_df.to_pandas()),
+                        "company_daily_gpu_usage": empty_table(),
+                        f"company_daily_gpu_usage_within_{limit}days": empty_table(),
+                        "company_weekly_gpu_usage": empty_table(),
+                        f"company_weekly_gpu_usage_within_{limit//7}weeks": empty_table(),
+                        "company_summary": empty_table(),
                         "warning": f"No data available for company: {company}"
                     }
                 else:
                     data_to_log = {
-                        "company_daily_gpu_usage": wandb.Table(data=gpu_daily_company_table.to_pandas()),
-                        f"company_daily_gpu_usage_within_{limit}days": wandb.Table(data=gpu_daily_company_table.head(limit).to_pandas()),
-                        "company_weekly_gpu_usage": wandb.Table(data=gpu_weekly_company_table.to_pandas()),
-                        f"company_weekly_gpu_usage_within_{limit//7}weeks": wandb.Table(data=gpu_weekly_company_table.head(limit//7).to_pandas()),
-                        "company_summary": wandb.Table(data=gpu_summary_company_table.to_pandas()),
+                        "company_daily_gpu_usage": to_wandb_table(gpu_daily_company_table),
+                        f"company_daily_gpu_usage_within_{limit}days": to_wandb_table(gpu_daily_company_table.head(limit)),
+                        "company_weekly_gpu_usage": to_wandb_table(gpu_weekly_company_table),
+                        f"company_weekly_gpu_usage_within_{limit//7}weeks": to_wandb_table(gpu_weekly_company_table.head(limit//7)),
+                        "company_summary": to_wandb_table(gpu_summary_company_table),
                     }
 
                 wandb.log(data_to_log)
+                self.published_tables[company] = {
+                    "company_daily_gpu_usage": len(gpu_daily_company_table),
+                    "company_weekly_gpu_usage": len(gpu_weekly_company_table),
+                    "company_summary": len(gpu_summary_company_table),
+                }
+            logger.debug(f"Published tables of {company}")
+            progress.advance()
+        progress.close()
+
+    def evaluate_alerts(self, gpu_daily_table: pl.DataFrame):
+        """アラートのルールを全企業についてまとめて評価し、新しいインシデントだけを通知する"""
+        alert_config = CONFIG.get("alert", {})
+        firing = evaluate_rules(gpu_daily_table, alert_config.get("rules", DEFAULT_RULES), self.end_date)
+        state = read_alert_state()
+        alerts, new_state = plan_notifications(firing, state, self.end_date, alert_config.get("renotify_days", 0))
+        TRACER.count("alerts_firing", len(firing))
+        TRACER.count("alerts_sent", len(alerts))
+        if alerts or new_state != state:
+            send_alerts(alerts, new_state, self.end_date)
+        else:
+            logger.info(f"No new alerts ({len(new_state)} open incidents)")
+
+    @staticmethod
+    def archive_enabled() -> bool:
+        archive_config = CONFIG.dashboard.get("archive")
+        return bool(archive_config and archive_config.get("enabled", False))
+
+    def get_archived_months(self) -> set[tuple[str, str]]:
+        """公開済みのアーカイブ（企業, 年月）を取得する"""
+        api = wandb.Api()
+        runs = api.runs(
+            f"{CONFIG.dashboard.entity}/{CONFIG.dashboard.project}",
+            {"tags": {"$in": [CONFIG.dashboard.archive.tag_for_archive]}},
+        )
+        return {(run.config.get("company"), run.config.get("year_month")) for run in runs}
+
+    def update_archives(self, gpu_daily_table: pl.DataFrame, gpu_weekly_table: pl.DataFrame):
+        """確定した月の日次・週次テーブルを企業ごとに一度だけ公開する"""
+        archive_tag = CONFIG.dashboard.archive.tag_for_archive
+        # end_dateが月末なら、その月も確定済みとみなす
+        first_open_month = (self.end_date + dt.timedelta(days=1)).strftime("%Y-%m")
+        archived_months = self.get_archived_months()
+
+        closed_daily_table = (
+            gpu_daily_table
+            .with_columns(pl.col("日付").str.slice(0, 7).alias("year_month"))
+            .filter(pl.col("year_month") < first_open_month)
+        )
+        closed_weekly_table = gpu_weekly_table.with_columns(pl.col("週開始日").str.slice(0, 7).alias("year_month"))
+
+        targets = (
+            closed_daily_table.select(pl.col("企業名"), pl.col("year_month"))
+            .unique()
+            .sort(["企業名", "year_month"])
+            .rows()
+        )
+        targets = [target for target in targets if target not in archived_months]
+        progress = Progress("archive_tables", total=len(targets))
+        for company, year_month in targets:
+            gpu_daily_month_table = closed_daily_table.filter(
+                (pl.col("企業名") == company) & (pl.col("year_month") == year_month)
+            ).drop("year_month")
+            gpu_weekly_month_table = closed_weekly_table.filter(
+                (pl.col("企業名") == company) & (pl.col("year_month") == year_month)
+            ).drop("year_month")
 
-                if CONFIG.enable_alert and not gpu_daily_company_table.is_empty():
-                    latest_row_dict = gpu_daily_company_table.to_pandas().to_dict(
-                        orient="records"
-                    )[0]
-                    threshold = 10
-                    if latest_row_dict["GPU稼働率(%)"] < threshold:
-                        wandb.alert(
-                            title="Too low utilization rate found.",
-                            text=company,
-                        )
+            with wandb.init(
+                entity=CONFIG.dashboard.entity,
+                project=CONFIG.dashboard.project,
+                name=f"Archive_{year_month}",
+                job_type="archive-table",
+                tags=[company, archive_tag],
+                config={"company": company, "year_month": year_month},
+            ) as run:
+                wandb.log(
+                    {
+                        "company_daily_gpu_usage": to_wandb_table(gpu_daily_month_table),
+                        "company_weekly_gpu_usage": to_wandb_table(gpu_weekly_month_table),
+                    }
+                )
+            logger.debug(f"Archived tables of {company} for {year_month}")
+            progress.advance()
+        progress.close()
+
+    @staticmethod
+    def host_matrix_enabled() -> bool:
+        host_matrix_config = CONFIG.dashboard.get("host_matrix")
+        return bool(host_matrix_config and host_matrix_config.get("enabled", False))
+
+    def update_host_matrices(self):
+        """期間に含まれる月の 時間×ホスト 稼働率行列を書き出し、月をエイリアスにしてartifactとして公開する"""
+        year_months = (
+            pl.date_range(self.start_date.replace(day=1), self.end_date, "1mo", eager=True)
+            .dt.strftime("%Y-%m")
+            .to_list()
+        )
+        output_dir = Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "host_matrix" / self.end_date.strftime("%Y-%m-%d")
+        runs = self.add_team().select(*SEGMENT_COLS, "average_gpu_utilization").collect(streaming=True)
+        written = write_host_matrices(runs, year_months, output_dir, GPU_PER_NODE)
+        if not written:
+            return
+        with wandb.init(
+            entity=CONFIG.dashboard.entity,
+            project=CONFIG.dashboard.project,
+            name=f"HostMatrix_{self.end_date}",
+            job_type="host-matrix",
+        ) as run:
+            artifact = wandb.Artifact(
+                name=CONFIG.dashboard.host_matrix.artifact_name,
+                type="matrix",
+                metadata={"year_months": year_months, "companies": sorted(written)},
+            )
+            artifact.add_dir(str(output_dir))
+            run.log_artifact(artifact, aliases=["latest", *year_months])
+        logger.info(f"Published host matrices of {len(written)} companies for {', '.join(year_months)}")
+
+    @staticmethod
+    def export_enabled() -> bool:
+        export_config = CONFIG.dashboard.get("export")
+        return bool(export_config and export_config.get("enabled", False))
+
+    def export_tables(self, tables: dict):
+        """集計済みテーブルをArrow IPCファイルに書き出し、対象日をエイリアスにしてartifactとして公開する"""
+        output_dir = Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "export" / self.end_date.strftime("%Y-%m-%d")
+        manifest = export_tables(tables, output_dir, self.end_date)
+        with wandb.init(
+            entity=CONFIG.dashboard.entity,
+            project=CONFIG.dashboard.project,
+            name=f"Export_{self.end_date}",
+            job_type="export-table",
+        ) as run:
+            artifact = wandb.Artifact(
+                name=CONFIG.dashboard.export.artifact_name,
+                type="tables",
+                metadata=manifest,
+            )
+            artifact.add_dir(str(output_dir))
+            run.log_artifact(artifact, aliases=["latest", self.end_date.strftime("%Y-%m-%d")])
+        logger.info(f"Exported {len(tables)} tables to {output_dir}")
 
     def agg_summary(self) -> pl.DataFrame:
-        if self.all_runs_df.is_empty():
+        if self.is_empty():
             return pl.DataFrame(schema={"company_name": pl.Utf8, "project": pl.Utf8, "Total hours": pl.Float64, 
                                         "Total runs": pl.Int64, "master_node_runs": pl.Int64, 
                                         "overlap_runs": pl.Int64, "ignore_runs": pl.Int64})
         
         start_date = self.end_date - dt.timedelta(days=(self.end_date.weekday() + 7))
         end_date = start_date + dt.timedelta(days=7)
-        df_filtered = self.all_runs_df.filter(
+        df_filtered = self.all_runs_df.lazy().filter(
             (pl.col('date') >= start_date) & (pl.col('date') < end_date)
-        )
+        ).collect()
         
         summary = (
             df_filtered
@@ -386,7 +648,8 @@ class GPUUsageCalculator:
             ])
             .sort(['company_name', 'project', 'host_name', 'created_at'])
             .with_columns([
-                pl.col('updated_at').shift().over(['company_name', 'project', 'host_name']).alias('prev_updated_at')
+                # 直前のrunだけでなく、それ以前に始まって長く続いているrunとの重なりも検出する
+                pl.col('updated_at').cum_max().shift().over(['company_name', 'project', 'host_name']).alias('prev_updated_at')
             ])
             .with_columns([
                 (pl.col('created_at') < pl.col('prev_updated_at')).alias('is_overlap')
@@ -412,13 +675,34 @@ class GPUUsageCalculator:
         return summary
 
     def update_tables(self):
-        gpu_overall_table = self.agg_overall()
-        gpu_monthly_table = self.agg_monthly()
-        gpu_weekly_table = self.agg_weekly()
-        gpu_daily_table = self.agg_daily()
-        gpu_summary_table = self.agg_summary()
-        self.update_overall(gpu_overall_table, gpu_monthly_table, gpu_weekly_table)
-        self.update_companies(gpu_daily_table, gpu_weekly_table, gpu_summary_table)
+        with TRACER.span("aggregate") as aggregate_span:
+            TRACER.count("rows", self.count_rows())
+            gpu_overall_table = self.agg_overall()
+            gpu_monthly_table = self.agg_monthly()
+            gpu_weekly_table = self.agg_weekly()
+            gpu_daily_table = self.agg_daily()
+            gpu_summary_table = self.agg_summary()
+        # 公開の時点までに完了した段階と、この集計の所要時間
+        stage_timings = TRACER.stage_timings() | {"aggregate": round(aggregate_span.duration_sec, 1)}
+        with TRACER.span("publish"):
+            self.update_overall(gpu_overall_table, gpu_monthly_table, gpu_weekly_table, stage_timings)
+            self.update_companies(gpu_daily_table, gpu_weekly_table, gpu_summary_table)
+            if CONFIG.enable_alert:
+                self.evaluate_alerts(gpu_daily_table)
+            if self.archive_enabled():
+                self.update_archives(gpu_daily_table, gpu_weekly_table)
+            if self.host_matrix_enabled():
+                self.update_host_matrices()
+            if self.export_enabled():
+                self.export_tables(
+                    {
+                        "overall": gpu_overall_table,
+                        "monthly": gpu_monthly_table,
+                        "weekly": gpu_weekly_table,
+                        "daily": gpu_daily_table,
+                        "summary": gpu_summary_table,
+                    }
+                )
 
 if __name__ == "__main__":
     df = pl.read_csv('dev/processed_df.csv', schema={"date": pl.Date, "company_name": pl.Utf8, "project": pl.Utf8, "run_id": pl.Utf8, "tags": pl.Utf8, 
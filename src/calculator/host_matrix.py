@@ -0,0 +1,116 @@
+"""企業ごと・月ごとの 時間×ホスト のGPU稼働率行列
+
+runの稼働区間を1時間単位に切り分け、各時間にそのホストのGPUがどれだけ使われていたか（%）を
+float32の2次元配列として `{output_dir}/{company}/{YYYY-MM}.npy` に保存する。
+行は月初からの経過時間、列は `{YYYY-MM}.json` の hosts の順に対応する。
+np.load(mmap_mode="r") で読み込めば、ヒートマップやアイドルホストの抽出は配列のスライスだけで済む。
+"""
+import calendar
+import datetime as dt
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import polars as pl
+
+from src.calculator.interval_sweep import run_day_segments
+
+SECONDS_PER_HOUR = 60 ** 2
+
+def hourly_host_usage(df: pl.DataFrame, gpu_per_node: int) -> pl.DataFrame:
+    """(企業, ホスト, 時刻)ごとのGPU稼働率(%)を計算する
+
+    稼働率は 稼働GPU時間×その日の平均GPU使用率 をホストのGPU数で割ったもの。
+    GPU使用率のメトリクスがないrunは稼働していたものとして数える。
+    """
+    segments = run_day_segments(df, extra_cols=["average_gpu_utilization"])
+    hour = pl.col("hour")
+    return (
+        segments.with_columns(
+            pl.datetime_ranges(
+                pl.col("start").dt.truncate("1h"),
+                (pl.col("end") - pl.duration(microseconds=1)).dt.truncate("1h"),
+                "1h",
+            ).alias("hour")
+        )
+        .explode("hour")
+        .with_columns(
+            (
+                (pl.min_horizontal(pl.col("end"), hour + pl.duration(hours=1)) - pl.max_horizontal(pl.col("start"), hour))
+                .dt.total_seconds()
+                / SECONDS_PER_HOUR
+            ).alias("active_hour")
+        )
+        .group_by(["company", "host", "hour"])
+        .agg(
+            (
+                pl.col("active_hour")
+                * pl.col("gpu_count")
+                * pl.col("average_gpu_utilization").fill_null(100).clip(0, 100)
+            ).sum().alias("busy_gpu_percent"),
+            pl.col("gpu_count").max().alias("max_gpu_count"),
+        )
+        .with_columns(
+            pl.col("max_gpu_count").max().over(["company", "host"]).alias("capacity")
+        )
+        .select(
+            "company",
+            "host",
+            "hour",
+            (pl.col("busy_gpu_percent") / pl.max_horizontal(pl.col("capacity"), pl.lit(gpu_per_node)))
+            .clip(0, 100)
+            .cast(pl.Float32)
+            .alias("utilization"),
+        )
+    )
+
+def month_start_hours(year_month: str) -> Tuple[dt.datetime, int]:
+    """月初の時刻と、その月の時間数を返す"""
+    year, month = map(int, year_month.split("-"))
+    return dt.datetime(year, month, 1), calendar.monthrange(year, month)[1] * 24
+
+def build_matrix(usage: pl.DataFrame, year_month: str) -> Tuple[np.ndarray, List[str]]:
+    """1企業1か月分の (時刻, ホスト, 稼働率) を 時間×ホスト の行列にする"""
+    month_start, n_hours = month_start_hours(year_month)
+    hosts = sorted(usage["host"].unique().to_list())
+    matrix = np.zeros((n_hours, len(hosts)), dtype=np.float32)
+    if hosts:
+        indexed = usage.select(
+            ((pl.col("hour") - month_start).dt.total_seconds() // SECONDS_PER_HOUR).cast(pl.Int64).alias("row"),
+            pl.col("host").replace(hosts, list(range(len(hosts))), return_dtype=pl.Int64).alias("col"),
+            pl.col("utilization"),
+        )
+        matrix[indexed["row"].to_numpy(), indexed["col"].to_numpy()] = indexed["utilization"].to_numpy()
+    return matrix, hosts
+
+def write_host_matrices(df: pl.DataFrame, year_months: List[str], output_dir: Path, gpu_per_node: int) -> Dict[str, int]:
+    """指定した月の行列を企業ごとに書き出し、書き出したファイル数を企業ごとに返す"""
+    output_dir = Path(output_dir)
+    written = {}
+    if df.is_empty():
+        return written
+    usage = hourly_host_usage(df, gpu_per_node).with_columns(pl.col("hour").dt.strftime("%Y-%m").alias("year_month"))
+    for (company, year_month), group in usage.filter(pl.col("year_month").is_in(year_months)).group_by(
+        ["company", "year_month"], maintain_order=True
+    ):
+        matrix, hosts = build_matrix(group, year_month)
+        company_dir = output_dir / company
+        company_dir.mkdir(parents=True, exist_ok=True)
+        np.save(company_dir / f"{year_month}.npy", matrix)
+        month_start, _ = month_start_hours(year_month)
+        with open(company_dir / f"{year_month}.json", "w") as f:
+            json.dump({"start": month_start.isoformat(), "step": "1h", "unit": "%", "hosts": hosts}, f, ensure_ascii=False)
+        written[company] = written.get(company, 0) + 1
+    return written
+
+def load_host_matrix(output_dir: Path, company: str, year_month: str) -> Tuple[np.ndarray, List[str]]:
+    """行列をメモリマップで読み込む"""
+    company_dir = Path(output_dir) / company
+    with open(company_dir / f"{year_month}.json") as f:
+        hosts = json.load(f)["hosts"]
+    return np.load(company_dir / f"{year_month}.npy", mmap_mode="r"), hosts
+
+def idle_hosts(matrix: np.ndarray, hosts: List[str], threshold: float = 1.0) -> List[str]:
+    """期間中の稼働率がthreshold(%)を一度も超えなかったホストを返す"""
+    return [host for host, busy in zip(hosts, (matrix > threshold).any(axis=0)) if not busy]
@@ -0,0 +1,72 @@
+"""同一ホスト上で重なって実行されたrunの重複をスイープラインで取り除く
+
+run×日の各行を、その日の中で実際に稼働していた区間に切り出し、(企業, ホスト, 日付)ごとに
+開始・終了イベントを時刻順に並べて累積する。各イベント間で稼働中のGPU数（ホストのGPU数で頭打ち）
+と稼働中のrun数を求めれば、重複を除いたGPU時間と重複していた時間が正確に求まる。
+ソートが支配的なので計算量はO(n log n)。
+"""
+import polars as pl
+from typing import Sequence
+
+SECONDS_PER_HOUR = 60 ** 2
+
+def run_day_segments(df: pl.DataFrame, extra_cols: Sequence[str] = ()) -> pl.DataFrame:
+    """run×日の行を、その日の中での稼働区間[start, end)に変換する
+
+    ホスト名が取れないrunは他のrunと重ならないものとして、run単位の仮ホストに割り当てる。
+    extra_colsに指定した列はそのまま引き継ぐ。
+    """
+    day_start = pl.col("date").cast(pl.Datetime("us"))
+    return (
+        df.select(
+            pl.col("company"),
+            pl.col("date"),
+            pl.coalesce(pl.col("host_name"), pl.concat_str(pl.lit("run:"), pl.col("project"), pl.lit("/"), pl.col("run_id"))).alias("host"),
+            pl.max_horizontal(pl.col("created_at").cast(pl.Datetime("us")), day_start).alias("start"),
+            pl.min_horizontal(pl.col("updated_at").cast(pl.Datetime("us")), day_start + pl.duration(days=1)).alias("end"),
+            pl.col("gpu_count").fill_null(0),
+            *extra_cols,
+        )
+        .filter(pl.col("end") > pl.col("start"))
+    )
+
+def sweep_host_usage(segments: pl.DataFrame, gpu_per_node: int) -> pl.DataFrame:
+    """(企業, 日付)ごとに、重複して数えられていたGPU時間と、runが重なっていた時間を計算する"""
+    keys = ["company", "host", "date"]
+    events = pl.concat(
+        [
+            segments.select(*keys, pl.col("start").alias("t"), pl.col("gpu_count").alias("d_gpu"), pl.lit(1).alias("d_run")),
+            segments.select(*keys, pl.col("end").alias("t"), (-pl.col("gpu_count")).alias("d_gpu"), pl.lit(-1).alias("d_run")),
+        ]
+    )
+    capacity = segments.group_by(keys).agg(
+        pl.max_horizontal(pl.col("gpu_count").max(), pl.lit(gpu_per_node)).alias("capacity")
+    )
+    return (
+        events.sort([*keys, "t"])
+        .with_columns(
+            pl.col("d_gpu").cum_sum().over(keys).alias("active_gpu"),
+            pl.col("d_run").cum_sum().over(keys).alias("active_runs"),
+            ((pl.col("t").shift(-1).over(keys) - pl.col("t")).dt.total_seconds() / SECONDS_PER_HOUR)
+            .fill_null(0)
+            .alias("interval_hour"),
+        )
+        .join(capacity, on=keys, how="left")
+        .with_columns(
+            (pl.col("interval_hour") * pl.col("active_gpu")).alias("raw_gpu_hour"),
+            (pl.col("interval_hour") * pl.min_horizontal(pl.col("active_gpu"), pl.col("capacity"))).alias("busy_gpu_hour"),
+            (pl.col("interval_hour") * (pl.col("active_runs") - 1).clip(lower_bound=0)).alias("overlap_hour"),
+        )
+        .group_by(["company", "date"])
+        .agg(
+            pl.col("raw_gpu_hour").sum(),
+            pl.col("busy_gpu_hour").sum(),
+            pl.col("overlap_hour").sum(),
+        )
+        .select(
+            pl.col("company"),
+            pl.col("date"),
+            (pl.col("raw_gpu_hour") - pl.col("busy_gpu_hour")).clip(lower_bound=0).alias("overlap_gpu_hour"),
+            pl.col("overlap_hour"),
+        )
+    )
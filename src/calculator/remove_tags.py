@@ -1,43 +1,87 @@
 import wandb
-from src.utils.config import CONFIG
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+from wandb_gql import gql
+from src.utils.config import CONFIG, get_companies
+from src.utils.log import get_logger, setup_logging
+from src.utils.tracing import TRACER
 
-def remove_latest_tags():
-    # W&B APIの初期化
-    api = wandb.Api()
+logger = get_logger(__name__)
+
+# 1回のリクエストにまとめるmutationの数と、同時に投げるリクエスト数
+MUTATION_BATCH_SIZE = 20
+MAX_CONCURRENT_REQUESTS = 4
+
+def list_latest_runs(api: Optional[wandb.Api] = None) -> list:
+    """latestタグと（会社名のいずれかまたは'overall'）タグを持つrunをサーバー側で絞り込んで取得する"""
+    api = api or wandb.Api()
 
     # CONFIGからentity、project、latest_tagを取得
     entity = CONFIG.dashboard.entity
     project = CONFIG.dashboard.project
     latest_tag = CONFIG.dashboard.tag_for_latest
 
-    # CONFIGから会社名のリストを作成
-    company_names = [company['company'] for company in CONFIG.companies]
+    # 設定の企業一覧から会社名のリストを作成
+    company_names = [company.company for company in get_companies()]
 
-    # 'latest'タグを持つrunを取得
-    runs = api.runs(f"{entity}/{project}", {"tags": {"$in": [latest_tag]}})
+    filters = {
+        "$and": [
+            {"tags": {"$in": [latest_tag]}},
+            {"tags": {"$in": company_names + ["overall"]}},
+        ]
+    }
+    return list(api.runs(f"{entity}/{project}", filters, per_page=1000))
+
+def build_remove_mutation(n: int) -> str:
+    """n件のrunのタグを一度に更新するmutationを作成する"""
+    params = ", ".join(f"$id{i}: String!, $tags{i}: [String!]" for i in range(n))
+    fields = "\n".join(
+        f"    r{i}: upsertBucket(input: {{id: $id{i}, tags: $tags{i}}}) {{ bucket {{ id }} }}"
+        for i in range(n)
+    )
+    return f"mutation RemoveLatestTags({params}) {{\n{fields}\n}}"
+
+def remove_latest_tags(runs: Optional[List] = None) -> int:
+    """latestタグをまとめて削除する
+
+    runsを渡した場合はそのrunだけを対象にする。新しいテーブルを公開する前に
+    list_latest_runsで対象を控えておき、公開が成功した後に呼び出す。
+    """
+    api = wandb.Api()
+    latest_tag = CONFIG.dashboard.tag_for_latest
+    if runs is None:
+        runs = list_latest_runs(api)
+
+    targets = [
+        (run.storage_id, [tag for tag in run.tags if tag != latest_tag])
+        for run in runs
+        if latest_tag in run.tags
+    ]
+    batches = [targets[i:i + MUTATION_BATCH_SIZE] for i in range(0, len(targets), MUTATION_BATCH_SIZE)]
+
+    def execute_batch(batch):
+        variables = {}
+        for i, (storage_id, tags) in enumerate(batch):
+            variables[f"id{i}"] = storage_id
+            variables[f"tags{i}"] = tags
+        api.client.execute(gql(build_remove_mutation(len(batch))), variables)
+        TRACER.count("mutations")
+        TRACER.count("tags_removed", len(batch))
+        return len(batch)
 
     removed_count = 0
-    for run in runs:
-        # runのタグを取得
-        tags = run.tags
-        
-        # latest_tagと（会社名のいずれかまたは'overall'）がタグに含まれているか確認
-        matching_companies = [company for company in company_names if company in tags]
-        if latest_tag in tags and (matching_companies or 'overall' in tags):
-            # latest_tagを削除
-            tags.remove(latest_tag)
-            
-            # タグを更新
-            run.tags = tags
-            run.update()
-            print(f"Removed '{latest_tag}' tag from run: {run.id}")
-            if matching_companies:
-                print(f"Matching companies: {', '.join(matching_companies)}")
-            if 'overall' in tags:
-                print("'overall' tag present")
-            removed_count += 1
-
-    print(f"Process completed. Removed '{latest_tag}' tag from {removed_count} runs.")
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(batches))) as executor:
+            futures = [executor.submit(execute_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                try:
+                    removed_count += future.result()
+                except Exception as e:
+                    logger.warning(f"Error removing '{latest_tag}' tags: {str(e)}")
+
+    logger.info(f"Process completed. Removed '{latest_tag}' tag from {removed_count}/{len(targets)} runs.")
+    return removed_count
 
 if __name__ == "__main__":
-    remove_latest_tags()
\ No newline at end of file
+    setup_logging()
+    remove_latest_tags()
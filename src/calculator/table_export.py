@@ -0,0 +1,46 @@
+"""集計済みテーブルのArrow IPC(Feather v2)形式でのエクスポート
+
+各テーブルを非圧縮のArrow IPCファイルとして書き出すため、読み込み側はメモリマップするだけで
+コピーなしに使える。manifest.json にはスキーマのバージョン、対象日、各テーブルの行数と列の型を記録する。
+列を変えた場合は SCHEMA_VERSION を上げること。
+"""
+import datetime as dt
+import json
+import polars as pl
+from pathlib import Path
+from typing import Dict
+
+SCHEMA_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+
+def export_tables(tables: Dict[str, pl.DataFrame], output_dir: Path, target_date: dt.date) -> dict:
+    """テーブルを {name}.arrow として書き出し、マニフェストを返す"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "schema_version": SCHEMA_VERSION,
+        "target_date": target_date.strftime("%Y-%m-%d"),
+        "created_at": dt.datetime.now().isoformat(),
+        "tables": {},
+    }
+    for name, df in tables.items():
+        filename = f"{name}.arrow"
+        # メモリマップで読めるように圧縮しない
+        df.write_ipc(output_dir / filename, compression="uncompressed")
+        manifest["tables"][name] = {
+            "file": filename,
+            "rows": len(df),
+            "schema": {col: str(dtype) for col, dtype in df.schema.items()},
+        }
+    with open(output_dir / MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+def load_exported_table(export_dir: Path, name: str) -> pl.DataFrame:
+    """エクスポートされたテーブルをメモリマップで読み込む"""
+    export_dir = Path(export_dir)
+    with open(export_dir / MANIFEST_FILE) as f:
+        manifest = json.load(f)
+    if manifest["schema_version"] != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported schema version: {manifest['schema_version']} (expected {SCHEMA_VERSION})")
+    return pl.read_ipc(export_dir / manifest["tables"][name]["file"], memory_map=True)
@@ -0,0 +1,18 @@
+import polars as pl
+import wandb
+
+EMPTY_TABLE_COLUMNS = ["column"]
+
+def to_wandb_table(df: pl.DataFrame) -> wandb.Table:
+    """pandasを経由せず、Arrowのバッファから直接wandb.Tableを作成する"""
+    arrow_table = df.to_arrow()
+    columns = [arrow_table.column(name).to_pylist() for name in arrow_table.column_names]
+    data = [list(row) for row in zip(*columns)]
+    return wandb.Table(columns=list(arrow_table.column_names), data=data)
+
+def empty_table() -> wandb.Table:
+    """データがない企業用の空テーブル
+
+    wandb.Tableは一度logしたrunに結び付くため、キーやrunごとに毎回新しく作る（共有すると別のrunでのlogが失敗する）
+    """
+    return wandb.Table(columns=list(EMPTY_TABLE_COLUMNS), data=[])
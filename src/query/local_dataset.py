@@ -0,0 +1,143 @@
+"""ローカルにキャッシュしたデータセットへの問い合わせ
+
+all_runs_data artifactを月ごとのparquetに分割して `{cache_dir}/dataset/` に保存し、
+パーティションごとの列の最小値・最大値を index.json に持っておく。
+問い合わせ時はインデックスで関係のないファイルを読み飛ばし、残りをlazyにscanして
+フィルタを読み込み時に押し下げるため、何年分のデータでも必要な部分だけを読めば済む。
+"""
+import json
+import datetime as dt
+import polars as pl
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.utils.config import CONFIG, get_companies
+
+INDEX_FILE = "index.json"
+# インデックスに最小値・最大値を持つ列
+INDEX_COLS = ["date", "company", "project", "host_name"]
+GROUP_BY_COLS = ["company", "team", "project", "host_name", "date", "week_start", "year_month"]
+
+def dataset_dir() -> Path:
+    return Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "dataset"
+
+def read_index(directory: Path) -> dict:
+    index_path = directory / INDEX_FILE
+    if not index_path.exists():
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+def add_company(df: pl.DataFrame) -> pl.DataFrame:
+    """チーム名(company_name)から企業名を付与する"""
+    team_to_company = {team: c.company for c in get_companies() for team in c.teams}
+    return df.with_columns(
+        pl.col("company_name").alias("team"),
+        pl.col("company_name").replace(team_to_company, default=None).alias("company"),
+    ).drop("company_name")
+
+def write_partitions(df: pl.DataFrame, directory: Path, digest: str) -> dict:
+    """月ごとのparquetとインデックスを書き出す"""
+    directory.mkdir(parents=True, exist_ok=True)
+    for old_partition in directory.glob("*.parquet"):
+        old_partition.unlink()
+
+    partitions = {}
+    df = add_company(df).with_columns(pl.col("date").dt.strftime("%Y-%m").alias("year_month"))
+    for (year_month,), partition_df in df.group_by(["year_month"], maintain_order=True):
+        filename = f"{year_month}.parquet"
+        # 並べておくと行グループの統計でもスキップが効く
+        partition_df = partition_df.drop("year_month").sort(["company", "project", "date"])
+        partition_df.write_parquet(directory / filename, statistics=True)
+        bounds = partition_df.select(
+            *[pl.col(c).min().cast(pl.Utf8).alias(f"{c}_min") for c in INDEX_COLS],
+            *[pl.col(c).max().cast(pl.Utf8).alias(f"{c}_max") for c in INDEX_COLS],
+        ).row(0, named=True)
+        partitions[filename] = {
+            "rows": len(partition_df),
+            **{c: [bounds[f"{c}_min"], bounds[f"{c}_max"]] for c in INDEX_COLS},
+        }
+
+    index = {"digest": digest, "created_at": dt.datetime.now().isoformat(), "partitions": partitions}
+    with open(directory / INDEX_FILE, "w") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index
+
+def sync_dataset(directory: Optional[Path] = None) -> dict:
+    """artifactが更新されていればダウンロードしてパーティションを作り直す"""
+    # wandbとpandasはダウンロードするときだけ必要なので、問い合わせだけの場合は読み込まない
+    import wandb
+    from src.uploader.artifact_handler import ArtifactHandler
+
+    directory = directory or dataset_dir()
+    index = read_index(directory)
+    artifact_name = CONFIG.dataset.artifact_name
+    artifact_path = f"{CONFIG.dataset.entity}/{CONFIG.dataset.project}/{artifact_name}:latest"
+    artifact = wandb.Api().artifact(artifact_path)
+    if index.get("digest") == artifact.digest:
+        return index
+    print(f"Downloading {artifact_path} ...")
+    artifact_dir = Path(artifact.download(CONFIG.wandb_dir))
+    all_runs_df = ArtifactHandler.read_dataset_csv(artifact_dir / f"{artifact_name}.csv")
+    return write_partitions(all_runs_df, directory, artifact.digest)
+
+def overlaps(bounds: List[Optional[str]], low: Optional[str], high: Optional[str]) -> bool:
+    """パーティションの[最小値, 最大値]が[low, high]と重なるか"""
+    if bounds[0] is None:
+        return False
+    if low is not None and bounds[1] < low:
+        return False
+    if high is not None and bounds[0] > high:
+        return False
+    return True
+
+def select_partitions(index: dict, filters: Dict[str, str]) -> List[str]:
+    """インデックスからフィルタに該当しうるパーティションだけを選ぶ"""
+    selected = []
+    for filename, stats in index.get("partitions", {}).items():
+        if not overlaps(stats["date"], filters.get("start_date"), filters.get("end_date")):
+            continue
+        if any(
+            filters.get(c) is not None and not overlaps(stats[c], filters[c], filters[c])
+            for c in ["company", "project", "host_name"]
+        ):
+            continue
+        selected.append(filename)
+    return sorted(selected)
+
+def query(filters: Dict[str, str], group_by: List[str], directory: Optional[Path] = None) -> pl.DataFrame:
+    """フィルタとグループ化を指定してGPU使用時間などを集計する"""
+    directory = directory or dataset_dir()
+    unknown_cols = set(group_by) - set(GROUP_BY_COLS)
+    if unknown_cols:
+        raise ValueError(f"Unsupported group-by columns: {sorted(unknown_cols)}")
+
+    files = select_partitions(read_index(directory), filters)
+    if not files:
+        return pl.DataFrame()
+
+    predicate = pl.lit(True)
+    if filters.get("start_date") is not None:
+        predicate &= pl.col("date") >= dt.date.fromisoformat(filters["start_date"])
+    if filters.get("end_date") is not None:
+        predicate &= pl.col("date") <= dt.date.fromisoformat(filters["end_date"])
+    for c in ["company", "project", "host_name"]:
+        if filters.get(c) is not None:
+            predicate &= pl.col(c) == filters[c]
+
+    return (
+        pl.scan_parquet([str(directory / f) for f in files])
+        .filter(predicate)
+        .with_columns(
+            (pl.col("date") - pl.duration(days=pl.col("date").dt.weekday() % 7)).alias("week_start"),
+            pl.col("date").dt.strftime("%Y-%m").alias("year_month"),
+        )
+        .group_by(group_by or [pl.lit("total").alias("total")])
+        .agg(
+            (pl.col("duration_hour") * pl.col("gpu_count")).sum().round(1).alias("gpu_hour"),
+            pl.col("run_id").n_unique().alias("runs"),
+            pl.col("average_gpu_utilization").mean().round(1).alias("average_gpu_utilization"),
+        )
+        .sort(group_by or "total")
+        .collect()
+    )
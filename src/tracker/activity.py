@@ -0,0 +1,65 @@
+"""システムメトリクスのサンプル時刻から、runが実際に動いていた区間を復元する
+
+createdAtからheartbeatAtまでを丸ごと稼働とみなすと、プリエンプションやハングで記録が途切れていた時間も数えてしまう。
+ここではサンプルを時刻順に並べ、次のサンプルまでの間隔がしきい値以下なら稼働、超えていれば停止とみなす。
+履歴は間引いて取得しているため、しきい値は設定値(gap_minutes)とサンプル間隔の中央値のgap_factor倍の大きい方にする。
+稼働区間は日付の境界で分割し、日ごとの稼働時間として返す。すべてpolarsの式で計算するため、runをまとめて渡してもよい。
+"""
+import polars as pl
+from typing import Optional, Sequence
+
+from src.utils.config import CONFIG
+
+SECONDS_PER_HOUR = 60 ** 2
+
+def active_hours_per_day(
+    samples: pl.DataFrame,
+    by: Sequence[str] = (),
+    gap_minutes: Optional[float] = None,
+    gap_factor: Optional[float] = None,
+) -> pl.DataFrame:
+    """サンプルの時刻(datetime列)から、(by, date)ごとの稼働時間(active_hour)を計算する"""
+    activity_config = CONFIG.get("activity", {})
+    gap_minutes = gap_minutes if gap_minutes is not None else activity_config.get("gap_minutes", 30)
+    gap_factor = gap_factor if gap_factor is not None else activity_config.get("gap_factor", 3)
+    by = list(by)
+    schema = {**{c: samples.schema[c] for c in by}, "date": pl.Date, "active_hour": pl.Float64}
+    if samples.is_empty():
+        return pl.DataFrame(schema=schema)
+
+    def over(expr: pl.Expr) -> pl.Expr:
+        return expr.over(by) if by else expr
+
+    intervals = (
+        samples.select(*by, pl.col("datetime").cast(pl.Datetime("us")).alias("start"))
+        .unique()
+        .sort([*by, "start"])
+        .with_columns(over(pl.col("start").shift(-1)).alias("end"))
+        .filter(pl.col("end").is_not_null())
+        .with_columns(((pl.col("end") - pl.col("start")).dt.total_seconds() / 60).alias("gap_minutes"))
+        .with_columns(
+            pl.max_horizontal(pl.lit(float(gap_minutes)), over(pl.col("gap_minutes").median()) * gap_factor)
+            .alias("threshold_minutes")
+        )
+        # しきい値を超えた間隔は停止していたとみなす
+        .filter(pl.col("gap_minutes") <= pl.col("threshold_minutes"))
+    )
+    day_start = pl.col("date").cast(pl.Datetime("us"))
+    return (
+        intervals
+        .with_columns(
+            pl.date_ranges(pl.col("start").dt.date(), pl.col("end").dt.date(), "1d").alias("date")
+        )
+        .explode("date")
+        .with_columns(
+            (
+                (pl.min_horizontal(pl.col("end"), day_start + pl.duration(days=1)) - pl.max_horizontal(pl.col("start"), day_start))
+                .dt.total_seconds() / SECONDS_PER_HOUR
+            ).alias("active_hour")
+        )
+        .filter(pl.col("active_hour") > 0)
+        .group_by([*by, "date"])
+        .agg(pl.col("active_hour").sum())
+        .select(list(schema))
+        .cast(schema)
+    )
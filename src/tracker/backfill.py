@@ -0,0 +1,62 @@
+import datetime as dt
+import multiprocessing
+import time
+import polars as pl
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from src.tracker.run_manager import RunManager
+from src.uploader.data_processor import DataProcessor
+from src.utils.config import CONFIG
+from src.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+def split_date_range(date_range: List[str], window_days: int) -> List[List[str]]:
+    """期間をwindow_days日ごとのウィンドウに分割する"""
+    start = dt.datetime.strptime(date_range[0], "%Y-%m-%d").date()
+    end = dt.datetime.strptime(date_range[1], "%Y-%m-%d").date()
+    windows = []
+    while start <= end:
+        window_end = min(start + dt.timedelta(days=window_days - 1), end)
+        windows.append([start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d")])
+        start = window_end + dt.timedelta(days=1)
+    return windows
+
+def fetch_window(window: List[str]) -> Tuple[List[str], str, int, Dict[str, int]]:
+    """1つのウィンドウを取得してparquetに書き出す（ワーカープロセスで実行される）"""
+    # ウィンドウは1晩分より長いため、夜間の取得の見積もり用の記録には残さない
+    run_manager = RunManager(window, record_stats=False)
+    window_df = run_manager.fetch_runs()
+    output_dir = Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "backfill"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"{window[0]}_{window[1]}.parquet"
+    # runがないウィンドウも読み込めるよう、スキーマ付きで書き出す
+    DataProcessor.write_parquet(window_df, output_path)
+    return window, str(output_path), len(window_df), run_manager.team_run_counts
+
+def backfill(date_range: List[str], window_days: int, max_workers: int) -> Tuple[pl.DataFrame, Dict[str, int]]:
+    """長い期間をウィンドウに分割し、プロセスプールで並列に取得して結合する
+
+    各ワーカーは1ウィンドウを処理するたびに入れ替わるため、ワーカーのメモリは
+    1ウィンドウ分に収まる。結合はDataProcessor.combine_framesと同じlatest-winsのルールで行う。
+    """
+    windows = split_date_range(date_range, window_days)
+    logger.info(f"Backfill {date_range[0]} ~ {date_range[1]} in {len(windows)} windows of {window_days} days")
+
+    frames = []
+    team_run_counts = {}
+    start_time = time.perf_counter()
+    # polarsのスレッドプールとforkの相性が悪いためspawnを使う
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=min(max_workers, len(windows)), maxtasksperchild=1) as pool:
+        for completed, (window, output_path, n_rows, counts) in enumerate(
+            pool.imap_unordered(fetch_window, windows), start=1
+        ):
+            frames.append(pl.read_parquet(output_path))
+            for team, count in counts.items():
+                team_run_counts[team] = team_run_counts.get(team, 0) + count
+            elapsed = time.perf_counter() - start_time
+            logger.info(f"[{completed}/{len(windows)}] Window {window[0]} ~ {window[1]}: {n_rows} rows ({elapsed:.0f}s elapsed)")
+
+    return DataProcessor.combine_frames(frames), team_run_counts
@@ -7,11 +7,12 @@ JAPAN_TIMEZONE = pytz.timezone("Asia/Tokyo")
 LOGGED_AT = dt.datetime.now(JAPAN_TIMEZONE).replace(tzinfo=None)
 JAPAN_UTC_OFFSET = 9
 
+# 取得期間と重なるrunだけをサーバー側で絞り込む
 GQL_QUERY = """
-query GetGpuInfoForProject($project: String!, $entity: String!, $first: Int!, $cursor: String!) {
+query GetGpuInfoForProject($project: String!, $entity: String!, $first: Int!, $cursor: String!, $filters: JSONString) {
     project(name: $project, entityName: $entity) {
         name
-        runs(first: $first, after: $cursor) {
+        runs(first: $first, after: $cursor, filters: $filters) {
             edges {
                 cursor
                 node {
@@ -34,6 +35,36 @@ query GetGpuInfoForProject($project: String!, $entity: String!, $first: Int!, $c
 }
 """
 
+# 稼働中、または指定時刻以降にheartbeatが更新されたrunだけをサーバー側で絞り込む
+GQL_ACTIVE_RUNS_QUERY = """
+query GetActiveRunsForProject($project: String!, $entity: String!, $first: Int!, $cursor: String!, $filters: JSONString) {
+    project(name: $project, entityName: $entity) {
+        name
+        runs(first: $first, after: $cursor, filters: $filters) {
+            edges {
+                cursor
+                node {
+                    name
+                    createdAt
+                    updatedAt
+                    heartbeatAt
+                    state
+                    tags
+                    host
+                    runInfo {
+                        gpuCount
+                        gpu
+                    }
+                    config
+                    systemMetrics
+                    eventsTail
+                }
+            }
+        }
+    }
+}
+"""
+
 @dataclass
 class Run:
     run_path: str
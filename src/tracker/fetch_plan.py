@@ -0,0 +1,122 @@
+"""前回の取得で記録したプロジェクトごとの件数から、今回の取得量と所要時間を見積もる
+
+プロジェクトごとに、runの一覧のページ数・有効なrun数・履歴の取得回数と、それぞれにかかった時間を
+`{cache_dir}/fetch_stats.json`（とヘルスマニフェスト）に保存しておく。次の取得ではこれを使って
+重いプロジェクトから順に共有のワーカーへ投入し、リストの最後の大きなプロジェクトが全体の時間を決めてしまうのを防ぐ。
+記録のないプロジェクトは、記録のあるプロジェクトの中央値として見積もる。
+"""
+import json
+import os
+import statistics
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from src.utils.config import CONFIG
+from src.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# 記録がまったくない場合の1回あたりの時間（秒）
+DEFAULT_SEC_PER_PAGE = 1.0
+DEFAULT_SEC_PER_HISTORY_CALL = 2.0
+
+@dataclass
+class ProjectEstimate:
+    team: str
+    project: str
+    pages: float
+    valid_runs: float
+    history_calls: float
+    list_sec: float
+    metrics_sec: float
+
+    @property
+    def key(self) -> str:
+        return f"{self.team}/{self.project}"
+
+    @property
+    def total_sec(self) -> float:
+        return self.list_sec + self.metrics_sec
+
+def stats_path() -> Path:
+    return Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "fetch_stats.json"
+
+def load_fetch_stats(path: Optional[Path] = None) -> Dict[str, dict]:
+    """前回の取得の記録を読み込む（ない場合は空のdict）"""
+    path = path or stats_path()
+    if not path.exists():
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to read fetch stats {path}: {str(e)}")
+        return {}
+
+def save_fetch_stats(stats: Dict[str, dict], path: Optional[Path] = None) -> None:
+    path = path or stats_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # バックフィルのワーカーが同時に書き込んでも壊れないように、一時ファイルから置き換える
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def rates(stats: Dict[str, dict]) -> Dict[str, float]:
+    """記録全体から、1ページ・1回の履歴取得にかかる時間と、runあたりの履歴取得回数を求める"""
+    values = list(stats.values())
+    pages = sum(s.get("pages", 0) for s in values)
+    history_calls = sum(s.get("history_calls", 0) for s in values)
+    valid_runs = sum(s.get("valid_runs", 0) for s in values)
+    return {
+        "sec_per_page": sum(s.get("list_sec", 0) for s in values) / pages if pages else DEFAULT_SEC_PER_PAGE,
+        "sec_per_history_call": sum(s.get("metrics_sec", 0) for s in values) / history_calls if history_calls else DEFAULT_SEC_PER_HISTORY_CALL,
+        "history_calls_per_run": history_calls / valid_runs if valid_runs else 1.0,
+    }
+
+def estimate_projects(projects: Sequence[tuple], stats: Dict[str, dict]) -> List[ProjectEstimate]:
+    """(team, project)ごとの見積もりを、重い順に返す"""
+    rate = rates(stats)
+    known = [stats[f"{team}/{project}"] for team, project in projects if f"{team}/{project}" in stats]
+    fallback = {
+        "pages": statistics.median([s.get("pages", 1) for s in known]) if known else 1,
+        "valid_runs": statistics.median([s.get("valid_runs", 0) for s in known]) if known else 0,
+    }
+    estimates = []
+    for team, project in projects:
+        s = stats.get(f"{team}/{project}", fallback)
+        pages = max(s.get("pages", 1), 1)
+        valid_runs = s.get("valid_runs", 0)
+        history_calls = s.get("history_calls", valid_runs * rate["history_calls_per_run"])
+        estimates.append(
+            ProjectEstimate(
+                team=team,
+                project=project,
+                pages=pages,
+                valid_runs=valid_runs,
+                history_calls=history_calls,
+                list_sec=pages * rate["sec_per_page"],
+                metrics_sec=history_calls * rate["sec_per_history_call"],
+            )
+        )
+    return sorted(estimates, key=lambda e: (-e.total_sec, e.key))
+
+def expected_wall_sec(costs: Sequence[float], workers: int) -> float:
+    """重い順に投入したときの所要時間の目安（ワーカーに均等に分かれるが、最大の1件より短くはならない）"""
+    if not costs:
+        return 0.0
+    return max(sum(costs) / max(workers, 1), max(costs))
+
+def log_plan(estimates: Sequence[ProjectEstimate], workers: int, top: int = 3) -> float:
+    """取得を始める前に、取得量と所要時間の見積もりを出力する（見積もった秒数を返す）"""
+    list_wall = expected_wall_sec([e.list_sec for e in estimates], workers)
+    # 履歴はrun単位でワーカーに分かれる
+    metrics_wall = sum(e.metrics_sec for e in estimates) / max(workers, 1)
+    heaviest = ", ".join(f"{e.key} (~{e.total_sec:.0f}s)" for e in estimates[:top])
+    logger.info(
+        f"Fetch plan: {len(estimates)} projects, ~{sum(e.pages for e in estimates):.0f} pages, "
+        f"~{sum(e.valid_runs for e in estimates):.0f} valid runs, ~{sum(e.history_calls for e in estimates):.0f} history calls; "
+        f"expected ~{(list_wall + metrics_wall) / 60:.1f} min with {workers} workers. Heaviest: {heaviest or '-'}"
+    )
+    return list_wall + metrics_wall
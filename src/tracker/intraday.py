@@ -0,0 +1,311 @@
+import datetime as dt
+import json
+import re
+import time
+import polars as pl
+import wandb
+from easydict import EasyDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from wandb_gql import gql
+
+from src.calculator.allocation_calendar import AllocationCalendar
+from src.calculator.gpu_usage_calculator import GPU_PER_NODE
+from src.calculator.table_serializer import to_wandb_table
+from src.tracker.common import JAPAN_UTC_OFFSET, GQL_ACTIVE_RUNS_QUERY, Run
+from src.tracker.run_manager import RunManager
+from src.utils.config import CONFIG, get_companies
+from src.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+GPU_UTILIZATION_PTN = r"^system\.gpu\.\d+\.gpu$"
+
+CONTRIBUTION_SCHEMA = {
+    "company": pl.Utf8,
+    "hour": pl.Datetime("us"),
+    "run_id": pl.Utf8,
+    "gpu_hours": pl.Float64,
+    "sum_gpu_utilization": pl.Float64,
+    "n_samples": pl.Int64,
+}
+
+EMPTY_SAMPLES = pl.DataFrame(schema={"hour": pl.Datetime("us"), "sum_gpu_utilization": pl.Float64, "n_samples": pl.Int64})
+
+def tail_samples(node: EasyDict) -> List[dict]:
+    """run一覧のノードのeventsTailとsystemMetricsから、直近のサンプルを_timestampごとに1つずつ取り出す
+
+    どちらもJSON文字列で返る（eventsTailは各行がJSON文字列の配列）。
+    _timestampがないサンプルはheartbeatの時刻のサンプルとして扱う。
+    """
+    heartbeat = dt.datetime.fromisoformat(node.heartbeatAt.rstrip("Z")).replace(tzinfo=dt.timezone.utc).timestamp()
+    tail, metrics = node.get("eventsTail"), node.get("systemMetrics")
+    lines = json.loads(tail) if isinstance(tail, str) else list(tail or [])
+    if metrics:
+        lines.append(metrics)
+    samples = [json.loads(line) if isinstance(line, str) else dict(line) for line in lines]
+    by_timestamp = {}
+    for sample in samples:
+        sample = {**sample, "_timestamp": sample.get("_timestamp") or heartbeat}
+        by_timestamp.setdefault(sample["_timestamp"], sample)
+    return list(by_timestamp.values())
+
+class IntradayTracker:
+    """稼働中のrunだけを定期的にポーリングし、企業ごとの時間別使用状況を更新し続ける
+
+    各ポーリングでは、稼働中または前回のポーリング以降にheartbeatが更新されたrunだけを
+    サーバー側のフィルタで取得し、前回までに取り込んだサンプルより新しいものだけを集計に加える。
+    runごとの最後の_timestampは状態に保存し、初めて見たrunだけeventsストリームから当日分を取り込む。
+    eventsストリームは開始位置を指定して取得できないため、以降はrun一覧と一緒に返る末尾の数行（eventsTail）と
+    最新のシステムメトリクスのうち、_timestampより新しいものだけを加え、runごとの履歴は再取得しない。
+    ポーリングの間に末尾の行数より多く記録されたサンプルは取り込まれないため、
+    時間別の平均GPUパフォーマンス率は各ポーリング時点の直近のサンプルから求めた値になる。
+    """
+
+    def __init__(self, interval_minutes: int, retention_hours: int):
+        self.interval_minutes = interval_minutes
+        self.retention_hours = retention_hours
+        self.team_to_company = {team: c.company for c in get_companies() for team in c.teams}
+        self.calendar = AllocationCalendar()
+        cache_dir = Path(CONFIG.get("cache_dir", CONFIG.wandb_dir))
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.state_path = cache_dir / "intraday_state.json"
+        self.contributions_path = cache_dir / "intraday_contributions.parquet"
+        self.run_manager: Optional[RunManager] = None
+        self.target_date: Optional[dt.date] = None
+        self.wandb_run = None
+        self.__load_state()
+
+    def run_forever(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error during intraday poll: {str(e)}")
+            time.sleep(max(0.0, self.interval_minutes * 60 - (time.monotonic() - started)))
+
+    def poll(self) -> None:
+        now_utc = dt.datetime.utcnow().replace(microsecond=0)
+        today = (now_utc + dt.timedelta(hours=JAPAN_UTC_OFFSET)).date()
+        if self.target_date != today:
+            # 日付が変わったらプロジェクト一覧と公開先のrunを作り直す
+            self.run_manager = RunManager([today.strftime("%Y-%m-%d")] * 2)
+            self.run_manager.fetch_projects()
+            self.target_date = today
+            self.__finish_wandb_run()
+
+        # 初回は当日0時（日本時間）以降を対象にする
+        day_start_utc = dt.datetime.combine(today, dt.time()) - dt.timedelta(hours=JAPAN_UTC_OFFSET)
+        since = self.last_poll or day_start_utc
+
+        active_runs, latest_samples = self.__query_active_runs(since)
+        frames = [self.__process_run(run, latest_samples.get(run.run_path, [])) for run in active_runs]
+        frames = [df for df in frames if not df.is_empty()]
+        if frames:
+            self.contributions = (
+                pl.concat([self.contributions, *frames])
+                .group_by(["company", "hour", "run_id"])
+                .agg(pl.col("gpu_hours").sum(), pl.col("sum_gpu_utilization").sum(), pl.col("n_samples").sum())
+            )
+
+        # 保持期間より古い時間帯は捨てる
+        now_jst = now_utc + dt.timedelta(hours=JAPAN_UTC_OFFSET)
+        self.contributions = self.contributions.filter(
+            pl.col("hour") >= now_jst - dt.timedelta(hours=self.retention_hours)
+        )
+        self.last_poll = now_utc
+        self.__save_state()
+        self.__publish()
+        logger.info(f"Intraday poll at {now_jst} (JST): {len(active_runs)} active runs")
+
+    def hourly_table(self) -> pl.DataFrame:
+        """企業×時間の使用状況テーブルを作成する"""
+        allocation = self.calendar.calendar.rename({"date": "day"})
+        return (
+            self.contributions
+            .group_by(["company", "hour"])
+            .agg(
+                pl.col("gpu_hours").sum(),
+                pl.col("sum_gpu_utilization").sum(),
+                pl.col("n_samples").sum(),
+                pl.col("run_id").n_unique().alias("n_runs"),
+            )
+            .with_columns(pl.col("hour").dt.date().alias("day"))
+            .join(allocation, on=["company", "day"], how="left")
+            .with_columns(
+                pl.min_horizontal(
+                    pl.col("gpu_hours") / (pl.col("assigned_gpu_node") * GPU_PER_NODE) * 100,
+                    pl.lit(100.0),
+                ).alias("utilization_rate"),
+                (pl.col("sum_gpu_utilization") / pl.col("n_samples")).alias("average_gpu_utilization"),
+            )
+            .select(
+                pl.col("company").alias("企業名"),
+                pl.col("hour").dt.strftime("%Y-%m-%d %H:00").alias("時刻"),
+                pl.col("gpu_hours").fill_null(0).round(1).alias("合計GPU使用時間(h)"),
+                pl.col("utilization_rate").fill_null(0).fill_nan(0).round(1).alias("GPU稼働率(%)"),
+                pl.col("average_gpu_utilization").fill_null(0).fill_nan(0).round(1).alias("平均GPUパフォーマンス率(%)"),
+                pl.col("n_runs"),
+                pl.col("assigned_gpu_node"),
+            )
+            .sort(["企業名", "時刻"], descending=[False, True])
+        )
+
+    def __query_active_runs(self, since: dt.datetime) -> Tuple[List[Run], Dict[str, List[dict]]]:
+        """稼働中のrunと、runごとの直近のシステムメトリクスのサンプルを取得する"""
+        filters = json.dumps({"$or": [{"state": "running"}, {"heartbeatAt": {"$gt": since.isoformat()}}]})
+        runs = []
+        latest_samples = {}
+        for team_config in self.run_manager.team_configs:
+            for project in team_config.projects or []:
+                nodes = []
+                cursor = ""
+                try:
+                    while True:
+                        results = self.run_manager.api.client.execute(
+                            gql(GQL_ACTIVE_RUNS_QUERY),
+                            {
+                                "entity": team_config.team,
+                                "project": project.project,
+                                "first": 1000,
+                                "cursor": cursor,
+                                "filters": filters,
+                            },
+                        )
+                        edges = results["project"]["runs"]["edges"]
+                        if not edges:
+                            break
+                        nodes += [EasyDict(e["node"]) for e in edges]
+                        cursor = edges[-1]["cursor"]
+                except Exception as e:
+                    logger.warning(f"Failed to query active runs for {team_config.team}/{project.project}: {str(e)}")
+                for node in nodes:
+                    latest_samples["/".join((team_config.team, project.project, node.name))] = tail_samples(node)
+                runs += self.run_manager.build_runs(
+                    nodes, team_config.team, project.project, team_config.start_date, team_config.end_date
+                )
+        return runs, latest_samples
+
+    def __process_run(self, run: Run, latest_samples: List[dict]) -> pl.DataFrame:
+        """前回のポーリング以降に増えた稼働時間とサンプルだけを時間別に集計する"""
+        team, _, run_id = run.run_path.split("/")
+        day_start = dt.datetime.combine(self.target_date, dt.time())
+        prev_heartbeat, prev_timestamp = self.watermarks.get(run.run_path, (max(run.created_at, day_start), None))
+
+        # 稼働時間：前回のheartbeatから今回のheartbeatまでを1分刻みで時間ごとに集計
+        duration_df = pl.DataFrame(schema={"hour": pl.Datetime("us"), "gpu_hours": pl.Float64})
+        if run.updated_at > prev_heartbeat:
+            minutes = pl.datetime_range(prev_heartbeat, run.updated_at, interval="1m", closed="left", eager=True)
+            duration_df = (
+                pl.DataFrame({"hour": minutes.dt.truncate("1h")})
+                .group_by("hour")
+                .agg(pl.count().truediv(60).mul(run.gpu_count).cast(pl.Float64).alias("gpu_hours"))
+                .with_columns(pl.col("hour").cast(pl.Datetime("us")))
+            )
+
+        if prev_timestamp is None:
+            samples_df, last_timestamp = self.__fetch_new_samples(run.run_path, prev_timestamp)
+        else:
+            samples_df, last_timestamp = self.__aggregate_samples(latest_samples, prev_timestamp)
+        self.watermarks[run.run_path] = (max(run.updated_at, prev_heartbeat), last_timestamp)
+
+        return (
+            duration_df.join(samples_df, on="hour", how="outer_coalesce")
+            .with_columns(
+                pl.lit(self.team_to_company.get(team, team)).alias("company"),
+                pl.lit(run_id).alias("run_id"),
+                pl.col("gpu_hours").fill_null(0.0),
+                pl.col("sum_gpu_utilization").fill_null(0.0),
+                pl.col("n_samples").fill_null(0),
+            )
+            .select([pl.col(name).cast(dtype) for name, dtype in CONTRIBUTION_SCHEMA.items()])
+        )
+
+    def __fetch_new_samples(self, run_path: str, prev_timestamp: Optional[float]) -> Tuple[pl.DataFrame, Optional[float]]:
+        """初めて見たrunについて、eventsストリームのサンプルを時間別に集計する
+
+        eventsストリームは開始位置を指定できず毎回run全体を返すため、ウォーターマークがないときだけ使う。
+        """
+        try:
+            lines = self.run_manager.api.run(path=run_path).history(stream="events", samples=1000, pandas=False)
+        except Exception as e:
+            logger.warning(f"Failed to fetch events for {run_path}: {str(e)}")
+            return EMPTY_SAMPLES, prev_timestamp
+        return self.__aggregate_samples(lines, prev_timestamp)
+
+    def __aggregate_samples(self, lines: List[dict], prev_timestamp: Optional[float]) -> Tuple[pl.DataFrame, Optional[float]]:
+        """前回取り込んだ_timestampより新しいサンプルだけを時間別に集計する"""
+        lines = [line for line in lines if line.get("_timestamp") is not None]
+        if not lines:
+            return EMPTY_SAMPLES, prev_timestamp
+
+        events_df = pl.from_dicts(lines, infer_schema_length=None)
+        if prev_timestamp is not None:
+            events_df = events_df.filter(pl.col("_timestamp") > prev_timestamp)
+        if events_df.is_empty():
+            return EMPTY_SAMPLES, prev_timestamp
+        # GPUのメトリクスがないサンプルも取り込み済みとして、次回以降は再取得しない
+        last_timestamp = events_df["_timestamp"].max()
+        gpu_columns = [c for c in events_df.columns if re.match(GPU_UTILIZATION_PTN, c)]
+        if not gpu_columns:
+            return EMPTY_SAMPLES, last_timestamp
+
+        samples_df = (
+            events_df
+            .select(
+                (pl.from_epoch(pl.col("_timestamp").cast(pl.Float64).mul(1e6).cast(pl.Int64), time_unit="us")
+                 + pl.duration(hours=JAPAN_UTC_OFFSET)).dt.truncate("1h").alias("hour"),
+                pl.concat_list([pl.col(c).cast(pl.Float64) for c in gpu_columns]).list.mean().alias("sample_utilization"),
+            )
+            .group_by("hour")
+            .agg(
+                pl.col("sample_utilization").sum().alias("sum_gpu_utilization"),
+                pl.col("sample_utilization").count().cast(pl.Int64).alias("n_samples"),
+            )
+        )
+        return samples_df, last_timestamp
+
+    def __publish(self) -> None:
+        if self.wandb_run is None:
+            self.wandb_run = wandb.init(
+                entity=CONFIG.dashboard.entity,
+                project=CONFIG.dashboard.project,
+                name=f"Intraday_{self.target_date}",
+                job_type="intraday",
+                tags=["intraday"],
+            )
+        self.wandb_run.log({"intraday_gpu_usage": to_wandb_table(self.hourly_table())})
+
+    def __finish_wandb_run(self) -> None:
+        if self.wandb_run is not None:
+            self.wandb_run.finish()
+            self.wandb_run = None
+
+    def __load_state(self) -> None:
+        """再起動しても続きから集計できるよう、前回の状態を読み込む"""
+        self.watermarks: Dict[str, Tuple[dt.datetime, Optional[float]]] = {}
+        self.last_poll: Optional[dt.datetime] = None
+        self.contributions = pl.DataFrame(schema=CONTRIBUTION_SCHEMA)
+        if self.state_path.exists() and self.contributions_path.exists():
+            try:
+                state = json.loads(self.state_path.read_text())
+                self.last_poll = dt.datetime.fromisoformat(state["last_poll"])
+                self.watermarks = {
+                    run_path: (dt.datetime.fromisoformat(heartbeat), timestamp)
+                    for run_path, (heartbeat, timestamp) in state["watermarks"].items()
+                }
+                self.contributions = pl.read_parquet(self.contributions_path)
+            except Exception as e:
+                logger.warning(f"Failed to load intraday state: {str(e)}")
+
+    def __save_state(self) -> None:
+        # 保持期間を過ぎたrunのウォーターマークは捨てる
+        horizon = self.last_poll + dt.timedelta(hours=JAPAN_UTC_OFFSET - self.retention_hours)
+        self.watermarks = {k: v for k, v in self.watermarks.items() if v[0] >= horizon}
+        state = {
+            "last_poll": self.last_poll.isoformat(),
+            "watermarks": {k: [v[0].isoformat(), v[1]] for k, v in self.watermarks.items()},
+        }
+        self.contributions.write_parquet(self.contributions_path)
+        self.state_path.write_text(json.dumps(state))
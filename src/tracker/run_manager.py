@@ -3,21 +3,29 @@ import re
 import json
 import time
 import gc
+import logging
 import threading
 from functools import wraps
 from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
 import datetime as dt
 import polars as pl
 from fnmatch import fnmatch
-from tqdm import tqdm
 from easydict import EasyDict
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from wandb_gql import gql
 
+from src.tracker.activity import active_hours_per_day
 from src.tracker.common import JAPAN_UTC_OFFSET, LOGGED_AT, GQL_QUERY, Run, Project
 from src.tracker.config_parser import parse_configs
+from src.tracker.fetch_plan import estimate_projects, load_fetch_stats, log_plan, rates, save_fetch_stats
 from src.tracker.set_gpucount import set_gpucount
-from src.utils.config import CONFIG
+from src.tracker.sharding import select_shard
+from src.utils.config import CONFIG, get_companies
+from src.utils.log import ErrorSampler, Progress, get_logger
+from src.utils.quantile_sketch import build_sketches
+from src.utils.tracing import TRACER
+
+logger = get_logger(__name__)
 
 def timeout(seconds):
     def decorator(func):
@@ -46,20 +54,59 @@ def timeout(seconds):
     return decorator
 
 class RunManager:
-    def __init__(self, date_range: List, test_mode: bool = False):
-        self.team_configs = parse_configs(CONFIG)
+    def __init__(
+        self,
+        date_range: List,
+        test_mode: bool = False,
+        shard: Optional[Tuple[int, int]] = None,
+        team_weights: Optional[Dict[str, int]] = None,
+        fetch_stats: Optional[Dict[str, dict]] = None,
+        record_stats: bool = True,
+    ):
+        self.team_configs = parse_configs(get_companies())
+        if shard is not None:
+            self.team_configs = select_shard(self.team_configs, shard, team_weights)
+            logger.info(f"Shard {shard[0]}/{shard[1]}: {[tc.team for tc in self.team_configs]}")
         self.start_date = dt.datetime.strptime(date_range[0], "%Y-%m-%d").date()
         self.end_date = dt.datetime.strptime(date_range[1], "%Y-%m-%d").date()
         self.api = wandb.Api(timeout=60)
         self.test_mode = test_mode
         self.total_valid_runs = 0
+        self.team_run_counts = {}
+        self.errors = ErrorSampler(logger)
+        # 前回の取得の記録（見積もり用）と、今回の取得の記録
+        self.fetch_stats = fetch_stats if fetch_stats is not None else load_fetch_stats()
+        # 1晩分の取得でない場合（バックフィルのウィンドウや再生）は、見積もり用の記録を上書きしない
+        self.record_stats = record_stats
+        self.project_stats: Dict[str, dict] = {}
+        self.project_order: Dict[str, int] = {}
+        self.expected_fetch_sec = 0.0
+        self.fetch_started = 0.0
+        self.lock = threading.Lock()
     
     def fetch_runs(self):
-        self.__get_projects()
-        self.__get_runs()
-        self.__get_metrics()
-        combined_df = self.__combined_run_df()
+        with TRACER.span("discover_projects"):
+            self.__get_projects()
+        self.__plan_fetch()
+        with TRACER.span("list_runs"):
+            self.__get_runs()
+        with TRACER.span("fetch_metrics"):
+            self.__get_metrics()
+        with TRACER.span("build_run_df"):
+            combined_df = self.__combined_run_df()
+            TRACER.count("rows", len(combined_df))
+        self.errors.summary()
+        self.__save_fetch_stats()
         return combined_df
+
+    def fetch_projects(self):
+        """対象チームのプロジェクト一覧だけを取得する"""
+        self.__get_projects()
+        return self.team_configs
+
+    def build_runs(self, nodes: List[EasyDict], team: str, project: str, start: dt.date, end: dt.date) -> List[Run]:
+        """GraphQLで取得したノードを検証し、Runに変換する"""
+        return self.__process_nodes(nodes, team, project, start, end)
     
     def __get_projects(self):
         for team_config in self.team_configs:
@@ -76,73 +123,152 @@ class RunManager:
                             if not ignore or not fnmatch(project.name, ignore):
                                 projects.append(Project(project=project.name))
                     team_config.projects = projects
+                    TRACER.count("projects", len(projects))
                 except Exception as e:
-                    print(f"Error fetching projects for {team_config.team}: {str(e)}")
+                    logger.error(f"Error fetching projects for {team_config.team}: {str(e)}")
                     team_config.projects = []
             else:
                 team_config.projects = []
 
+    def __plan_fetch(self):
+        """前回の記録から取得量を見積もり、重いプロジェクトから処理する順番を決める"""
+        projects = [(tc.team, project.project) for tc in self.team_configs for project in tc.projects]
+        estimates = estimate_projects(projects, self.fetch_stats)
+        self.project_order = {estimate.key: i for i, estimate in enumerate(estimates)}
+        self.expected_fetch_sec = log_plan(estimates, CONFIG.max_workers)
+        self.fetch_started = time.perf_counter()
+
+    def __record(self, key: str, **values):
+        """今回の取得の記録をプロジェクトごとに加算する"""
+        with self.lock:
+            stats = self.project_stats.setdefault(
+                key, {"pages": 0, "nodes": 0, "valid_runs": 0, "history_calls": 0, "list_sec": 0.0, "metrics_sec": 0.0}
+            )
+            for name, value in values.items():
+                stats[name] += value
+
+    def __save_fetch_stats(self):
+        """今回取得したプロジェクトの記録で前回の記録を更新し、次回の見積もりのために保存する"""
+        stats = {
+            key: {name: round(value, 3) if isinstance(value, float) else value for name, value in project_stats.items()}
+            for key, project_stats in self.project_stats.items()
+        }
+        self.fetch_stats = {**self.fetch_stats, **stats}
+        logger.info(
+            f"Fetch took {(time.perf_counter() - self.fetch_started) / 60:.1f} min "
+            f"(estimated {self.expected_fetch_sec / 60:.1f} min)"
+        )
+        if self.record_stats and not self.test_mode:
+            try:
+                save_fetch_stats(self.fetch_stats)
+            except OSError as e:
+                logger.warning(f"Failed to save fetch stats: {str(e)}")
+
     def __get_runs(self):
-        for team_config in self.team_configs:
-            print(f"Get runs for {team_config.team} ...")
-            for i, project in enumerate(team_config.projects):
-                print(f"Processing project {i+1}/{len(team_config.projects)}: {project.project}")
-                project.runs = self.__query_runs(
-                    team=team_config.team,
-                    project=project.project,
-                    start=team_config.start_date,
-                    end=team_config.end_date,
-                    )
-        print(f"\nTotal valid runs across all projects: {self.total_valid_runs}")
-    
+        # 共有のワーカーに、一覧の取得が重いプロジェクトから投入する
+        work = sorted(
+            ((team_config, project) for team_config in self.team_configs for project in team_config.projects),
+            key=lambda w: self.project_order.get(f"{w[0].team}/{w[1].project}", len(self.project_order)),
+        )
+        progress = Progress("list_runs", total=len(work))
+        with ThreadPoolExecutor(max_workers=max(min(CONFIG.max_workers, len(work)), 1)) as executor:
+            futures = [executor.submit(self.__list_project_runs, team_config, project) for team_config, project in work]
+            for future in as_completed(futures):
+                future.result()
+                progress.advance()
+        progress.close()
+        logger.info(f"Total valid runs across all projects: {self.total_valid_runs}")
+
+    def __list_project_runs(self, team_config, project):
+        logger.debug(f"Get runs for {team_config.team}/{project.project} ...")
+        start = time.perf_counter()
+        project.runs = self.__query_runs(
+            team=team_config.team,
+            project=project.project,
+            start=team_config.start_date,
+            end=team_config.end_date,
+        )
+        self.__record(f"{team_config.team}/{project.project}", list_sec=time.perf_counter() - start)
+
     def __get_metrics(self):
-        print("Get metrics for each run ...")
-        for team_config in self.team_configs:
-            print(f"Processing team: {team_config.team}")
-            for project in tqdm(team_config.projects, desc="Projects"):
-                print(f"Processing project: {project.project}")
-                if project.runs:
-                    self.__process_project_runs(project)
-                else:
-                    print(f"Skipping project {project.project} as it has no runs.")
+        # 有効なrun数が分かったので見積もり直し、履歴の取得が重いプロジェクトのrunから共有のワーカーに投入する
+        calls_per_run = rates(self.fetch_stats)["history_calls_per_run"]
+
+        def expected_calls(key: str, n_runs: int) -> float:
+            stats = self.fetch_stats.get(key)
+            if stats and stats.get("valid_runs"):
+                return n_runs * stats.get("history_calls", 0) / stats["valid_runs"]
+            return n_runs * calls_per_run
+
+        projects = sorted(
+            (
+                (f"{team_config.team}/{project.project}", project)
+                for team_config in self.team_configs
+                for project in team_config.projects
+                if project.runs
+            ),
+            key=lambda p: (-expected_calls(p[0], len(p[1].runs)), p[0]),
+        )
+        runs = [run for _, project in projects for run in project.runs]
+        progress = Progress("fetch_metrics", total=len(runs))
+        with ThreadPoolExecutor(max_workers=max(min(CONFIG.max_workers, len(runs)), 1)) as executor:
+            futures = {executor.submit(self.__create_metrics_df_with_retry, run.run_path): run for run in runs}
+            for future in as_completed(futures):
+                run = futures[future]
+                try:
+                    metrics_df = future.result(timeout=300)
+                    run.metrics_df = metrics_df
+                    progress.advance()
+                except Exception as e:
+                    self.errors.log("fetch_metrics", f"Error retrieving metrics for run {run.run_path}: {str(e)}")
+                    run.metrics_df = pl.DataFrame()
+                    progress.advance(failed=True)
                 gc.collect()
+        progress.close()
     
     def __combined_run_df(self):
-        print("Create combined run DataFrame ...")
+        progress = Progress("build_run_df", total=self.total_valid_runs)
         combined_df = pl.DataFrame()
-        for team_config in tqdm(self.team_configs, desc="Processing teams"):
-            print(f"  Team: {team_config.team}")
+        for team_config in self.team_configs:
             if not team_config.projects:
-                print(f"  Skipping team {team_config.team} as it has no projects.")
+                logger.debug(f"Skipping team {team_config.team} as it has no projects.")
                 continue
             for project in team_config.projects:
                 if not hasattr(project, 'runs') or not project.runs:
-                    print(f"  Skipping project {project.project} as it has no runs.")
+                    logger.debug(f"Skipping project {project.project} as it has no runs.")
                     continue
-                print(f"  Processing {len(project.runs)} runs for project {project.project}")
+                logger.debug(f"Processing {len(project.runs)} runs for project {project.project}")
                 for run in project.runs:
                     try:
                         new_run_df = self.__create_run_df(run)
                         if not new_run_df.is_empty():
                             combined_df = pl.concat([combined_df, new_run_df])
+                        progress.advance()
                     except Exception as e:
-                        print(f"Error processing run {run.run_path}: {str(e)}")
-                        print(f"Run details: created_at={run.created_at}, updated_at={run.updated_at}, state={run.state}")
+                        self.errors.log(
+                            "build_run_df",
+                            f"Error processing run {run.run_path}: {str(e)} "
+                            f"(created_at={run.created_at}, updated_at={run.updated_at}, state={run.state})",
+                        )
+                        progress.advance(failed=True)
                 gc.collect()
+        progress.close()
         
         if not combined_df.is_empty():
-            print(f"Total runs processed: {len(combined_df)}")
+            logger.info(f"Total runs processed: {len(combined_df)}")
             return combined_df
         else:
-            print("Warning: No valid DataFrames were created.")
+            logger.warning("No valid DataFrames were created.")
             return pl.DataFrame()
     
     def __query_runs(self, team: str, project: str, start: str, end: str) -> list[Run]:
         cursor = ""
         nodes = []
         total_processed = 0
+        pages = 0
 
-        print(f"Starting to query runs for {team}/{project}")
+        logger.debug(f"Starting to query runs for {team}/{project}")
+        filters = self.__period_filters()
 
         while True:
             try:
@@ -153,21 +279,33 @@ class RunManager:
                         "project": project,
                         "first": 1000,
                         "cursor": cursor,
+                        "filters": filters,
                     },
                 )
+                TRACER.count("graphql_pages")
+                pages += 1
                 _edges = results["project"]["runs"]["edges"]
                 if not _edges:
-                    return self.__process_nodes(nodes, team, project, start, end)
+                    break
                 new_nodes = [EasyDict(e["node"]) for e in _edges]
                 nodes += new_nodes
                 total_processed += len(new_nodes)
-                print(f"Processed {len(new_nodes)} runs for {team}/{project}. Total processed: {total_processed}")
+                logger.debug(f"Processed {len(new_nodes)} runs for {team}/{project}. Total processed: {total_processed}")
                 cursor = _edges[-1]["cursor"]
             except Exception as e:
-                print(f"Failed to execute query for {team}/{project}")
-                print(f"Error details: {str(e)}")
-                return self.__process_nodes(nodes, team, project, start, end)
+                logger.error(f"Failed to execute query for {team}/{project}: {str(e)}")
+                break
+        self.__record(f"{team}/{project}", pages=pages, nodes=len(nodes))
+        return self.__process_nodes(nodes, team, project, start, end)
     
+    def __period_filters(self) -> str:
+        """取得期間と重なるrunのフィルタ（日本時間の日付での判定は__is_run_validで行う）"""
+        period_start = dt.datetime.combine(self.start_date, dt.time()) - dt.timedelta(hours=JAPAN_UTC_OFFSET)
+        period_end = dt.datetime.combine(self.end_date + dt.timedelta(days=1), dt.time()) - dt.timedelta(hours=JAPAN_UTC_OFFSET)
+        return json.dumps(
+            {"$and": [{"heartbeatAt": {"$gte": period_start.isoformat()}}, {"createdAt": {"$lt": period_end.isoformat()}}]}
+        )
+
     def __process_nodes(self, nodes: List[EasyDict], team: str, project: str, start: str, end: str) -> List[Run]:
         runs = []
         for node in nodes:
@@ -188,8 +326,12 @@ class RunManager:
                     gpu_count=gpu_count,
                 )
                 runs.append(run)
-        self.total_valid_runs += len(runs)
-        print(f"Total valid runs for {team}/{project}: {len(runs)}")
+        with self.lock:
+            self.total_valid_runs += len(runs)
+            self.team_run_counts[team] = self.team_run_counts.get(team, 0) + len(runs)
+        TRACER.count("valid_runs", len(runs))
+        self.__record(f"{team}/{project}", valid_runs=len(runs))
+        logger.debug(f"Total valid runs for {team}/{project}: {len(runs)}")
         return runs
 
     def __is_run_valid(self, node, createdAt, updatedAt, start, end) -> bool:
@@ -216,24 +358,6 @@ class RunManager:
 
         return True
 
-    def __process_project_runs(self, project):
-        max_workers = min(CONFIG.max_workers, len(project.runs))
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(self.__create_metrics_df_with_retry, run.run_path): run for run in project.runs}
-            completed = 0
-            for future in tqdm(as_completed(futures), total=len(futures), desc=f"Processing {project.project}"):
-                run = futures[future]
-                try:
-                    metrics_df = future.result(timeout=300)
-                    run.metrics_df = metrics_df
-                except Exception as e:
-                    print(f"Error retrieving metrics for run {run.run_path}: {str(e)}")
-                    run.metrics_df = pl.DataFrame()
-                completed += 1
-                gc.collect()
-        
-        print(f"Completed processing {len(project.runs)} runs for {project.project}")
-    
     def __create_metrics_df_with_retry(self, run_path: str, max_retries=3, initial_timeout=5):
         for attempt in range(max_retries):
             try:
@@ -244,24 +368,32 @@ class RunManager:
                 return attempt_create_metrics_df()
 
             except TimeoutError:
+                TRACER.count("metrics_timeouts")
                 if attempt < max_retries - 1:
-                    print(f"Timeout occurred for run {run_path}. Retrying (attempt {attempt + 1}/{max_retries})...")
+                    TRACER.count("retries")
+                    self.errors.log("timeout", f"Timeout occurred for run {run_path}. Retrying (attempt {attempt + 1}/{max_retries})...")
                     time.sleep(5)
                 else:
-                    print(f"Failed to retrieve metrics for run {run_path} after {max_retries} attempts")
+                    self.errors.log("timeout_failed", f"Failed to retrieve metrics for run {run_path} after {max_retries} attempts", logging.ERROR)
                     return pl.DataFrame()
             except Exception as e:
+                TRACER.count("metrics_errors")
                 if attempt < max_retries - 1:
-                    print(f"Error processing run {run_path} (attempt {attempt + 1}/{max_retries}): {str(e)}")
+                    TRACER.count("retries")
+                    self.errors.log("retry", f"Error processing run {run_path} (attempt {attempt + 1}/{max_retries}): {str(e)}")
                     time.sleep(5)
                 else:
-                    print(f"Failed to process run {run_path} after {max_retries} attempts: {str(e)}")
+                    self.errors.log("failed", f"Failed to process run {run_path} after {max_retries} attempts: {str(e)}", logging.ERROR)
                     return pl.DataFrame()
 
     def __create_metrics_df(self, run_path: str) -> pl.DataFrame:
+        start = time.perf_counter()
         try:
             run = self.api.run(path=run_path)
             metrics_df = pl.from_dataframe(run.history(stream="events", samples=100))
+            TRACER.count("history_calls")
+            self.__record(run_path.rsplit("/", 1)[0], history_calls=1)
+            TRACER.count("history_rows", len(metrics_df))
             if len(metrics_df) <= 1:
                 return pl.DataFrame()
 
@@ -282,17 +414,23 @@ class RunManager:
             return daily_metrics_df
 
         except Exception as e:
-            print(f"Error processing run {run_path}: {str(e)}")
+            self.errors.log("metrics", f"Error processing run {run_path}: {str(e)}")
             return pl.DataFrame()
+        finally:
+            self.__record(run_path.rsplit("/", 1)[0], metrics_sec=time.perf_counter() - start)
     
+    @staticmethod
+    def __datetime_expr() -> pl.Expr:
+        # _timestampはUTCのepoch秒。createdAt/heartbeatAtと同じく日本時間に揃える
+        return (
+            pl.from_epoch(pl.col("_timestamp").cast(pl.Float64).mul(1e6).cast(pl.Int64), time_unit="us")
+            + pl.duration(hours=JAPAN_UTC_OFFSET)
+        ).alias("datetime")
+
     def __add_datetime_and_filter(self, metrics_df: pl.DataFrame) -> pl.DataFrame:
         return (
             metrics_df
-            .with_columns(
-                pl.col("_timestamp")
-                .map_elements(lambda x: dt.datetime.fromtimestamp(x))
-                .alias("datetime")
-            )
+            .with_columns(self.__datetime_expr())
             .filter(
                 (pl.col("datetime").dt.date() >= self.start_date) &
                 (pl.col("datetime").dt.date() < self.end_date + dt.timedelta(days=1))
@@ -313,7 +451,7 @@ class RunManager:
         gpu_ptn = "^system\.gpu\.\d+\.gpu$"
         memory_ptn = "^system\.gpu\.\d+\.memory$"
         
-        return (
+        daily_metrics_df = (
             df
             .with_columns(pl.col("datetime").dt.date().alias("date"))
             .melt(
@@ -328,9 +466,6 @@ class RunManager:
             .agg(
                 pl.col("value").mean().alias("average"),
                 pl.col("value").max().alias("max"),
-                pl.col("_timestamp")
-                .map_elements(lambda x: (max(x) - min(x)) / 60**2)
-                .alias("metrics_hours"),
             )
             .pivot(index="date", columns="gpu", values=["average", "max"])
             .rename({f"{prefix}_gpu_gpu": f"{prefix}_gpu_utilization" for prefix in ("average", "max")})
@@ -342,6 +477,35 @@ class RunManager:
                 pl.col("max_gpu_memory").cast(pl.Float64),
             )
         )
+        return (
+            daily_metrics_df
+            .join(
+                self.__build_utilization_sketches(df, [c for c in original_df.columns if re.findall(gpu_ptn, c)]),
+                on="date",
+                how="left",
+            )
+            # サンプルの間隔から、実際に稼働していた時間を日ごとに求める。
+            # 期間の前後のサンプルとの間隔やしきい値も使うため、日付で絞り込む前のサンプルから求める
+            # （日付の境界で分割されるので、leftのjoinで対象期間の日だけが残る）
+            .join(
+                active_hours_per_day(original_df.select(self.__datetime_expr()).drop_nulls()),
+                on="date",
+                how="left",
+            )
+        )
+
+    def __build_utilization_sketches(self, df: pl.DataFrame, gpu_columns: List[str]) -> pl.DataFrame:
+        """日付ごとに、GPU番号別のGPU使用率の分位点スケッチを作成する"""
+        long_df = (
+            df
+            .with_columns(pl.col("datetime").dt.date().alias("date"))
+            .melt(id_vars=["date"], value_vars=gpu_columns, variable_name="gpu", value_name="value")
+            .with_columns(pl.col("gpu").str.split(".").list.get(2).cast(pl.Int64))
+        )
+        return build_sketches(long_df, ["date"], "gpu", "value").select(
+            pl.col("date").cast(pl.Date),
+            pl.col("sketch").cast(pl.Utf8).alias("gpu_utilization_sketch"),
+        )
     
     def __create_run_df(self, run: Run) -> pl.DataFrame:
         duration_df = self.__calculate_daily_duration(run.created_at, run.updated_at)
@@ -349,7 +513,7 @@ class RunManager:
         metrics_columns = [
             pl.lit(None).cast(pl.Float64).alias(col) for col in 
             ["average_gpu_utilization", "max_gpu_utilization", "average_gpu_memory", "max_gpu_memory"]
-        ]
+        ] + [pl.lit(None).cast(pl.Utf8).alias("gpu_utilization_sketch"), pl.lit(None).cast(pl.Float64).alias("active_hour")]
         
         new_run_df = (
             duration_df.with_columns(metrics_columns) if run.metrics_df.is_empty()
@@ -373,7 +537,8 @@ class RunManager:
             "date", "company_name", "project", "run_id", "tags",
             "created_at", "updated_at", "state", "duration_hour", "gpu_count",
             "average_gpu_utilization", "average_gpu_memory",
-            "max_gpu_utilization", "max_gpu_memory", "host_name", "logged_at"
+            "max_gpu_utilization", "max_gpu_memory", "host_name", "logged_at",
+            "gpu_utilization_sketch", "active_hour",
         ])
 
     def __calculate_daily_duration(self, start: dt.datetime, end: dt.datetime) -> pl.DataFrame:
@@ -2,10 +2,11 @@ from typing import Dict, Any
 from easydict import EasyDict
 import json
 import logging
+from src.utils.log import ErrorSampler, get_logger
 
-# ロギングの設定
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# ロギングの設定（runごとの計算結果はDEBUG、警告は種類ごとに間引く）
+logger = get_logger(__name__)
+warnings = ErrorSampler(logger)
 
 # 定数
 TEAM_CONFIGS = {
@@ -34,7 +35,7 @@ def get_config_value(config: Dict[str, Any], key: str) -> int:
     try:
         return int(value)
     except (ValueError, TypeError):
-        logger.warning(f"Could not convert '{value}' to int. Using 0 instead.")
+        warnings.log(f"convert:{key}", f"Could not convert '{value}' to int. Using 0 instead.")
         return 0
 
 def get_config_value_multi(config: Dict[str, Any], keys: tuple) -> int:
@@ -51,7 +52,7 @@ def set_gpucount(node: EasyDict, team: str) -> int:
     gpu_count = node.runInfo.gpuCount if node.runInfo else 0
     
     if team not in TEAM_CONFIGS:
-        logger.warning(f"Unknown team {team}. Using default GPU count.")
+        warnings.log(f"unknown_team:{team}", f"Unknown team {team}. Using default GPU count.")
         return gpu_count
 
     config_dict = json.loads(node.config)
@@ -77,8 +78,8 @@ def set_gpucount(node: EasyDict, team: str) -> int:
         else:
             gpu_count = num_nodes
         
-        logger.info(f"Calculated GPU count for {team} ({node.name}): {gpu_count}")
+        logger.debug(f"Calculated GPU count for {team} ({node.name}): {gpu_count}")
     except Exception as e:
-        logger.error(f"Error calculating GPU count for {team} ({node.name}): {str(e)}")
+        warnings.log(f"error:{team}", f"Error calculating GPU count for {team} ({node.name}): {str(e)}", logging.ERROR)
     
     return gpu_count
\ No newline at end of file
@@ -0,0 +1,39 @@
+from typing import Dict, List, Optional, Tuple
+
+from src.tracker.config_parser import TeamConfig
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """'i/n'形式の指定をパースする（iは1始まり）"""
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}'. Use the form i/n (e.g. 1/4).")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{spec}'. i must be between 1 and n.")
+    return index, count
+
+def assign_shards(teams: List[str], count: int, team_weights: Optional[Dict[str, int]] = None) -> List[List[str]]:
+    """過去のrun数が均等になるようにチームをシャードに割り振る
+
+    重い順に、その時点で最も軽いシャードへ割り当てる。同じ入力なら常に同じ結果になる。
+    """
+    team_weights = team_weights or {}
+    shards = [[] for _ in range(count)]
+    loads = [0] * count
+    # 過去のrun数が不明なチームは1件として扱う
+    for team in sorted(teams, key=lambda t: (-max(team_weights.get(t, 1), 1), t)):
+        target = min(range(count), key=lambda i: (loads[i], i))
+        shards[target].append(team)
+        loads[target] += max(team_weights.get(team, 1), 1)
+    return shards
+
+def select_shard(
+    team_configs: List[TeamConfig],
+    shard: Tuple[int, int],
+    team_weights: Optional[Dict[str, int]] = None,
+) -> List[TeamConfig]:
+    """指定シャードに割り当てられたチームの設定だけを返す"""
+    index, count = shard
+    shards = assign_shards([tc.team for tc in team_configs], count, team_weights)
+    selected = set(shards[index - 1])
+    return [tc for tc in team_configs if tc.team in selected]
@@ -3,8 +3,13 @@ import json
 import pandas as pd
 import polars as pl
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from ..uploader.data_processor import DataProcessor
 from ..utils.config import CONFIG
+from ..utils.log import get_logger
+from ..utils.tracing import TRACER
+
+logger = get_logger(__name__)
 
 class ArtifactHandler:
     @staticmethod
@@ -26,37 +31,143 @@ class ArtifactHandler:
                 artifact = run.use_artifact(f"{artifact_path}")
                 artifact_dir = Path(artifact.download(wandb_dir))
                 csv_path = artifact_dir / f"{artifact_name}.csv"
-                old_runs_df = pl.from_pandas(
-                    pd.read_csv(
-                        csv_path,
-                        parse_dates=["created_at", "updated_at", "logged_at"],
-                        date_format="ISO8601",
-                    )
-                ).with_columns(
-                    pl.col("date").str.strptime(pl.Datetime, "%Y-%m-%d").cast(pl.Date),
-                    pl.col("created_at").cast(pl.Datetime("us")),
-                    pl.col("updated_at").cast(pl.Datetime("us")),
-                    pl.col("logged_at").cast(pl.Datetime("us")),
-                )
+                old_runs_df = ArtifactHandler.read_dataset_csv(csv_path)
             except Exception as e:
                 print(e)
                 old_runs_df = pl.DataFrame()
             finally:
                 return old_runs_df
     
+    @staticmethod
+    def read_dataset_csv(csv_path: Path) -> pl.DataFrame:
+        """データセットのcsvを型を揃えて読み込む"""
+        TRACER.count("bytes", Path(csv_path).stat().st_size)
+        df = pl.from_pandas(
+            pd.read_csv(
+                csv_path,
+                parse_dates=["created_at", "updated_at", "logged_at"],
+                date_format="ISO8601",
+            )
+        ).with_columns(
+            pl.col("date").str.strptime(pl.Datetime, "%Y-%m-%d").cast(pl.Date),
+            pl.col("created_at").cast(pl.Datetime("us")),
+            pl.col("updated_at").cast(pl.Datetime("us")),
+            pl.col("logged_at").cast(pl.Datetime("us")),
+        )
+        TRACER.count("rows", len(df))
+        return df
+
+    @staticmethod
+    def download_dataset() -> Optional[Path]:
+        """artifactのcsvをダウンロードだけして、そのパスを返す（取得できない場合はNone）"""
+        with wandb.init(
+            entity=CONFIG.dashboard.entity,
+            project=CONFIG.dashboard.project,
+            name="Read Dataset",
+        ) as run:
+            try:
+                artifact_name = CONFIG.dataset.artifact_name
+                artifact_path = f"{CONFIG.dataset.entity}/{CONFIG.dataset.project}/{artifact_name}:latest"
+                artifact = run.use_artifact(artifact_path)
+                artifact_dir = Path(artifact.download(CONFIG.wandb_dir))
+                return artifact_dir / f"{artifact_name}.csv"
+            except Exception as e:
+                print(e)
+                return None
+
     @staticmethod
     def update_dataset(all_runs_df: pl.DataFrame, date_range: List[str]) -> None:
+        csv_path = f"{CONFIG.wandb_dir}/{CONFIG.dataset.artifact_name}.csv"
+        all_runs_df.write_csv(csv_path)
+        ArtifactHandler.upload_dataset_csv(csv_path, date_range)
+
+    @staticmethod
+    def upload_dataset_csv(csv_path: str, date_range: List[str]) -> None:
         with wandb.init(
             entity=CONFIG.dashboard.entity,
             project=CONFIG.dashboard.project,
             name=f"Update_{date_range[1]}",
         ) as run:
             filename = CONFIG.dataset.artifact_name
-            csv_path = f"{CONFIG.wandb_dir}/{filename}.csv"
-            all_runs_df.write_csv(csv_path)
             artifact = wandb.Artifact(
                 name=filename,
                 type="dataset",
             )
             artifact.add_file(local_path=csv_path)
             run.log_artifact(artifact)
+
+    @staticmethod
+    def write_manifest(manifest: dict) -> None:
+        """ヘルスチェック用のマニフェストをartifactのメタデータとして保存する"""
+        with wandb.init(
+            entity=CONFIG.dashboard.entity,
+            project=CONFIG.dashboard.project,
+            name=f"Manifest_{manifest['target_date']}",
+            job_type="health-manifest",
+        ) as run:
+            artifact = wandb.Artifact(
+                name=CONFIG.dashboard.manifest_artifact_name,
+                type="manifest",
+                metadata=manifest,
+            )
+            run.log_artifact(artifact)
+
+    @staticmethod
+    def read_manifest() -> dict:
+        """前回のヘルスマニフェストを取得する（取得できない場合は空のdict）"""
+        dashboard = CONFIG.dashboard
+        artifact_path = f"{dashboard.entity}/{dashboard.project}/{dashboard.manifest_artifact_name}:latest"
+        try:
+            return dict(wandb.Api().artifact(artifact_path).metadata)
+        except Exception as e:
+            logger.warning(f"Failed to read health manifest: {str(e)}")
+            return {}
+
+    @staticmethod
+    def partial_artifact_name(index: int, count: int) -> str:
+        return f"{CONFIG.dataset.artifact_name}_shard{index}of{count}"
+
+    @staticmethod
+    def write_partial(new_runs_df: pl.DataFrame, date_range: List[str], shard: Tuple[int, int], team_run_counts: Dict[str, int]) -> None:
+        """シャードで取得したデータを部分結果として保存する"""
+        index, count = shard
+        filename = ArtifactHandler.partial_artifact_name(index, count)
+        with wandb.init(
+            entity=CONFIG.dashboard.entity,
+            project=CONFIG.dashboard.project,
+            name=f"Shard{index}of{count}_{date_range[1]}",
+            job_type="fetch-shard",
+        ) as run:
+            # 型を保ったまま受け渡すためparquetで保存する
+            parquet_path = f"{CONFIG.wandb_dir}/{filename}.parquet"
+            DataProcessor.write_parquet(new_runs_df, parquet_path)
+            artifact = wandb.Artifact(
+                name=filename,
+                type="partial-dataset",
+                metadata={"date_range": date_range, "team_run_counts": team_run_counts},
+            )
+            artifact.add_file(local_path=parquet_path)
+            run.log_artifact(artifact, aliases=["latest", f"{date_range[0]}_{date_range[1]}"])
+
+    @staticmethod
+    def read_partials(date_range: List[str], count: int) -> Tuple[pl.DataFrame, Dict[str, int]]:
+        """全シャードの部分結果を読み込んで結合する（1つでも欠けていればエラー）"""
+        frames = []
+        team_run_counts = {}
+        with wandb.init(
+            entity=CONFIG.dashboard.entity,
+            project=CONFIG.dashboard.project,
+            name=f"Merge_{date_range[1]}",
+            job_type="merge-shards",
+        ) as run:
+            for index in range(1, count + 1):
+                filename = ArtifactHandler.partial_artifact_name(index, count)
+                artifact_path = f"{CONFIG.dashboard.entity}/{CONFIG.dashboard.project}/{filename}:{date_range[0]}_{date_range[1]}"
+                artifact = run.use_artifact(artifact_path)
+                artifact_dir = Path(artifact.download(CONFIG.wandb_dir))
+                partial_df = pl.read_parquet(artifact_dir / f"{filename}.parquet")
+                if not partial_df.is_empty():
+                    frames.append(partial_df)
+                team_run_counts.update(artifact.metadata.get("team_run_counts", {}))
+        new_runs_df = pl.concat(frames) if frames else pl.DataFrame()
+        return new_runs_df, team_run_counts
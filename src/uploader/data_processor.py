@@ -1,9 +1,49 @@
 import polars as pl
-import wandb
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import json
 from pathlib import Path
+from typing import List, Optional
 from ..utils.config import CONFIG
-from ..uploader.artifact_handler import ArtifactHandler
+
+# データセットの列の型（csvを型付きで読むため）
+DATASET_SCHEMA = {
+    "date": pl.Date,
+    "company_name": pl.Utf8,
+    "project": pl.Utf8,
+    "run_id": pl.Utf8,
+    "tags": pl.Utf8,
+    "created_at": pl.Datetime("us"),
+    "updated_at": pl.Datetime("us"),
+    "state": pl.Utf8,
+    "duration_hour": pl.Float64,
+    "gpu_count": pl.Int64,
+    "average_gpu_utilization": pl.Float64,
+    "average_gpu_memory": pl.Float64,
+    "max_gpu_utilization": pl.Float64,
+    "max_gpu_memory": pl.Float64,
+    "host_name": pl.Utf8,
+    "logged_at": pl.Datetime("us"),
+    "gpu_utilization_sketch": pl.Utf8,
+    "active_hour": pl.Float64,
+}
+
+# 後から追加した列（追加前のデータにはないため、nullで補う）
+OPTIONAL_COLS = {
+    "gpu_utilization_sketch": pl.Utf8,
+    "active_hour": pl.Float64,
+}
+
+# 同じrunの同じ日を表すキー（このキーごとにlogged_atが最新の行を残す）
+DATASET_KEYS = ["date", "company_name", "project", "run_id"]
+
+# csvをparquetに変換するときに一度に読むバイト数
+CSV_BLOCK_BYTES = 4 << 20
+
+def fill_optional_cols(df):
+    """DataFrame/LazyFrameにない後から追加した列をnullで補う"""
+    missing = [pl.lit(None).cast(dtype).alias(col) for col, dtype in OPTIONAL_COLS.items() if col not in df.columns]
+    return df.with_columns(missing) if missing else df
 
 class DataProcessor:
     @staticmethod
@@ -11,21 +51,91 @@ class DataProcessor:
         if old_runs_df.is_empty():
             all_runs_df = new_runs_df.clone()
         else:
-            all_runs_df = (
-                pl.concat((new_runs_df.pipe(DataProcessor.set_schema), old_runs_df.pipe(DataProcessor.set_schema)))
-                .sort(["logged_at"], descending=True)
-                .unique(["date", "company_name", "project", "run_id"], keep="first")
-                .sort(["run_id", "project"])
-                .sort(["date"], descending=True)
-                .sort(["company_name"])
-            )
+            all_runs_df = DataProcessor.combine_frames([new_runs_df, old_runs_df])
         return all_runs_df
 
+    @staticmethod
+    def combine_frames(frames: List[pl.DataFrame]) -> pl.DataFrame:
+        """複数のDataFrameを結合し、同じ(date, company_name, project, run_id)はlogged_atが新しいものを残す"""
+        frames = [df.pipe(DataProcessor.set_schema) for df in frames if not df.is_empty()]
+        if not frames:
+            return pl.DataFrame()
+        return (
+            pl.concat(frames)
+            .sort(["logged_at"], descending=True)
+            .unique(DATASET_KEYS, keep="first")
+            .sort(["run_id", "project"])
+            .sort(["date"], descending=True)
+            .sort(["company_name"])
+        )
+
+    @staticmethod
+    def csv_to_parquet(csv_path: Path, parquet_path: Path) -> None:
+        """csvをCSV_BLOCK_BYTESずつ読んでparquetに書き出す（ない列はnullで補う）
+
+        polarsのcsvのスキャンはファイル全体をバッファするため、pyarrowのストリーミングリーダーで変換する。
+        """
+        schema = pl.DataFrame(schema=DATASET_SCHEMA).to_arrow().schema
+        reader = pacsv.open_csv(
+            csv_path,
+            read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+            convert_options=pacsv.ConvertOptions(
+                column_types=schema, include_columns=schema.names, include_missing_columns=True
+            ),
+        )
+        with pq.ParquetWriter(parquet_path, schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+
+    @staticmethod
+    def combine_files(new_runs_path: Optional[Path], old_runs_csv_path: Optional[Path], output_path: Path) -> None:
+        """combine_framesと同じlatest-winsのルールで、ファイルからファイルへストリーミングで結合する
+
+        新旧のデータをどちらもメモリに読み込まず、polarsのストリーミングエンジンでチャンクごとに処理する。
+        sort→uniqueはストリーミングでは行の順序が保証されないため、キーごとに最新の行を集約とjoinで明示的に選ぶ。
+        出力の行はキーの順には並べない（全体のソートはメモリ上で行われるため）。
+        """
+        frames = []
+        if new_runs_path is not None:
+            frames.append(pl.scan_parquet(new_runs_path))
+        if old_runs_csv_path is not None:
+            old_runs_path = output_path.with_name("old_runs.parquet")
+            DataProcessor.csv_to_parquet(old_runs_csv_path, old_runs_path)
+            frames.append(pl.scan_parquet(old_runs_path))
+        # logged_atが同じ場合は新しく取得したファイル（先頭）の行を優先する
+        ranked = pl.concat(
+            [
+                fill_optional_cols(lf)
+                .select([pl.col(c).cast(t) for c, t in DATASET_SCHEMA.items()])
+                .with_columns((pl.col("logged_at").cast(pl.Int64).fill_null(0) * 2 + int(i == 0)).alias("_rank"))
+                for i, lf in enumerate(frames)
+            ]
+        )
+        latest = ranked.group_by(DATASET_KEYS).agg(pl.col("_rank").max())
+        # 小さい方（キーごとの最新）を左にすると、ハッシュテーブルに全列の行を載せずに済む
+        (
+            latest.join(ranked, on=[*DATASET_KEYS, "_rank"], how="inner")
+            .select(list(DATASET_SCHEMA))
+            .sink_parquet(output_path)
+        )
+
+    @staticmethod
+    def write_parquet(df: pl.DataFrame, path) -> None:
+        """DATASET_SCHEMAの型でparquetに書き出す
+
+        runがなかったときの列のないDataFrameはそのまま書くと読み込めないparquetになるため、
+        スキーマだけの空のDataFrameとして書き出す。
+        """
+        if df.is_empty():
+            df = pl.DataFrame(schema=DATASET_SCHEMA)
+        DataProcessor.set_schema(df).write_parquet(path)
+
     @staticmethod
     def set_schema(df: pl.DataFrame) -> pl.DataFrame:
         """Dataframeのdata型をcastする"""
         try:
-            new_runs_df = df.with_columns(
+            # 分位点スケッチや稼働時間の導入前のデータには列がないため、nullで補う
+            new_runs_df = fill_optional_cols(df).with_columns(
                 pl.col("run_id").cast(pl.Utf8),
                 #pl.col("assigned_gpu_node").cast(pl.Int64),
                 pl.col("duration_hour").cast(pl.Float64),
@@ -34,6 +144,8 @@ class DataProcessor:
                 pl.col("average_gpu_memory").cast(pl.Float64),
                 pl.col("max_gpu_utilization").cast(pl.Float64),
                 pl.col("max_gpu_memory").cast(pl.Float64),
+                pl.col("gpu_utilization_sketch").cast(pl.Utf8),
+                pl.col("active_hour").cast(pl.Float64),
             )
             return new_runs_df
         except:
@@ -1,18 +1,88 @@
 import datetime as dt
+import multiprocessing
+import os
 import polars as pl
-from typing import List
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
 from .artifact_handler import ArtifactHandler
 from .data_processor import DataProcessor
+from ..utils.config import CONFIG
+from ..utils.log import get_logger
+from ..utils.tracing import TRACER
+
+logger = get_logger(__name__)
 
 class RunUploader:
-    def __init__(self, new_runs_df, date_range: List):
+    def __init__(self, new_runs_df, date_range: List, background: bool = False):
         self.start_date = dt.datetime.strptime(date_range[0], "%Y-%m-%d").date()
         self.end_date = dt.datetime.strptime(date_range[1], "%Y-%m-%d").date()
         self.new_runs_df = new_runs_df
         self.date_range = date_range
+        self.background = background
+        self.upload_future: Optional[Future] = None
+        self.executor: Optional[ProcessPoolExecutor] = None
 
     def process_and_upload_runs(self):
-        old_runs_df = ArtifactHandler.read_dataset()
-        all_runs_df = DataProcessor.combine_df(new_runs_df=self.new_runs_df, old_runs_df=old_runs_df)
-        ArtifactHandler.update_dataset(all_runs_df=all_runs_df, date_range=self.date_range)
-        return all_runs_df
\ No newline at end of file
+        with TRACER.span("read_dataset"):
+            old_runs_df = ArtifactHandler.read_dataset()
+            TRACER.count("rows", len(old_runs_df))
+        with TRACER.span("combine"):
+            all_runs_df = DataProcessor.combine_df(new_runs_df=self.new_runs_df, old_runs_df=old_runs_df)
+            TRACER.count("rows", len(all_runs_df))
+        with TRACER.span("write_dataset"):
+            Path(CONFIG.wandb_dir).mkdir(parents=True, exist_ok=True)
+            csv_path = f"{CONFIG.wandb_dir}/{CONFIG.dataset.artifact_name}.csv"
+            all_runs_df.write_csv(csv_path)
+            self.__upload(csv_path)
+        return all_runs_df
+
+    def process_and_upload_runs_streaming(self):
+        """新旧のデータをメモリに載せずにディスク上で結合してアップロードする"""
+        # チャンクの行数でストリーミングエンジンのメモリ使用量の上限を調整する
+        pl.Config.set_streaming_chunk_size(CONFIG.streaming.chunk_size)
+        work_dir = Path(CONFIG.get("cache_dir", CONFIG.wandb_dir)) / "streaming"
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+        new_runs_path = None
+        if not self.new_runs_df.is_empty():
+            new_runs_path = work_dir / "new_runs.parquet"
+            DataProcessor.set_schema(self.new_runs_df).write_parquet(new_runs_path)
+        with TRACER.span("read_dataset"):
+            old_runs_csv_path = ArtifactHandler.download_dataset()
+        if new_runs_path is None and old_runs_csv_path is None:
+            return pl.DataFrame()
+
+        all_runs_path = work_dir / "all_runs.parquet"
+        with TRACER.span("combine"):
+            DataProcessor.combine_files(new_runs_path, old_runs_csv_path, all_runs_path)
+            TRACER.count("bytes", os.path.getsize(all_runs_path))
+        with TRACER.span("write_dataset"):
+            Path(CONFIG.wandb_dir).mkdir(parents=True, exist_ok=True)
+            csv_path = f"{CONFIG.wandb_dir}/{CONFIG.dataset.artifact_name}.csv"
+            pl.scan_parquet(all_runs_path).sink_csv(csv_path)
+            self.__upload(csv_path)
+        # 集計側も必要な列だけを読むように、読み込まずにscanのまま渡す
+        return pl.scan_parquet(all_runs_path)
+
+    def __upload(self, csv_path: str) -> None:
+        """csvをartifactとしてアップロードする（backgroundの場合は別プロセスで開始だけする）"""
+        TRACER.count("bytes", os.path.getsize(csv_path))
+        if not self.background:
+            ArtifactHandler.upload_dataset_csv(csv_path, self.date_range)
+            return
+        # wandb.initは1プロセスで同時に1つしか扱えないため、スレッドではなく別プロセスで実行する
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        self.upload_future = self.executor.submit(ArtifactHandler.upload_dataset_csv, csv_path, self.date_range)
+        logger.info("Started uploading the dataset in the background")
+
+    def wait_for_upload(self) -> None:
+        """バックグラウンドのアップロードの完了を待つ（失敗していれば例外を送出する）"""
+        if self.upload_future is None:
+            return
+        try:
+            self.upload_future.result()
+            logger.info("Finished uploading the dataset")
+        finally:
+            self.executor.shutdown()
+            self.upload_future = None
@@ -0,0 +1,101 @@
+"""W&B APIのGraphQL通信の記録と再生
+
+wandbのGraphQLクライアント(GraphQLSession.execute)を差し替え、記録モードでは実際のレスポンスを、
+再生モードでは記録済みのレスポンスを返す。runの一覧もシステムメトリクスの履歴もGraphQLで取得しているため、
+これだけで取得処理の通信をすべて記録・再生できる。
+カセットはgzip圧縮したJSON Linesで、1行が1リクエスト分（クエリと変数のハッシュ、操作名、レスポンス）。
+wandb.initによるアップロードは別プロセス(wandb-service)で行われるため対象外。
+"""
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Optional
+
+from wandb.sdk.lib.gql_request import GraphQLSession
+from wandb_graphql.execution import ExecutionResult
+from wandb_graphql.language.printer import print_ast
+
+from src.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+_original_execute = GraphQLSession.execute
+
+def request_key(query: str, variables: Optional[dict]) -> str:
+    payload = json.dumps({"query": query, "variables": variables or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def operation_name(query: str) -> str:
+    match = re.search(r"(query|mutation)\s+(\w+)", query)
+    return match.group(2) if match else "unknown"
+
+class CassetteMiss(KeyError):
+    """再生モードで記録にないリクエストが来た"""
+
+class Cassette:
+    def __init__(self, path: str, mode: str, latency_ms: float = 0.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.responses = defaultdict(deque)
+        if mode == "record":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        else:
+            self.file = None
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.responses[entry["key"]].append(entry["response"])
+
+    def execute(self, session: GraphQLSession, document, variable_values=None, timeout=None) -> ExecutionResult:
+        query = print_ast(document)
+        key = request_key(query, variable_values)
+        if self.mode == "replay":
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000)
+            with self.lock:
+                self.requests += 1
+                responses = self.responses.get(key)
+                if not responses:
+                    raise CassetteMiss(f"No recorded response for {operation_name(query)} {variable_values}")
+                # 同じリクエストが複数回記録されていれば順に返し、最後の1件は使い回す
+                response = responses.popleft() if len(responses) > 1 else responses[0]
+            return ExecutionResult(data=response.get("data"), errors=response.get("errors"))
+
+        result = _original_execute(session, document, variable_values, timeout)
+        entry = {
+            "key": key,
+            "operation": operation_name(query),
+            "response": {"data": result.data, "errors": result.errors},
+        }
+        with self.lock:
+            self.requests += 1
+            self.file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        return result
+
+    def install(self) -> "Cassette":
+        cassette = self
+
+        def execute(session, document, variable_values=None, timeout=None):
+            return cassette.execute(session, document, variable_values, timeout)
+
+        GraphQLSession.execute = execute
+        logger.info(f"Cassette {self.mode}: {self.path}")
+        return self
+
+    def close(self) -> None:
+        GraphQLSession.execute = _original_execute
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        logger.info(f"Cassette {self.mode}: {self.requests} requests ({self.path})")
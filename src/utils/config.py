@@ -1,10 +1,98 @@
+import datetime as dt
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
 import yaml
 from easydict import EasyDict
 
+# 割り当てが終了していない企業の終了日
+OPEN_END_DATE = dt.date(2100, 1, 1)
+
+def config_path() -> Path:
+    """環境変数GPU_DASHBOARD_CONFIG、カレントディレクトリ、リポジトリ直下の順にconfig.yamlを探す"""
+    path = Path(os.environ.get("GPU_DASHBOARD_CONFIG", "config.yaml"))
+    if not path.exists():
+        path = Path(__file__).resolve().parents[2] / "config.yaml"
+    return path
+
 # 設定ファイルの読み込み
 try:
-    with open("config.yaml", "r") as f:
+    with open(config_path(), "r") as f:
         CONFIG = EasyDict(yaml.safe_load(f))
 except FileNotFoundError:
     print("Warning: config.yaml file not found.")
-    raise
\ No newline at end of file
+    raise
+
+@dataclass(frozen=True)
+class ScheduleEntry:
+    date: dt.date
+    assigned_gpu_node: int
+
+@dataclass(frozen=True)
+class CompanyConfig:
+    company: str
+    teams: Tuple[str, ...]
+    # 日付順に並べたスケジュール
+    schedule: Tuple[ScheduleEntry, ...]
+    ignore_project_pattern: Optional[str] = None
+    include_project_pattern: Optional[str] = None
+
+    @property
+    def start_date(self) -> dt.date:
+        return self.schedule[0].date
+
+    @property
+    def last_date(self) -> dt.date:
+        return self.schedule[-1].date
+
+    @property
+    def end_date(self) -> dt.date:
+        """割り当てが0になって終わっていればその日、続いていればOPEN_END_DATE"""
+        return self.last_date if self.schedule[-1].assigned_gpu_node == 0 else OPEN_END_DATE
+
+def parse_companies(companies: Sequence[dict]) -> Tuple[CompanyConfig, ...]:
+    """config.yamlのcompaniesを検証し、日付を変換済みのCompanyConfigにする"""
+    parsed = []
+    seen_teams = set()
+    for company in companies:
+        name = company.get("company")
+        if not name or not company.get("teams") or not company.get("schedule"):
+            raise ValueError(f"Company config needs company, teams and schedule: {company}")
+        schedule = []
+        for item in company["schedule"]:
+            date = item["date"]
+            if not isinstance(date, dt.date):
+                try:
+                    date = dt.datetime.strptime(str(date), "%Y-%m-%d").date()
+                except ValueError:
+                    raise ValueError(f"Invalid schedule date for {name}: {item['date']}")
+            node = item.get("assigned_gpu_node")
+            if not isinstance(node, int) or node < 0:
+                raise ValueError(f"Invalid assigned_gpu_node for {name} on {date}: {node}")
+            schedule.append(ScheduleEntry(date=date, assigned_gpu_node=node))
+        duplicated = seen_teams.intersection(company["teams"])
+        if duplicated:
+            raise ValueError(f"Teams assigned to more than one company: {sorted(duplicated)}")
+        seen_teams.update(company["teams"])
+        parsed.append(
+            CompanyConfig(
+                company=name,
+                teams=tuple(company["teams"]),
+                schedule=tuple(sorted(schedule, key=lambda s: s.date)),
+                ignore_project_pattern=company.get("ignore_project_pattern"),
+                include_project_pattern=company.get("include_project_pattern"),
+            )
+        )
+    return tuple(parsed)
+
+_parsed_companies = (None, ())
+
+def get_companies() -> Tuple[CompanyConfig, ...]:
+    """CONFIG.companiesを変換したもの（一度だけ変換し、CONFIG.companiesが差し替えられたら変換し直す）"""
+    global _parsed_companies
+    raw = CONFIG.companies
+    if _parsed_companies[0] is not raw:
+        _parsed_companies = (raw, parse_companies(raw))
+    return _parsed_companies[1]
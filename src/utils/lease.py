@@ -0,0 +1,170 @@
+"""main.pyの実行が重ならないようにするリース（期限付きのロック）
+
+ダッシュボードのプロジェクトに、リースのタグを付けたrunを作ってリースを表す。
+runのconfigには保持者と有効期限(expires_at)を持ち、保持している間はハートビートで期限を延ばし続ける。
+
+W&Bには比較して書き込む操作がないため、取得は「自分のrunを作ってから、有効なリースのrunを作成順に並べ、
+先頭が自分なら取得できた」とする。同時に作った場合もサーバーの作成時刻の順で必ずどちらか一方だけが勝つ。
+取得できなかった場合は自分のrunを削除する。異常終了して延長されなくなったリースは期限切れとして無視し、削除する。
+"""
+import datetime as dt
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import wandb
+from wandb_gql import gql
+
+from src.utils.config import CONFIG
+from src.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+CREATE_MUTATION = """
+mutation CreateLease($entity: String!, $project: String!, $name: String!, $tags: [String!], $config: JSONString!) {
+  upsertBucket(input: {entityName: $entity, modelName: $project, name: $name, displayName: $name, tags: $tags, config: $config}) {
+    bucket { id name createdAt }
+  }
+}
+"""
+
+HEARTBEAT_MUTATION = """
+mutation RenewLease($id: String!, $config: JSONString!) {
+  upsertBucket(input: {id: $id, config: $config}) { bucket { id } }
+}
+"""
+
+DELETE_MUTATION = """
+mutation DeleteLease($id: ID!) {
+  deleteRun(input: {id: $id}) { clientMutationId }
+}
+"""
+
+class LeaseHeld(RuntimeError):
+    """他の実行がリースを保持している"""
+
+class Lease:
+    """名前ごとのリース。withの間だけ保持し、取得できなければLeaseHeldを送出する
+
+        with Lease("pipeline"):
+            ...
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_minutes: Optional[float] = None,
+        heartbeat_minutes: Optional[float] = None,
+        wait_minutes: Optional[float] = None,
+    ):
+        lease_config = CONFIG.get("lease", {})
+        self.name = name
+        self.tag = lease_config.get("tag", "lease")
+        self.ttl_sec = 60 * (ttl_minutes if ttl_minutes is not None else lease_config.get("ttl_minutes", 30))
+        self.heartbeat_sec = 60 * (heartbeat_minutes if heartbeat_minutes is not None else lease_config.get("heartbeat_minutes", 5))
+        self.wait_sec = 60 * (wait_minutes if wait_minutes is not None else lease_config.get("wait_minutes", 0))
+        self.holder = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.entity = CONFIG.dashboard.entity
+        self.project = CONFIG.dashboard.project
+        self.storage_id: Optional[str] = None
+        self.stopped = threading.Event()
+        self.heartbeat_thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "Lease":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def config_json(self) -> str:
+        expires_at = time.time() + self.ttl_sec
+        config = {
+            "holder": self.holder,
+            "lease": self.name,
+            "expires_at": expires_at,
+            "expires_at_iso": dt.datetime.fromtimestamp(expires_at, dt.timezone.utc).replace(microsecond=0).isoformat(),
+        }
+        return json.dumps({key: {"value": value, "desc": None} for key, value in config.items()})
+
+    def acquire(self) -> None:
+        """リースを取得する（wait_minutesの間は待ち、それでも取れなければLeaseHeld）"""
+        deadline = time.monotonic() + self.wait_sec
+        while True:
+            holder = self.try_acquire()
+            if holder is None:
+                logger.info(f"Acquired lease '{self.name}' as {self.holder}")
+                self.heartbeat_thread = threading.Thread(target=self.__heartbeat, daemon=True)
+                self.heartbeat_thread.start()
+                return
+            if time.monotonic() >= deadline:
+                raise LeaseHeld(f"Lease '{self.name}' is held by {holder}")
+            logger.info(f"Lease '{self.name}' is held by {holder}. Waiting ...")
+            time.sleep(min(self.heartbeat_sec, max(deadline - time.monotonic(), 1)))
+
+    def try_acquire(self) -> Optional[str]:
+        """自分のrunを作って順番を確認する。取得できればNone、できなければ保持者を返す"""
+        api = wandb.Api()
+        result = api.client.execute(
+            gql(CREATE_MUTATION),
+            {
+                "entity": self.entity,
+                "project": self.project,
+                "name": f"lease-{self.name}-{self.holder}",
+                "tags": [self.tag, self.name],
+                "config": self.config_json(),
+            },
+        )
+        self.storage_id = result["upsertBucket"]["bucket"]["id"]
+
+        leases = self.list_active_leases(api)
+        if leases and leases[0].storage_id == self.storage_id:
+            return None
+        self.__delete(api, self.storage_id)
+        self.storage_id = None
+        return leases[0].config.get("holder", leases[0].name) if leases else "unknown"
+
+    def list_active_leases(self, api: wandb.Api) -> List:
+        """期限内のリースのrunを作成順に返す（期限切れのものは削除する）"""
+        runs = api.runs(
+            f"{self.entity}/{self.project}",
+            {"$and": [{"tags": {"$in": [self.tag]}}, {"tags": {"$in": [self.name]}}]},
+            order="+created_at",
+        )
+        now = time.time()
+        active = []
+        for run in runs:
+            if run.config.get("expires_at", 0) > now or run.storage_id == self.storage_id:
+                active.append(run)
+            else:
+                logger.warning(f"Removing expired lease of {run.config.get('holder', run.name)}")
+                self.__delete(api, run.storage_id)
+        return sorted(active, key=lambda run: (run.created_at, run.storage_id))
+
+    def __heartbeat(self) -> None:
+        while not self.stopped.wait(self.heartbeat_sec):
+            try:
+                wandb.Api().client.execute(gql(HEARTBEAT_MUTATION), {"id": self.storage_id, "config": self.config_json()})
+            except Exception as e:
+                logger.warning(f"Failed to renew lease '{self.name}': {str(e)}")
+
+    @staticmethod
+    def __delete(api: wandb.Api, storage_id: str) -> None:
+        try:
+            api.client.execute(gql(DELETE_MUTATION), {"id": storage_id})
+        except Exception as e:
+            logger.warning(f"Failed to delete lease run {storage_id}: {str(e)}")
+
+    def release(self) -> None:
+        self.stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        if self.storage_id is not None:
+            self.__delete(wandb.Api(), self.storage_id)
+            self.storage_id = None
+            logger.info(f"Released lease '{self.name}'")
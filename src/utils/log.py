@@ -0,0 +1,106 @@
+"""レベル付きのログ、一定間隔でまとめて出す進捗、エラーの間引き
+
+runやプロジェクトごとに1行ずつ出すと、数万runではログの量（CloudWatchの取り込み量）と標準出力の競合が無視できなくなる。
+そのため、個々の処理の詳細はDEBUGに落とし（--verboseで表示）、通常は段階ごとの進捗を一定間隔で1行にまとめて出す。
+エラーは種類ごとに最初の数件だけ出力し、残りは件数だけを最後にまとめて出す。
+
+    progress = Progress("fetch_metrics", total=len(runs))
+    for run in runs:
+        ...
+        progress.advance()
+    progress.close()
+"""
+import logging
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from src.utils.config import CONFIG
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+def setup_logging(verbose: bool = False) -> None:
+    """ルートロガーを設定する（verboseならDEBUGまで出力する）"""
+    level = logging.DEBUG if verbose else getattr(logging, CONFIG.get("logging", {}).get("level", "INFO"))
+    logging.basicConfig(level=level, format=LOG_FORMAT, stream=sys.stdout, force=True)
+    # 依存ライブラリのDEBUGログは量が多いため抑える
+    for name in ("urllib3", "wandb", "git"):
+        logging.getLogger(name).setLevel(max(level, logging.INFO))
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+def progress_interval_sec() -> float:
+    return CONFIG.get("logging", {}).get("progress_interval_sec", 30)
+
+def error_samples() -> int:
+    return CONFIG.get("logging", {}).get("error_samples", 5)
+
+class Progress:
+    """段階の進捗を数え、interval_secごとに1行だけ出力する（スレッドセーフ）"""
+
+    def __init__(self, stage: str, total: Optional[int] = None, interval_sec: Optional[float] = None, logger: Optional[logging.Logger] = None):
+        self.stage = stage
+        self.total = total
+        self.interval_sec = progress_interval_sec() if interval_sec is None else interval_sec
+        self.logger = logger or get_logger("progress")
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.last_emitted = self.start
+
+    def add_total(self, n: int) -> None:
+        with self.lock:
+            self.total = (self.total or 0) + n
+
+    def advance(self, n: int = 1, failed: bool = False) -> None:
+        with self.lock:
+            self.done += n
+            self.failed += n if failed else 0
+            now = time.monotonic()
+            if now - self.last_emitted < self.interval_sec:
+                return
+            self.last_emitted = now
+            message = self.__message(now)
+        self.logger.info(message)
+
+    def close(self) -> None:
+        with self.lock:
+            message = self.__message(time.monotonic())
+        self.logger.info(f"{message} (done)")
+
+    def __message(self, now: float) -> str:
+        elapsed = now - self.start
+        total = f"/{self.total}" if self.total is not None else ""
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        failed = f", {self.failed} failed" if self.failed else ""
+        return f"{self.stage}: {self.done}{total} ({rate:.1f}/s, {elapsed:.0f}s{failed})"
+
+class ErrorSampler:
+    """種類ごとに最初のmax_samples件だけエラーを出力し、残りは件数だけを数える"""
+
+    def __init__(self, logger: logging.Logger, max_samples: Optional[int] = None):
+        self.logger = logger
+        self.max_samples = error_samples() if max_samples is None else max_samples
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def log(self, kind: str, message: str, level: int = logging.WARNING) -> None:
+        with self.lock:
+            count = self.counts.get(kind, 0) + 1
+            self.counts[kind] = count
+        if count <= self.max_samples:
+            self.logger.log(level, message)
+        elif count == self.max_samples + 1:
+            self.logger.log(level, f"Suppressing further '{kind}' messages")
+        else:
+            self.logger.debug(message)
+
+    def summary(self) -> None:
+        """出力を省略したエラーの件数を出力する"""
+        with self.lock:
+            suppressed = {kind: count - self.max_samples for kind, count in self.counts.items() if count > self.max_samples}
+        for kind, count in suppressed.items():
+            self.logger.warning(f"{count} more '{kind}' messages were suppressed")
@@ -0,0 +1,125 @@
+"""GPU使用率の分布を保持するDDSketch形式の分位点スケッチ
+
+値を対数スケールのバケットに数え上げるだけなので、スケッチ同士はバケットごとの
+件数を足し合わせるだけでマージでき、サイズはサンプル数によらずバケット数で抑えられる。
+シリアライズ形式は [{"g": GPU番号, "b": バケット, "c": 件数}, ...] のJSON文字列。
+"""
+import math
+from typing import List, Sequence, Union
+
+import polars as pl
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# 0以下の値（アイドル）を数えるバケット
+ZERO_BUCKET = -1_000_000
+MAX_VALUE = 100.0
+
+# JSONを展開する行数の単位（展開後の縦持ちはスケッチのバケット数倍になるため、まとめて展開しない）
+DECODE_CHUNK_ROWS = 10_000
+
+SKETCH_DTYPE = pl.List(pl.Struct({"g": pl.Int64, "b": pl.Int64, "c": pl.Int64}))
+
+def bucket_expr(value: pl.Expr) -> pl.Expr:
+    """値をバケット番号に変換する"""
+    return (
+        pl.when(value <= 0)
+        .then(pl.lit(ZERO_BUCKET))
+        .otherwise((value.log() / LOG_GAMMA).ceil())
+        .cast(pl.Int64)
+    )
+
+def bucket_value_expr(bucket: pl.Expr) -> pl.Expr:
+    """バケットの代表値（相対誤差RELATIVE_ACCURACY以内）を返す"""
+    return (
+        pl.when(bucket == ZERO_BUCKET)
+        .then(pl.lit(0.0))
+        .otherwise((2 * pl.lit(GAMMA).pow(bucket.cast(pl.Float64)) / (GAMMA + 1)).clip(upper_bound=MAX_VALUE))
+    )
+
+def build_sketches(df: pl.DataFrame, keys: List[str], gpu_col: str, value_col: str) -> pl.DataFrame:
+    """keysごとに、GPU番号別のスケッチをシリアライズした列を作成する"""
+    return (
+        df.filter(pl.col(value_col).is_not_null())
+        .with_columns(bucket_expr(pl.col(value_col).cast(pl.Float64)).alias("b"))
+        .group_by([*keys, gpu_col, "b"])
+        .agg(pl.count().cast(pl.Int64).alias("c"))
+        .sort([*keys, gpu_col, "b"])
+        .group_by(keys, maintain_order=True)
+        .agg(pl.struct(pl.col(gpu_col).cast(pl.Int64).alias("g"), "b", "c").struct.json_encode().alias("sketch"))
+        .with_columns(pl.concat_str(pl.lit("["), pl.col("sketch").list.join(","), pl.lit("]")).alias("sketch"))
+    )
+
+def explode_sketches(df: pl.DataFrame, keys: List[str], sketch_col: str) -> pl.DataFrame:
+    """シリアライズされたスケッチを (keys, g, b, c) の縦持ちに展開する"""
+    return (
+        df.select(*keys, pl.col(sketch_col))
+        .filter(pl.col(sketch_col).is_not_null())
+        .with_columns(pl.col(sketch_col).str.json_decode(SKETCH_DTYPE))
+        .explode(sketch_col)
+        .unnest(sketch_col)
+        .filter(pl.col("c").is_not_null())
+    )
+
+def count_sketch_chunk(df: pl.DataFrame, keys: List[str], sketch_col: str) -> pl.DataFrame:
+    """チャンクのスケッチを展開し、(keys, b)ごとの件数にまとめる（GPU番号はまとめる）"""
+    return explode_sketches(df, keys, sketch_col).group_by([*keys, "b"]).agg(pl.col("c").sum())
+
+def merge_sketch_counts(
+    df: Union[pl.DataFrame, pl.LazyFrame], keys: List[str], sketch_col: str, chunk_rows: int = DECODE_CHUNK_ROWS
+) -> pl.DataFrame:
+    """スケッチをchunk_rows行ずつ展開してすぐに(keys, b)ごとの件数にまとめる（GPU番号はまとめる）
+
+    全行を一度に展開するとバケット数倍の縦持ちがメモリに載るため、チャンクごとに集約してから結合する。
+    LazyFrame（parquetのscanなど）はスライスするとチャンクごとにファイル全体を読むため、
+    ストリーミングエンジンのチャンク（parquetの行グループ）ごとに集約する。
+    """
+    if isinstance(df, pl.LazyFrame):
+        schema = {k: df.schema[k] for k in keys} | {"b": pl.Int64, "c": pl.Int64}
+        query = (
+            df.select(*keys, sketch_col)
+            # UDFの中で使う列が落とされないように、列の射影の最適化は止める
+            .map_batches(
+                lambda chunk: count_sketch_chunk(chunk, keys, sketch_col),
+                schema=schema,
+                streamable=True,
+                projection_pushdown=False,
+            )
+            .group_by([*keys, "b"])
+            .agg(pl.col("c").sum())
+        )
+        with pl.Config(streaming_chunk_size=chunk_rows):
+            return query.collect(streaming=True)
+    parts = [count_sketch_chunk(df.slice(offset, chunk_rows), keys, sketch_col) for offset in range(0, len(df), chunk_rows)]
+    if not parts:
+        return explode_sketches(df, keys, sketch_col).select(*keys, "b", "c")
+    return pl.concat(parts).group_by([*keys, "b"]).agg(pl.col("c").sum())
+
+def merge_quantiles(long_df: pl.DataFrame, keys: List[str], quantiles: Sequence[float]) -> pl.DataFrame:
+    """縦持ちのスケッチをkeysごとにマージし、分位点とアイドル率(%)を計算する"""
+    merged = (
+        long_df.group_by([*keys, "b"])
+        .agg(pl.col("c").sum())
+        .sort([*keys, "b"])
+        .with_columns(
+            pl.col("c").cum_sum().over(keys).alias("cum_count"),
+            pl.col("c").sum().over(keys).alias("total_count"),
+        )
+    )
+    result = (
+        merged.group_by(keys)
+        .agg(
+            (pl.col("c").filter(pl.col("b") == ZERO_BUCKET).sum() / pl.col("c").sum() * 100).alias("idle_rate"),
+        )
+    )
+    for q in quantiles:
+        result = result.join(
+            merged.filter(pl.col("cum_count") >= q * pl.col("total_count"))
+            .group_by(keys)
+            .agg(pl.col("b").first())
+            .select(*keys, bucket_value_expr(pl.col("b")).alias(f"p{int(q * 100)}")),
+            on=keys,
+            how="left",
+        )
+    return result
@@ -0,0 +1,106 @@
+"""処理の段階ごとの階層的な計測（スパン）とカウンタ
+
+    with TRACER.span("fetch_runs"):
+        with TRACER.span("list_runs"):
+            TRACER.count("graphql_pages")
+
+スパンは入れ子にでき、それぞれ所要時間とカウンタ（GraphQLのページ数、履歴の取得回数、リトライ、
+キャッシュヒット、バイト数、行数など）を持つ。スレッドプールのワーカーのようにスパンの外で呼ばれたcountは、
+メインスレッドで最後に開いたスパンに加算する。結果は to_dict() でJSONにでき、summary() で最上位の段階ごとの要約を返す。
+"""
+import contextvars
+import datetime as dt
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    def __init__(self, span_id: int, name: str, parent: Optional["Span"]):
+        self.span_id = span_id
+        self.name = name
+        self.parent = parent
+        self.started_at = dt.datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.duration_sec: Optional[float] = None
+        self.counters: Dict[str, float] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_sec": self.duration_sec,
+            "counters": dict(self.counters),
+        }
+
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans: List[Span] = []
+        self.ids = itertools.count(1)
+        self.last_opened: Optional[Span] = None
+
+    @contextmanager
+    def span(self, name: str):
+        parent = _current_span.get()
+        with self.lock:
+            span = Span(next(self.ids), name, parent)
+            self.spans.append(span)
+        token = _current_span.set(span)
+        previous = self.last_opened
+        self.last_opened = span
+        try:
+            yield span
+        finally:
+            span.duration_sec = round(time.perf_counter() - span.start, 3)
+            _current_span.reset(token)
+            self.last_opened = previous
+
+    def count(self, name: str, value: float = 1) -> None:
+        """現在のスパンのカウンタに加算する"""
+        span = _current_span.get() or self.last_opened
+        if span is None:
+            return
+        with self.lock:
+            span.counters[name] = span.counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"spans": [span.to_dict() for span in self.spans]}
+
+    def summary(self) -> Dict[str, dict]:
+        """最上位のスパンごとに、所要時間と配下のスパンを含めたカウンタの合計を返す"""
+        summary = {}
+        with self.lock:
+            for span in self.spans:
+                root = span
+                while root.parent is not None:
+                    root = root.parent
+                entry = summary.setdefault(root.name, {"duration_sec": root.duration_sec, "counters": {}})
+                for name, value in span.counters.items():
+                    entry["counters"][name] = entry["counters"].get(name, 0) + value
+        return summary
+
+    def stage_timings(self) -> Dict[str, float]:
+        """完了した最上位のスパンの所要時間（秒）"""
+        with self.lock:
+            return {
+                span.name: round(span.duration_sec, 1)
+                for span in self.spans
+                if span.parent is None and span.duration_sec is not None
+            }
+
+    def write(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+TRACER = Tracer()
@@ -0,0 +1,80 @@
+import datetime as dt
+
+import polars as pl
+import pytest
+from easydict import EasyDict
+
+from src.calculator.alert_rules import evaluate_rules
+from src.calculator.gpu_usage_calculator import GPUUsageCalculator
+from src.uploader.data_processor import DATASET_SCHEMA
+from src.utils.config import CONFIG
+
+END_DATE = dt.date(2025, 3, 31)
+RULES = [
+    {"name": "low_utilization", "type": "utilization_floor", "threshold": 10, "days": 1},
+    {"name": "no_data", "type": "no_data", "days": 3},
+]
+
+def make_runs(company: str, days: list) -> list:
+    """1日中8GPUを使ったrunの行を作る"""
+    rows = []
+    for date in days:
+        start = dt.datetime.combine(date, dt.time())
+        rows.append(
+            {
+                "date": date,
+                "company_name": company,
+                "project": "project",
+                "run_id": f"{company}-{date}",
+                "tags": "",
+                "created_at": start,
+                "updated_at": start + dt.timedelta(hours=24),
+                "state": "finished",
+                "duration_hour": 24.0,
+                "gpu_count": 8,
+                "average_gpu_utilization": 90.0,
+                "average_gpu_memory": 50.0,
+                "max_gpu_utilization": 100.0,
+                "max_gpu_memory": 60.0,
+                "host_name": f"{company}-host",
+                "logged_at": start,
+                "gpu_utilization_sketch": None,
+                "active_hour": 24.0,
+            }
+        )
+    return rows
+
+@pytest.fixture
+def daily_table(monkeypatch, tmp_path):
+    companies = [
+        {
+            "company": company,
+            "teams": [company],
+            "schedule": [
+                {"date": "2025-03-20", "assigned_gpu_node": 1},
+                {"date": "2025-04-30", "assigned_gpu_node": 0},
+            ],
+        }
+        for company in ("gap-geniac", "busy-geniac")
+    ]
+    monkeypatch.setattr(CONFIG, "companies", EasyDict({"companies": companies}).companies)
+    monkeypatch.setattr(CONFIG, "cache_dir", str(tmp_path))
+    days = [dt.date(2025, 3, 20) + dt.timedelta(days=i) for i in range(12)]
+    # gap-geniacは最後の4日間runがない
+    rows = make_runs("gap-geniac", days[:-4]) + make_runs("busy-geniac", days)
+    all_runs_df = pl.DataFrame(rows, schema=DATASET_SCHEMA)
+    calculator = GPUUsageCalculator(all_runs_df, [END_DATE.strftime("%Y-%m-%d")] * 2)
+    return calculator.agg_daily()
+
+def test_gap_day_has_no_runs(daily_table):
+    gap_day = daily_table.filter((pl.col("企業名") == "gap-geniac") & (pl.col("日付") == "2025-03-31"))
+    assert gap_day.item(0, "n_runs") == 0
+    busy_day = daily_table.filter((pl.col("企業名") == "busy-geniac") & (pl.col("日付") == "2025-03-31"))
+    assert busy_day.item(0, "n_runs") == 1
+
+def test_no_data_rule_fires_on_gap_days(daily_table):
+    firing = evaluate_rules(daily_table, RULES, END_DATE)
+    assert sorted(zip(firing["rule"], firing["company"])) == [
+        ("low_utilization", "gap-geniac"),
+        ("no_data", "gap-geniac"),
+    ]
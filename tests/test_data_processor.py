@@ -0,0 +1,82 @@
+import datetime as dt
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from src.uploader.data_processor import DATASET_KEYS, DATASET_SCHEMA, OPTIONAL_COLS, DataProcessor
+
+FETCHED_AT = dt.datetime(2025, 3, 31, 23)
+
+def make_rows(run_ids: list, logged_at: dt.datetime, duration_hour: float) -> pl.DataFrame:
+    """2日分のrunの行を作る（duration_hourで新旧どちらの行が残ったかを見分ける）"""
+    rows = []
+    for run_id in run_ids:
+        for date in (dt.date(2025, 3, 30), dt.date(2025, 3, 31)):
+            start = dt.datetime.combine(date, dt.time())
+            rows.append(
+                {
+                    "date": date,
+                    "company_name": "geniac",
+                    "project": "project",
+                    "run_id": run_id,
+                    "tags": "[]",
+                    "created_at": start,
+                    "updated_at": start + dt.timedelta(hours=12),
+                    "state": "finished",
+                    "duration_hour": duration_hour,
+                    "gpu_count": 8,
+                    "average_gpu_utilization": 90.0,
+                    "average_gpu_memory": 50.0,
+                    "max_gpu_utilization": 100.0,
+                    "max_gpu_memory": 60.0,
+                    "host_name": "host",
+                    "logged_at": logged_at,
+                    "gpu_utilization_sketch": None,
+                    "active_hour": duration_hour,
+                }
+            )
+    return pl.DataFrame(rows, schema=DATASET_SCHEMA)
+
+def combine(tmp_path, new_runs_df: pl.DataFrame, old_runs_df: pl.DataFrame) -> pl.DataFrame:
+    new_runs_path = tmp_path / "new_runs.parquet"
+    old_runs_csv_path = tmp_path / "old_runs.csv"
+    output_path = tmp_path / "all_runs.parquet"
+    new_runs_df.write_parquet(new_runs_path)
+    old_runs_df.write_csv(old_runs_csv_path)
+    DataProcessor.combine_files(new_runs_path, old_runs_csv_path, output_path)
+    return pl.read_parquet(output_path).sort(DATASET_KEYS)
+
+def test_combine_files_matches_combine_frames(tmp_path):
+    # run-bは新旧の両方にあり新しい方が残る。run-cは新しく取得した方のlogged_atが古い
+    old_runs_df = pl.concat(
+        [
+            make_rows(["run-a", "run-b"], FETCHED_AT - dt.timedelta(days=1), 1.0),
+            make_rows(["run-c"], FETCHED_AT, 1.0),
+        ]
+    )
+    new_runs_df = pl.concat(
+        [
+            make_rows(["run-b", "run-d"], FETCHED_AT, 2.0),
+            make_rows(["run-c"], FETCHED_AT - dt.timedelta(days=1), 2.0),
+        ]
+    )
+    # 導入前の列がない古いcsvも読めること
+    old_runs_df = old_runs_df.drop(list(OPTIONAL_COLS))
+
+    expected = DataProcessor.combine_frames([new_runs_df, old_runs_df]).sort(DATASET_KEYS)
+    actual = combine(tmp_path, new_runs_df, old_runs_df)
+
+    assert_frame_equal(actual, expected)
+    assert dict(zip(actual["run_id"], actual["duration_hour"])) == {"run-a": 1.0, "run-b": 2.0, "run-c": 1.0, "run-d": 2.0}
+
+def test_combine_files_prefers_new_runs_on_same_logged_at(tmp_path):
+    actual = combine(tmp_path, make_rows(["run-a"], FETCHED_AT, 2.0), make_rows(["run-a"], FETCHED_AT, 1.0))
+    assert actual["duration_hour"].to_list() == [2.0, 2.0]
+
+def test_write_parquet_round_trips_empty_frame(tmp_path):
+    # runがなかったときの列のないDataFrameも読み込めるparquetになること
+    path = tmp_path / "empty.parquet"
+    DataProcessor.write_parquet(pl.DataFrame(), path)
+    empty_df = pl.read_parquet(path)
+    assert empty_df.is_empty()
+    assert empty_df.schema == DATASET_SCHEMA
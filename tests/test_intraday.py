@@ -0,0 +1,22 @@
+import datetime as dt
+import json
+
+from easydict import EasyDict
+
+from src.tracker.intraday import tail_samples
+
+HEARTBEAT_AT = "2025-03-31T03:00:00Z"
+
+def make_node(events_tail, system_metrics) -> EasyDict:
+    return EasyDict({"heartbeatAt": HEARTBEAT_AT, "eventsTail": events_tail, "systemMetrics": system_metrics})
+
+def test_tail_samples_deduplicates_latest_metrics():
+    # systemMetricsはeventsTailの最後の行と同じサンプルになる
+    lines = [json.dumps({"_timestamp": 100.0 + i, "system.gpu.0.gpu": 50.0}) for i in range(3)]
+    samples = tail_samples(make_node(json.dumps(lines), lines[-1]))
+    assert [sample["_timestamp"] for sample in samples] == [100.0, 101.0, 102.0]
+
+def test_tail_samples_stamps_heartbeat_without_timestamp():
+    samples = tail_samples(make_node(None, json.dumps({"system.gpu.0.gpu": 80.0})))
+    heartbeat = dt.datetime(2025, 3, 31, 3, tzinfo=dt.timezone.utc).timestamp()
+    assert samples == [{"system.gpu.0.gpu": 80.0, "_timestamp": heartbeat}]